@@ -0,0 +1,128 @@
+"""
+ICD mapping benchmark: precision / recall vs per-name latency for trigram matching,
+embedding retrieval and trigram matching with the embedding fallback.
+
+The evaluation set is a TSV of `name<TAB>expected code` (--file) or the built-in
+lay-term and misspelling samples below:
+
+    python benchmarks/bench_icd.py
+    python benchmarks/bench_icd.py --file eval.tsv --min-similarity 0.7
+"""
+import argparse
+import csv
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import percentile  # noqa: E402
+from ml.icd_index import get_icd_index  # noqa: E402
+
+# Names as they come out of NER: paraphrases, lay terms, misspellings, abbreviations
+SAMPLE_NAMES = [
+    ("raised blood pressure", "I10"),
+    ("elevated blood pressure", "I10"),
+    ("hypertensive disorder", "I10"),
+    ("diabetes type 2", "E11"),
+    ("sugar diabetes", "E11"),
+    ("diabetis mellitus", "E11"),
+    ("insulin dependent diabetes", "E10.9"),
+    ("heart attack", "I21.9"),
+    ("myocardial infarct", "I21.9"),
+    ("cardiac failure", "I50.9"),
+    ("congestive cardiac failure", "I50.9"),
+    ("irregular heartbeat", "I49.9"),
+    ("brain attack", "I63.9"),
+    ("cerebrovascular accident", "I63.9"),
+    ("kidney failure", "N17.9"),
+    ("renal insufficiency chronic", "N18.9"),
+    ("chronic kidney failure", "N18.9"),
+    ("lung infection", "J18.9"),
+    ("pnuemonia", "J18.9"),
+    ("wheezing asthma", "J45"),
+    ("emphysema lungs", "J44.9"),
+    ("underactive thyroid gland", "E03.9"),
+    ("overactive thyroid", "E05.90"),
+    ("low hemoglobin", "D64.9"),
+    ("anaemic", "D64.9"),
+    ("high cholesterol levels", "E78.5"),
+    ("raised lipids", "E78.5"),
+    ("fatty liver disease", "K76.0"),
+    ("liver scarring", "K74.60"),
+    ("heartburn reflux", "K21.9"),
+    ("stomach ulcer", "K25.9"),
+    ("bladder infection", "N39.0"),
+    ("kidney stone", "N20.0"),
+    ("feeling tired", "R53.83"),
+    ("short of breath", "R06.02"),
+    ("breathing difficulty", "R06.00"),
+    ("head ache", "R51"),
+    ("high temperature", "R50.9"),
+    ("blood clot in leg", "I82.409"),
+    ("low mood depression", "F32.9"),
+    ("joint wear and tear", "M19.90"),
+    ("brittle bones", "M81.0"),
+    ("coronary heart disease", "I25.10"),
+    ("atrial fib", "I48.91"),
+    ("covid infection", "U07.1"),
+]
+
+
+def load_samples(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(row[0], row[1]) for row in csv.reader(f, delimiter="\t") if len(row) >= 2 and row[0]]
+
+
+def evaluate(label, lookup_one, samples):
+    latencies, correct, predicted = [], 0, 0
+    for name, expected in samples:
+        started = time.perf_counter()
+        code = lookup_one(name)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if code is not None:
+            predicted += 1
+            correct += code == expected
+    precision = correct / predicted if predicted else 0.0
+    print(f"{label:20s} precision={precision:.2f} recall={correct / len(samples):.2f} "
+          f"mapped={predicted}/{len(samples)} mean_ms={statistics.mean(latencies):.2f} "
+          f"p95_ms={percentile(latencies, 95):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", help="TSV of name and expected ICD code")
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--min-similarity", type=float, default=None)
+    parser.add_argument("--margin", type=float, default=None, help="Embedding ambiguity margin")
+    args = parser.parse_args()
+
+    samples = load_samples(args.file) if args.file else SAMPLE_NAMES
+    started = time.perf_counter()
+    index = get_icd_index()
+    print(f"terms={len(index)} samples={len(samples)} index_build_ms={(time.perf_counter() - started) * 1000:.0f}")
+    evaluate("trigram", index.lookup, samples)
+
+    from sentence_transformers import SentenceTransformer
+    from ml.icd_embeddings import IcdEmbeddingIndex
+
+    started = time.perf_counter()
+    embeddings = IcdEmbeddingIndex(index, SentenceTransformer(args.model), args.model)
+    if args.min_similarity is not None:
+        embeddings.min_similarity = args.min_similarity
+    if args.margin is not None:
+        embeddings.margin = args.margin
+    print(f"embedding_index_ms={(time.perf_counter() - started) * 1000:.0f} "
+          f"min_similarity={embeddings.min_similarity} margin={embeddings.margin}")
+    evaluate("embedding", lambda n: embeddings.lookup_many([n])[0], samples)
+    evaluate("trigram+embedding", lambda n: index.lookup(n) or embeddings.lookup_many([n])[0], samples)
+
+    names = [n for n, _ in samples]
+    started = time.perf_counter()
+    embeddings.lookup_many(names)
+    print(f"embedding batch of {len(names)}: {(time.perf_counter() - started) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
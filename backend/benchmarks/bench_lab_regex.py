@@ -0,0 +1,217 @@
+"""
+Micro-benchmark of the regex lab extractor: legacy two-pass scan vs ml/lab_regex.py,
+and regex alternation vs the Aho-Corasick name matcher as the vocabulary grows.
+
+The corpus is the stored `extracted_text` of patient records, a directory of
+.txt files, or (by default) 50 synthetic reports generated from the lab KB with a
+fixed seed, each mixing prose, "name: value unit" lines, table-style rows and
+non-lab "label: number" lines:
+
+    python benchmarks/bench_lab_regex.py
+    python benchmarks/bench_lab_regex.py --synthetic 200 --seed 7
+    python benchmarks/bench_lab_regex.py --mongo --limit 500
+    python benchmarks/bench_lab_regex.py --dir ./reports --repeat 20
+    python benchmarks/bench_lab_regex.py --vocab 5000
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.load_test import SAMPLE_REPORTS, percentile  # noqa: E402
+from ml import lab_regex  # noqa: E402
+from ml.lab_kb import get_lab_kb  # noqa: E402
+from ml.lab_matcher import LabNameMatcher  # noqa: E402
+
+_LEGACY_UNITS = lab_regex.LAB_UNIT_PATTERN
+LEGACY_KNOWN_NAMES = (
+    r"Glucose|WBC|RBC|Hemoglobin|HGB|Hematocrit|HCT|Platelet|Creatinine|BUN|ALT|AST|Cholesterol|Triglyceride|"
+    r"Albumin|Bilirubin|Sodium|Potassium|Calcium|Phosphorus|Magnesium|TSH|T4|T3|HbA1c|HbA|LDL|HDL|CRP|ESR|PT|"
+    r"INR|APTT|PSA|Vitamin\s+D|Vitamin\s+B12|Folate|Iron|Ferritin|Uric\s+Acid|Alkaline\s+Phosphatase|ALP|GGT|"
+    r"LDH|CK|Troponin|BNP|NT-proBNP|D-dimer|Fibrinogen|Protein|Globulin|A/G\s+Ratio|Bicarbonate|CO2|Chloride|"
+    r"Anion\s+Gap|Osmolality|Urea|eGFR|GFR|Microalbumin|Urine\s+Protein|Urine\s+Glucose"
+)
+LEGACY_PATTERN1 = (r"([A-Za-z][A-Za-z0-9\s/&-]{2,30}?)\s*[:=]\s*([\d.,]+)\s*(" + _LEGACY_UNITS + r")?")
+LEGACY_PATTERN2 = (r"\b(" + LEGACY_KNOWN_NAMES + r")\s*[:=]?\s*([\d.,]+)\s*(" + _LEGACY_UNITS + r")?")
+
+
+def legacy_is_valid(lab_name, value, kb):
+    """The per-candidate validation as it was: one re.match per false-positive pattern"""
+    if not lab_name:
+        return False
+    lab_lower = lab_name.lower().strip()
+    for pattern in lab_regex.FALSE_POSITIVE_PATTERNS:
+        if re.match(pattern, lab_lower, re.IGNORECASE):
+            return False
+    if not value:
+        return False
+    try:
+        float(value)
+    except (ValueError, TypeError):
+        return False
+    if kb.is_known(lab_lower):
+        return True
+    if any(keyword in lab_lower for keyword in lab_regex.LAB_KEYWORDS):
+        return True
+    if len(lab_name) < 3 or len(lab_name) > 50:
+        return False
+    return lab_lower not in lab_regex.EXCLUDED_WORDS
+
+
+def legacy_extract(text, kb):
+    """Two full scans with uncompiled pattern strings"""
+    labs, seen = [], set()
+    for pattern in (LEGACY_PATTERN1, LEGACY_PATTERN2):
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            name, value = match.group(1).strip(), match.group(2).strip()
+            if legacy_is_valid(name, value, kb):
+                key = f"{name.lower()}:{value}"
+                if key not in seen:
+                    seen.add(key)
+                    labs.append((name, value))
+    return labs
+
+
+_PROSE = [
+    "Patient seen in clinic for routine follow-up.",
+    "History of hypertension and type 2 diabetes mellitus, on metformin.",
+    "No chest pain, shortness of breath or fever reported.",
+    "Findings discussed with the patient; repeat labs advised in 3 months.",
+    "Specimen collected fasting. Results reviewed by the attending physician.",
+]
+_NON_LAB_LINES = ["Age: {n} years", "Room: {n}", "Blood pressure: {n}/80 mmHg", "Pulse: {n} bpm",
+                  "Report ID: {n}", "Page {n} of 3", "Weight: {n} kg"]
+
+
+def synthetic_reports(kb, count, seed=0):
+    """`count` reproducible lab reports built from KB tests, names drawn from names and synonyms"""
+    rng = random.Random(seed)
+    tests = [t for t in kb.tests if t.low is not None or t.high is not None] or kb.tests
+    reports = []
+    for _ in range(count):
+        lines = rng.sample(_PROSE, 2)
+        for test in rng.sample(tests, min(len(tests), rng.randint(6, 20))):
+            name = rng.choice((test.name,) + test.synonyms)
+            low = test.low if test.low is not None else 0.0
+            high = test.high if test.high is not None else low * 2 + 10
+            value = round(rng.uniform(low * 0.7, high * 1.3), rng.choice((0, 1, 2)))
+            unit = test.unit or ""
+            style = rng.random()
+            if style < 0.5:
+                lines.append(f"{name}: {value} {unit}".rstrip())
+            elif style < 0.8:
+                lines.append(f"{name}   {value}   {unit}   {test.normal_range or ''}".rstrip())
+            else:
+                lines.append(f"{name} was {value} {unit} on repeat testing.")
+        for template in rng.sample(_NON_LAB_LINES, 3):
+            lines.insert(rng.randrange(len(lines) + 1), template.format(n=rng.randint(2, 120)))
+        reports.append("\n".join(lines))
+    return reports
+
+
+def load_corpus(args, kb):
+    if args.mongo:
+        from pymongo import MongoClient
+        uri = os.getenv("MONGO_DB_URI")
+        if not uri:
+            sys.exit("MONGO_DB_URI is not set")
+        records = MongoClient(uri, serverSelectionTimeoutMS=5000)["medical_rag_db"]["patient_records"]
+        cursor = records.find({"extracted_text": {"$ne": ""}}, {"extracted_text": 1}).limit(args.limit)
+        return [r["extracted_text"] for r in cursor if r.get("extracted_text")]
+    if args.dir:
+        texts = []
+        for path in sorted(glob.glob(os.path.join(args.dir, "*.txt")))[:args.limit]:
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                texts.append(f.read())
+        return texts
+    if args.synthetic:
+        return synthetic_reports(kb, args.synthetic, args.seed)
+    return list(SAMPLE_REPORTS)
+
+
+def time_per_doc(extract, corpus, kb, repeat):
+    timings = []
+    for text in corpus:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            extract(text, kb)
+        timings.append((time.perf_counter() - started) * 1000 / repeat)
+    return timings
+
+
+def synthetic_vocabulary(kb, size):
+    """KB aliases padded with made-up multi-word test names up to `size` entries"""
+    names = list(kb.aliases())
+    stems = ["serum", "plasma", "urine", "total", "free", "ionized", "fasting", "random"]
+    i = 0
+    while len(names) < size:
+        names.append(f"{stems[i % len(stems)]} analyte{i} level")
+        i += 1
+    return names
+
+
+def bench_vocabulary(corpus, kb, size, repeat):
+    """Time locating every name occurrence: one regex alternation vs the automaton"""
+    names = synthetic_vocabulary(kb, size)
+    started = time.perf_counter()
+    alternation = re.compile(r"\b(?:" + "|".join(
+        re.escape(n).replace(r"\ ", r"\s+") for n in sorted(names, key=len, reverse=True)) + r")\b", re.IGNORECASE)
+    compile_ms = (time.perf_counter() - started) * 1000
+    started = time.perf_counter()
+    matcher = LabNameMatcher(names)
+    build_ms = (time.perf_counter() - started) * 1000
+    print(f"vocabulary={len(names)} regex_compile_ms={compile_ms:.1f} automaton_build_ms={build_ms:.1f}")
+    for label, find in (("alternation", lambda t: alternation.findall(t)), ("automaton", matcher.find_all)):
+        timings = []
+        for text in corpus:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                find(text)
+            timings.append((time.perf_counter() - started) * 1000 / repeat)
+        print(f"{label:12s} mean_ms={statistics.mean(timings):.3f} p95_ms={percentile(timings, 95):.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", action="store_true", help="read extracted_text from MONGO_DB_URI")
+    parser.add_argument("--dir", help="directory of .txt reports")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--synthetic", type=int, default=50,
+                        help="number of generated reports when neither --mongo nor --dir is given (0 = built-in samples)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--vocab", type=int, default=0, help="also time name lookup with this many names")
+    args = parser.parse_args()
+
+    kb = get_lab_kb()
+    corpus = load_corpus(args, kb)
+    if not corpus:
+        sys.exit("empty corpus")
+    print(f"documents={len(corpus)} chars={sum(len(t) for t in corpus)} repeat={args.repeat}")
+
+    results = {}
+    for label, extract in (("legacy", legacy_extract), ("current", lab_regex.extract_lab_matches)):
+        timings = time_per_doc(extract, corpus, kb, args.repeat)
+        results[label] = sum(len(extract(t, kb)) for t in corpus)
+        print(f"{label:12s} total_ms={sum(timings):.1f} mean_ms={statistics.mean(timings):.3f} "
+              f"p50_ms={percentile(timings, 50):.3f} p95_ms={percentile(timings, 95):.3f} matches={results[label]}")
+
+    same = 0
+    for text in corpus:
+        old = {(n.lower(), v) for n, v in legacy_extract(text, kb)}
+        new = {(m.name.lower(), m.value) for m in lab_regex.extract_lab_matches(text, kb)}
+        same += old == new
+    print(f"documents with identical (name, value) sets: {same}/{len(corpus)}")
+
+    if args.vocab:
+        bench_vocabulary(corpus, kb, args.vocab, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
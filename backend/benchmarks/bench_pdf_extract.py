@@ -0,0 +1,76 @@
+"""
+PDF text extraction benchmark over a directory of sample PDFs: the legacy
+sequential `text +=` loop vs utils.extract_pdf_pages with 1..N worker processes.
+
+    python benchmarks/bench_pdf_extract.py --dir ./sample_pdfs
+    python benchmarks/bench_pdf_extract.py --dir ./sample_pdfs --workers 1 2 4 8 --repeat 3
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pdfplumber  # noqa: E402
+
+import utils  # noqa: E402
+
+
+def legacy_extract(path):
+    """The extractor as it was (with the None page fix so it does not crash)"""
+    text = ""
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages:
+            text += (page.extract_text() or "") + "\n"
+    return text
+
+
+def timed(fn, paths, repeat):
+    """(best total seconds over `repeat` runs, texts of the last run)"""
+    best, texts = None, []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        texts = [fn(path) for path in paths]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, texts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", required=True, help="Directory of .pdf files")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-pages", type=int, default=0, help="Page limit per document (0 = all)")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.dir, "*.pdf")))
+    if not paths:
+        parser.error(f"no .pdf files in {args.dir}")
+    page_counts = []
+    for path in paths:
+        with pdfplumber.open(path) as pdf:
+            page_counts.append(len(pdf.pages))
+    pages = sum(page_counts)
+    print(f"{len(paths)} PDFs, {pages} pages (median {statistics.median(page_counts):.0f}, max {max(page_counts)}), "
+          f"parallel from {utils.PDF_PARALLEL_MIN_PAGES} pages")
+
+    legacy_s, expected = timed(legacy_extract, paths, args.repeat)
+    print(f"{'legacy':12s} {legacy_s:8.2f} s {pages / legacy_s:8.1f} pages/s")
+    for workers in args.workers:
+        if workers > 1:
+            # Start the pool outside the timed runs
+            utils._pdf_pool(workers).submit(time.sleep, 0).result()
+        elapsed, texts = timed(
+            lambda p: utils.extract_pdf_pages(p, max_pages=args.max_pages, timeout=0, workers=workers).text,
+            paths, args.repeat)
+        same = sum(a == b for a, b in zip(texts, expected)) if not args.max_pages else "-"
+        print(f"workers={workers:<4d} {elapsed:8.2f} s {pages / elapsed:8.1f} pages/s "
+              f"speedup={legacy_s / elapsed:5.2f}x same_text={same}/{len(paths)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+End-to-end load test for the predict endpoints.
+
+Run the API with the stub LLM provider so no Gemini key or network is needed:
+
+    LLM_PROVIDER=stub LLM_STUB_LATENCY_MS=800 LLM_STUB_FAILURE_RATE=0.02 uvicorn main:app
+    python benchmarks/load_test.py --url http://localhost:8000 --requests 200 --concurrency 16
+"""
+import argparse
+import json
+import math
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+SAMPLE_REPORTS = [
+    "Patient with type 2 diabetes mellitus and hypertension.\n"
+    "Glucose: 182 mg/dL\nHbA1c: 8.1 %\nCreatinine: 1.4 mg/dL\nCholesterol: 236 mg/dL",
+    "History of asthma and chronic kidney disease.\n"
+    "Hemoglobin 10.9 g/dL (12-16)\nWBC 11.2 10^3/uL\nPlatelets 310 10^3/uL\nBUN 28 mg/dL",
+    "Follow-up for fatty liver disease.\nALT: 88 U/L\nAST: 61 U/L\nTriglycerides: 240 mg/dL",
+]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def send(url, i, timeout):
+    payload = json.dumps({"text": SAMPLE_REPORTS[i % len(SAMPLE_REPORTS)], "icd_map": False}).encode("utf-8")
+    req = urllib.request.Request(url, data=payload, headers={"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, (time.perf_counter() - started) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--endpoint", default="/predict")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + args.endpoint
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(lambda i: send(url, i, args.timeout), range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [ms for ok, ms in results if ok]
+    errors = sum(1 for ok, _ in results if not ok)
+    print(f"requests={args.requests} concurrency={args.concurrency} errors={errors}")
+    print(f"throughput={len(latencies) / elapsed:.2f} req/s over {elapsed:.1f}s")
+    if latencies:
+        print(
+            f"latency_ms mean={statistics.mean(latencies):.0f} "
+            f"p50={percentile(latencies, 50):.0f} p90={percentile(latencies, 90):.0f} "
+            f"p95={percentile(latencies, 95):.0f} p99={percentile(latencies, 99):.0f} "
+            f"max={max(latencies):.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
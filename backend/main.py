@@ -90,6 +90,8 @@ try:
     # Add existing routes from rag.py
     app.add_api_route("/predict", rag.predict_combined_rag, methods=["POST"], tags=["ml"])
     app.add_api_route("/predict_pdf", rag.predict_combined_pdf, methods=["POST"], tags=["ml"])
+    app.add_api_route("/predict_stream", rag.predict_stream, methods=["POST"], tags=["ml"])
+    app.add_api_route("/predict_pdf_stream", rag.predict_pdf_stream, methods=["POST"], tags=["ml"])
     app.add_api_route("/predict_multiple_pdfs", rag.predict_multiple_pdfs, methods=["POST"], tags=["ml"])
     app.add_api_route("/predict_multiple_pdfs_summary", rag.predict_multiple_pdfs_consolidated, methods=["POST"], tags=["ml"])
     
@@ -109,6 +111,13 @@ try:
     app.add_api_route("/screening/high_risk", rag.get_high_risk_records, methods=["GET"], tags=["screening"])
     
     app.add_api_route("/doctor/dashboard", rag.doctor_dashboard, methods=["GET"], tags=["doctor"])
+
+    app.add_api_route("/summary_jobs/{job_id}", rag.get_summary_job, methods=["GET"], tags=["ml"])
+    app.add_api_route("/summary_jobs/{job_id}/events", rag.stream_summary_job, methods=["GET"], tags=["ml"])
+    app.add_api_route("/ml/stats", rag.get_ml_stats, methods=["GET"], tags=["ml"])
+
+    # 413 for oversized PDF uploads from Content-Length, before the body is read
+    app.middleware("http")(rag.limit_upload_size)
     
     print("✅ Loaded ML processing and existing routes from rag.py")
     
@@ -0,0 +1,3 @@
+"""
+ML processing package
+"""
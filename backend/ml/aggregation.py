@@ -0,0 +1,129 @@
+"""
+Cross-document aggregation of disease and lab entities for consolidated summaries
+"""
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ml.lab_kb import LabKnowledgeBase, normalize_lab_name
+
+_PUNCT_RE = re.compile(r"[^\w\s]")
+_WS_RE = re.compile(r"\s+")
+
+# (document number, entities of that document)
+DocumentEntities = Tuple[int, Sequence[Any]]
+
+
+def normalize_entity_name(name: str) -> str:
+    """Dedupe key for entity names: lower case, no punctuation, single spaces"""
+    return _WS_RE.sub(" ", _PUNCT_RE.sub(" ", (name or "").lower())).strip()
+
+
+def normalize_value(value: Optional[str]) -> str:
+    """Dedupe key for lab values: "7.20" and "7.2" are the same reading"""
+    value = (value or "").strip().replace(",", "")
+    try:
+        return format(float(value), "g")
+    except ValueError:
+        return value.lower()
+
+
+def _field(entity: Any, name: str) -> Any:
+    return entity.get(name) if isinstance(entity, dict) else getattr(entity, name, None)
+
+
+def aggregate_diseases(documents: Sequence[DocumentEntities]) -> List[Dict[str, Any]]:
+    """
+    One entry per distinct disease across documents:
+    {"name", "icd_code", "documents", "mentions", "confidence"}, most widespread first.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for doc_no, entities in documents:
+        for entity in entities:
+            name = (_field(entity, "text") or "").strip()
+            key = normalize_entity_name(name)
+            if not key:
+                continue
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {"name": name, "icd_code": None, "documents": [], "mentions": 0,
+                                       "confidence": 0.0}
+            entry["mentions"] += 1
+            entry["confidence"] = max(entry["confidence"], float(_field(entity, "confidence") or 0.0))
+            entry["icd_code"] = entry["icd_code"] or _field(entity, "icd_code")
+            if doc_no not in entry["documents"]:
+                entry["documents"].append(doc_no)
+    return sorted(merged.values(), key=lambda e: (-len(e["documents"]), -e["mentions"], e["name"].lower()))
+
+
+def aggregate_labs(documents: Sequence[DocumentEntities],
+                   lab_kb: Optional[LabKnowledgeBase] = None) -> List[Dict[str, Any]]:
+    """
+    One entry per distinct lab test (KB canonical name when known) with its distinct
+    readings: {"name", "normal_range", "documents", "values": [{"value", "unit", "documents"}]}.
+    Readings are deduplicated by normalized value and unit.
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for doc_no, entities in documents:
+        for entity in entities:
+            raw_name = (_field(entity, "text") or "").strip()
+            if not raw_name:
+                continue
+            canonical = lab_kb.canonical_name(raw_name) if lab_kb is not None else None
+            name = canonical or raw_name
+            key = normalize_lab_name(name)
+            entry = merged.get(key)
+            if entry is None:
+                entry = merged[key] = {"name": name, "normal_range": None, "documents": [], "values": [],
+                                       "_readings": {}}
+            entry["normal_range"] = entry["normal_range"] or _field(entity, "normal_range")
+            if doc_no not in entry["documents"]:
+                entry["documents"].append(doc_no)
+
+            value = (_field(entity, "value") or "").strip()
+            if not value:
+                continue
+            unit = (_field(entity, "unit") or "").strip()
+            reading_key = (normalize_value(value), unit.lower())
+            reading = entry["_readings"].get(reading_key)
+            if reading is None:
+                reading = entry["_readings"][reading_key] = {"value": value, "unit": unit, "documents": []}
+                entry["values"].append(reading)
+            if doc_no not in reading["documents"]:
+                reading["documents"].append(doc_no)
+
+    labs = []
+    for entry in merged.values():
+        entry.pop("_readings")
+        labs.append(entry)
+    return sorted(labs, key=lambda e: (-len(e["documents"]), e["name"].lower()))
+
+
+def _doc_refs(doc_nos: Sequence[int]) -> str:
+    return ("doc " if len(doc_nos) == 1 else "docs ") + ", ".join(str(n) for n in doc_nos)
+
+
+def format_aggregate(diseases: Sequence[Dict[str, Any]], labs: Sequence[Dict[str, Any]],
+                     max_diseases: int = 30, max_labs: int = 30, max_values: int = 4) -> str:
+    """Compact text block of aggregated findings for an LLM prompt"""
+    lines = ["Diagnoses:"]
+    for d in diseases[:max_diseases]:
+        code = f" [{d['icd_code']}]" if d.get("icd_code") else ""
+        lines.append(f"- {d['name']}{code} ({_doc_refs(d['documents'])})")
+    if len(diseases) > max_diseases:
+        lines.append(f"- ... {len(diseases) - max_diseases} more")
+    if not diseases:
+        lines.append("- None")
+
+    lines.append("Lab results:")
+    for l in labs[:max_labs]:
+        readings = [
+            f"{r['value']}{' ' + r['unit'] if r['unit'] else ''} ({_doc_refs(r['documents'])})"
+            for r in l["values"][-max_values:]
+        ]
+        normal = f"; normal {l['normal_range']}" if l.get("normal_range") else ""
+        lines.append(f"- {l['name']}: {', '.join(readings) or '-'}{normal}")
+    if len(labs) > max_labs:
+        lines.append(f"- ... {len(labs) - max_labs} more")
+    if not labs:
+        lines.append("- None")
+    return "\n".join(lines)
@@ -0,0 +1,98 @@
+"""
+Micro-batching: coalesce concurrent requests into one call
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple, Type
+
+
+class MicroBatcher:
+    """
+    Items submitted concurrently (e.g. by documents of one upload processed in
+    parallel) are collected into a batch that is flushed when it holds
+    `max_items` items or `max_cost` total cost, or `max_wait` seconds after its
+    first item arrived. `flush(items)` must return one result per item, in order;
+    if it raises, every submitter of that batch gets the exception.
+    """
+
+    def __init__(self, flush: Callable[[List[Any]], Awaitable[List[Any]]], max_items: int = 8,
+                 max_cost: float = 3000, max_wait: float = 0.05):
+        self.flush = flush
+        self.max_items = max_items
+        self.max_cost = max_cost
+        self.max_wait = max_wait
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._pending_cost = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any, cost: float = 1.0) -> Any:
+        loop = asyncio.get_running_loop()
+        if self._pending and (len(self._pending) >= self.max_items or self._pending_cost + cost > self.max_cost):
+            self._flush_now()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        self._pending_cost += cost
+        if len(self._pending) >= self.max_items or self._pending_cost >= self.max_cost:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush_now)
+        return await future
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._pending_cost = self._pending, [], 0.0
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = await self.flush([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"flush returned {len(results)} results for {len(batch)} items")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+async def split_keyed_batch(keys: Sequence[str], call: Callable[[], Awaitable[Dict[str, Any]]],
+                            fallback: Callable[[List[int]], Awaitable[List[Any]]],
+                            reraise: Tuple[Type[BaseException], ...] = ()) -> List[Any]:
+    """
+    One result per key from a single keyed call ({key: result}). Keys the answer
+    leaves out, or every key if the call fails with anything but `reraise`, get
+    `fallback(indices of those keys)`, which returns one result per index.
+    """
+    try:
+        by_key = await call()
+    except reraise:
+        raise
+    except Exception as e:
+        print(f"[batching] keyed batch call failed, falling back per item: {e!r}")
+        by_key = {}
+    results: List[Any] = [by_key.get(key) for key in keys]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        for i, result in zip(missing, await fallback(missing)):
+            results[i] = result
+    return results
@@ -0,0 +1,124 @@
+"""
+Circuit breaker for LLM calls, driven by rolling error rate and latency percentiles
+"""
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+LLM_BREAKER_WINDOW = int(os.getenv("LLM_BREAKER_WINDOW", "50"))
+LLM_BREAKER_MIN_CALLS = int(os.getenv("LLM_BREAKER_MIN_CALLS", "10"))
+LLM_BREAKER_ERROR_RATE = float(os.getenv("LLM_BREAKER_ERROR_RATE", "0.5"))
+LLM_BREAKER_P95_MS = float(os.getenv("LLM_BREAKER_P95_MS", "15000"))
+LLM_BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile, None for an empty list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+class CircuitBreaker:
+    """
+    Closed: calls flow, outcomes are recorded in a rolling window.
+    Open: calls are rejected until `cooldown` seconds have passed.
+    Half-open: a single probe call is allowed; success closes the circuit,
+    failure re-opens it. The circuit opens when, over at least `min_calls`
+    recent calls, the error rate or the p95 latency exceeds its threshold.
+    """
+
+    def __init__(self, window: int = LLM_BREAKER_WINDOW, min_calls: int = LLM_BREAKER_MIN_CALLS,
+                 error_rate_threshold: float = LLM_BREAKER_ERROR_RATE,
+                 p95_latency_threshold_ms: float = LLM_BREAKER_P95_MS,
+                 cooldown: float = LLM_BREAKER_COOLDOWN_S):
+        self.min_calls = min_calls
+        self.error_rate_threshold = error_rate_threshold
+        self.p95_latency_threshold_ms = p95_latency_threshold_ms
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)  # (ok, latency_ms)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Whether a call may proceed now (claims the probe slot when half-open)"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self, latency_ms: float):
+        with self._lock:
+            self._outcomes.append((True, latency_ms))
+            if self.state == HALF_OPEN:
+                self._close()
+            else:
+                self._evaluate()
+
+    def record_failure(self, latency_ms: float):
+        with self._lock:
+            self._outcomes.append((False, latency_ms))
+            if self.state == HALF_OPEN:
+                self._open()
+            else:
+                self._evaluate()
+
+    def release_probe(self):
+        """Give back a half-open probe slot whose call was abandoned without an outcome"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _evaluate(self):
+        if self.state != CLOSED or len(self._outcomes) < self.min_calls:
+            return
+        errors = sum(1 for ok, _ in self._outcomes if not ok)
+        p95 = percentile([ms for _, ms in self._outcomes], 95)
+        if errors / len(self._outcomes) >= self.error_rate_threshold or p95 >= self.p95_latency_threshold_ms:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.times_opened += 1
+
+    def _close(self):
+        self.state = CLOSED
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._outcomes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = [ms for _, ms in self._outcomes]
+            errors = sum(1 for ok, _ in self._outcomes if not ok)
+            return {
+                "state": self.state,
+                "window_calls": len(self._outcomes),
+                "error_rate": round(errors / len(self._outcomes), 4) if self._outcomes else 0.0,
+                "p50_ms": percentile(latencies, 50),
+                "p95_ms": percentile(latencies, 95),
+                "p99_ms": percentile(latencies, 99),
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+            }
@@ -0,0 +1,117 @@
+"""
+Embedding retrieval over ICD terms: the fallback stage for names string matching cannot map
+"""
+import hashlib
+import os
+from typing import List, NamedTuple, Optional, Sequence
+
+from ml.icd_index import IcdIndex
+from ml.lab_kb import EMBEDDING_CACHE_DIR
+
+# Cosine similarity a retrieved term needs to be accepted
+ICD_EMBED_MIN_SIMILARITY = float(os.getenv("ICD_EMBED_MIN_SIMILARITY", "0.75"))
+# The nearest code is not used when another code's term is within this cosine similarity of it
+ICD_EMBED_AMBIGUITY_MARGIN = float(os.getenv("ICD_EMBED_AMBIGUITY_MARGIN", "0.03"))
+# Nearest terms retrieved per name to find the runner-up code (a code can have several terms)
+ICD_EMBED_CANDIDATES = 5
+ICD_EMBED_BATCH_SIZE = int(os.getenv("ICD_EMBED_BATCH_SIZE", "256"))
+
+
+class IcdHit(NamedTuple):
+    code: str
+    term: str
+    similarity: float
+
+
+def choose_code(hits: Sequence[IcdHit], min_similarity: float, margin: float) -> Optional[str]:
+    """
+    Code of the nearest term, None below `min_similarity` or when the nearest term
+    of another code is within `margin` (a family name such as "cancer", or a near-tie)
+    """
+    if not hits or hits[0].similarity < min_similarity:
+        return None
+    runner_up = next((hit for hit in hits[1:] if hit.code != hits[0].code), None)
+    if runner_up is not None and hits[0].similarity - runner_up.similarity < margin:
+        return None
+    return hits[0].code
+
+
+class IcdEmbeddingIndex:
+    """
+    Every ICD term (description or synonym) embedded with the sentence embedding
+    model in a FAISS inner-product index over normalized vectors (cosine similarity).
+    The index is written to disk keyed by model name and dictionary content, so
+    only the first start after a dictionary change encodes the terms. Over a
+    memory-mapped ICD store the key comes from the store file, and the index file
+    is mapped read-only, so workers share its pages.
+    """
+
+    def __init__(self, icd_index: IcdIndex, embed_model, model_name: str = "default",
+                 min_similarity: float = ICD_EMBED_MIN_SIMILARITY, batch_size: int = ICD_EMBED_BATCH_SIZE,
+                 margin: float = ICD_EMBED_AMBIGUITY_MARGIN):
+        self.icd_index = icd_index
+        self.embed_model = embed_model
+        self.min_similarity = min_similarity
+        self.margin = margin
+        self.batch_size = batch_size
+        self.queries = 0
+        self.mapped = 0
+        self.faiss_index = self._load_or_build(model_name)
+
+    def _encode(self, texts: Sequence[str]):
+        return self.embed_model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                       normalize_embeddings=True).astype("float32")
+
+    def _load_or_build(self, model_name: str):
+        import faiss
+
+        # A MappedIcdIndex identifies its file without decoding every term
+        store_fingerprint = getattr(self.icd_index, "fingerprint", None)
+        if store_fingerprint is not None:
+            content = f"{model_name}\n{store_fingerprint}"
+        else:
+            content = "\n".join(
+                [model_name] + [f"{c}\t{t}" for c, t in zip(self.icd_index.term_codes, self.icd_index.terms)])
+        fingerprint = hashlib.sha1(content.encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(EMBEDDING_CACHE_DIR, f"icd_{fingerprint}.faiss")
+        if os.path.exists(path):
+            try:
+                return faiss.read_index(path, faiss.IO_FLAG_MMAP)
+            except Exception as e:
+                print(f"⚠️ Could not read ICD embedding index: {e}")
+
+        vectors = self._encode(self.icd_index.terms)
+        faiss_index = faiss.IndexFlatIP(vectors.shape[1])
+        faiss_index.add(vectors)
+        try:
+            # Written aside and renamed, so a worker starting meanwhile never maps a partial file
+            os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            faiss.write_index(faiss_index, tmp_path)
+            os.replace(tmp_path, path)
+        except (OSError, RuntimeError) as e:
+            print(f"⚠️ Could not write ICD embedding index: {e}")
+        return faiss_index
+
+    def search_many(self, names: Sequence[str], k: int = 1) -> List[List[IcdHit]]:
+        """Top `k` terms for each name; all names are encoded in one batch"""
+        if not names:
+            return []
+        similarities, ids = self.faiss_index.search(self._encode(names), k)
+        return [
+            [IcdHit(self.icd_index.term_codes[i], self.icd_index.terms[i], float(s))
+             for s, i in zip(row_s, row_i) if i >= 0]
+            for row_s, row_i in zip(similarities, ids)
+        ]
+
+    def lookup_many(self, names: Sequence[str]) -> List[Optional[str]]:
+        """Code of the nearest term per name, see choose_code()"""
+        codes = [choose_code(hits, self.min_similarity, self.margin)
+                 for hits in self.search_many(names, k=ICD_EMBED_CANDIDATES)]
+        self.queries += len(names)
+        self.mapped += sum(1 for c in codes if c is not None)
+        return codes
+
+    def stats(self):
+        return {"terms": self.faiss_index.ntotal, "queries": self.queries, "mapped": self.mapped,
+                "min_similarity": self.min_similarity, "margin": self.margin}
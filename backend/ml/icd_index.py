@@ -0,0 +1,297 @@
+"""
+ICD-10 normalization: exact-match map plus a character trigram index with top-k scoring
+"""
+import csv
+import os
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from ml.lab_kb import DATA_DIR
+from ml.lru import LRUCache
+
+DEFAULT_ICD_PATH = os.path.join(DATA_DIR, "icd10_codes.tsv")
+# Matches scoring at or below this (0-100) are not mapped
+ICD_MIN_SCORE = float(os.getenv("ICD_MIN_SCORE", "80"))
+# Trigram candidates re-scored per query
+ICD_CANDIDATES = int(os.getenv("ICD_CANDIDATES", "50"))
+# Trigrams found in more than this share of entries are skipped when rarer ones exist
+ICD_MAX_TRIGRAM_SHARE = 0.05
+# A fuzzy best match is not mapped when the runner-up code scores within this many points of it
+ICD_AMBIGUITY_MARGIN = float(os.getenv("ICD_AMBIGUITY_MARGIN", "5"))
+# Distinct disease names whose mapping is memoized per process
+ICD_CACHE_SIZE = int(os.getenv("ICD_CACHE_SIZE", "20000"))
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+# The rest of a term after a negation ("... without heart failure") names what the code excludes
+_NEGATED_RE = re.compile(r"\b(?:without|no|not)\b.*")
+# Words that say nothing about which condition is meant; they do not count for word containment
+GENERIC_WORDS = frozenset({
+    "disease", "disorder", "syndrome", "condition", "unspecified", "acute", "chronic", "of", "the",
+    "and", "with", "without", "other", "type", "stage", "history",
+})
+
+
+class IcdMatch(NamedTuple):
+    code: str
+    description: str  # the description or synonym that matched
+    score: float  # 0-100
+
+
+def normalize_term(text: str) -> str:
+    """Lower case, punctuation to spaces, single spaces"""
+    return _NON_ALNUM_RE.sub(" ", (text or "").lower()).strip()
+
+
+def trigrams(term: str) -> List[str]:
+    padded = f" {term} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def similarity(query: str, term: str) -> float:
+    """
+    0-100 score between normalized strings: the better of whole-string similarity
+    and word containment of the query in the term (scaled down like a partial match).
+    Words the term negates do not count, and a query of one distinctive word
+    found in a longer term ("cancer" in "lung cancer") names a family of codes,
+    so it scores below ICD_MIN_SCORE.
+    """
+    ratio = SequenceMatcher(None, query, term).ratio()
+    q_words, t_words = set(query.split()) - GENERIC_WORDS, set(_NEGATED_RE.sub("", term).split())
+    if not q_words or not t_words:
+        return ratio * 100
+    containment = len(q_words & t_words) / len(q_words)
+    if len(q_words) == 1 and containment:
+        return 75.0
+    scale = 0.9 if len(term) <= 8 * len(query) else 0.6
+    return max(ratio, containment * scale) * 100
+
+
+class IcdIndex:
+    """
+    Terms (descriptions and synonyms) are kept once each. Lookups try the exact
+    normalized term first, then gather candidates from a trigram inverted index
+    (weighted by trigram rarity) and re-score only the best ICD_CANDIDATES of them.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, Iterable[str]]]):
+        self.terms: List[str] = []
+        self.term_codes: List[str] = []
+        self.descriptions: Dict[str, str] = {}
+        self._exact: Dict[str, int] = {}
+        for code, description, synonyms in entries:
+            self.descriptions.setdefault(code, description)
+            for term in (description, *synonyms):
+                key = normalize_term(term)
+                if key and key not in self._exact:
+                    self._exact[key] = len(self.terms)
+                    self.terms.append(key)
+                    self.term_codes.append(code)
+
+        postings: Dict[str, List[int]] = defaultdict(list)
+        self._gram_counts: List[int] = []
+        for term_id, term in enumerate(self.terms):
+            grams = set(trigrams(term))
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                postings[gram].append(term_id)
+        self._postings = dict(postings)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+    def _candidates(self, query: str, limit: int) -> List[int]:
+        grams = set(trigrams(query))
+        max_df = max(1, int(len(self.terms) * ICD_MAX_TRIGRAM_SHARE))
+        lists = [self._postings[g] for g in grams if g in self._postings]
+        rare = [p for p in lists if len(p) <= max_df]
+        shared: Dict[int, int] = defaultdict(int)
+        for posting in (rare or lists):
+            for term_id in posting:
+                shared[term_id] += 1
+        # Dice coefficient on trigram sets
+        scored = sorted(shared.items(), key=lambda kv: -2 * kv[1] / (len(grams) + self._gram_counts[kv[0]]))
+        return [term_id for term_id, _ in scored[:limit]]
+
+    def search(self, name: str, k: int = 5) -> List[IcdMatch]:
+        """Best `k` matches (one per code), highest score first"""
+        query = normalize_term(name)
+        if not query:
+            return []
+        term_id = self._exact.get(query)
+        if term_id is not None and k == 1:
+            return [IcdMatch(self.term_codes[term_id], self.terms[term_id], 100.0)]
+
+        best: Dict[str, IcdMatch] = {}
+        for term_id in self._candidates(query, ICD_CANDIDATES):
+            term, code = self.terms[term_id], self.term_codes[term_id]
+            score = 100.0 if term == query else similarity(query, term)
+            if code not in best or score > best[code].score:
+                best[code] = IcdMatch(code, term, score)
+        return sorted(best.values(), key=lambda m: (-m.score, len(m.description)))[:k]
+
+    def lookup(self, name: str, min_score: float = ICD_MIN_SCORE,
+               margin: float = ICD_AMBIGUITY_MARGIN) -> Optional[str]:
+        """
+        ICD code for a disease name, None if nothing scores above `min_score` or
+        a fuzzy best match is within `margin` of the next code (an exact term wins)
+        """
+        term_id = self._exact.get(normalize_term(name))
+        if term_id is not None:
+            return self.term_codes[term_id]
+        matches = self.search(name, k=2)
+        if not matches or matches[0].score <= min_score:
+            return None
+        if len(matches) > 1 and matches[0].score - matches[1].score < margin:
+            return None
+        return matches[0].code
+
+    def lookup_many(self, names: List[str], min_score: float = ICD_MIN_SCORE) -> List[Optional[str]]:
+        """lookup() for a list of names; each distinct normalized name is scored once"""
+        resolved: Dict[str, Optional[str]] = {}
+        codes = []
+        for name in names:
+            key = normalize_term(name)
+            if key not in resolved:
+                resolved[key] = self.lookup(key, min_score)
+            codes.append(resolved[key])
+        return codes
+
+
+_UNRESOLVED = object()
+
+
+class IcdMapper:
+    """
+    Batch ICD mapping: the names of a request are deduplicated, known ones come
+    from an LRU shared by all requests of the process, and the rest are resolved
+    in one lookup_many() call. Names the index cannot map go, in one batch, to the
+    optional `fallback` stage (anything with lookup_many(), e.g. embedding
+    retrieval). Unmappable names are cached too (as None).
+    """
+
+    def __init__(self, index: IcdIndex, cache_size: int = ICD_CACHE_SIZE, fallback: Any = None):
+        self.index = index
+        self.fallback = fallback
+        self.cache = LRUCache(maxsize=cache_size)
+        self.batches = 0
+        self.names = 0
+        self.unique_names = 0
+        self.resolved = 0
+        self.fallback_mapped = 0
+        self.fallback_errors = 0
+
+    def map_many(self, names: Iterable[str]) -> Dict[str, Optional[str]]:
+        """{name: code or None} for every non-empty name"""
+        names = [name for name in names if name]
+        keys = {name: normalize_term(name) for name in names}
+        codes: Dict[str, Optional[str]] = {}
+        misses = []
+        for key in set(keys.values()):
+            code = self.cache.get(key, _UNRESOLVED)
+            if code is _UNRESOLVED:
+                misses.append(key)
+            else:
+                codes[key] = code
+        if misses:
+            resolved = self.index.lookup_many(misses)
+            cacheable = [True] * len(misses)
+            unmapped = [i for i, code in enumerate(resolved) if code is None]
+            if unmapped and self.fallback is not None:
+                try:
+                    for i, code in zip(unmapped, self.fallback.lookup_many([misses[i] for i in unmapped])):
+                        resolved[i] = code
+                        self.fallback_mapped += code is not None
+                except Exception as e:
+                    # Do not memoize "no code" for names the fallback never saw
+                    print(f"⚠️ ICD fallback failed: {e!r}")
+                    self.fallback_errors += 1
+                    for i in unmapped:
+                        cacheable[i] = False
+            for key, code, cache in zip(misses, resolved, cacheable):
+                if cache:
+                    self.cache.set(key, code)
+                codes[key] = code
+        self.batches += 1
+        self.names += len(names)
+        self.unique_names += len(codes)
+        self.resolved += len(misses)
+        return {name: codes[key] for name, key in keys.items()}
+
+    def map_one(self, name: str) -> Optional[str]:
+        return self.map_many([name]).get(name) if name else None
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "names": self.names,
+            "unique_names": self.unique_names,
+            "resolved": self.resolved,
+            "fallback_mapped": self.fallback_mapped,
+            "fallback_errors": self.fallback_errors,
+            "fallback": self.fallback.stats() if self.fallback is not None else None,
+            "cache": self.cache.stats(),
+        }
+
+
+def _load_cms_codes_file(path: str) -> List[Tuple[str, str, List[str]]]:
+    """CMS ICD-10-CM code file: "A000    Cholera due to ..." per line, codes without the dot"""
+    entries = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            code, _, description = line.strip().partition(" ")
+            if not code or not description.strip():
+                continue
+            if len(code) > 3 and "." not in code:
+                code = f"{code[:3]}.{code[3:]}"
+            entries.append((code, description.strip(), []))
+    return entries
+
+
+def load_icd_entries(path: str = DEFAULT_ICD_PATH) -> List[Tuple[str, str, List[str]]]:
+    """
+    Rows of a code / description / synonyms file (TSV, or CSV by extension; synonyms
+    separated by "|"), or of a CMS ICD-10-CM code file (.txt)
+    """
+    if path.lower().endswith(".txt"):
+        return _load_cms_codes_file(path)
+    delimiter = "," if path.lower().endswith(".csv") else "\t"
+    entries = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f, delimiter=delimiter):
+            code = (row.get("code") or "").strip()
+            if not code:
+                continue
+            synonyms = [s.strip() for s in (row.get("synonyms") or "").split("|") if s.strip()]
+            entries.append((code, (row.get("description") or "").strip(), synonyms))
+    return entries
+
+
+@lru_cache(maxsize=1)
+def get_icd_index() -> IcdIndex:
+    """
+    Process-wide ICD index: the memory-mapped store built by `python -m ml.icd_store`
+    (ICD_STORE_PATH) when it exists and is not older than the dictionary
+    (ICD_DICT_PATH), otherwise an index built in memory from the dictionary.
+    """
+    from ml.icd_store import DEFAULT_ICD_STORE_PATH, MappedIcdIndex
+
+    dict_path = os.getenv("ICD_DICT_PATH", DEFAULT_ICD_PATH)
+    store_path = os.getenv("ICD_STORE_PATH", DEFAULT_ICD_STORE_PATH)
+    if os.path.exists(store_path):
+        if os.path.exists(dict_path) and os.path.getmtime(dict_path) > os.path.getmtime(store_path):
+            print(f"⚠️ {store_path} is older than {dict_path}; rebuild it with python -m ml.icd_store")
+        else:
+            try:
+                return MappedIcdIndex(store_path)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Could not map ICD store {store_path}: {e}")
+    return IcdIndex(load_icd_entries(dict_path))
+
+
+@lru_cache(maxsize=1)
+def get_icd_mapper() -> IcdMapper:
+    """Process-wide memoizing ICD mapper over get_icd_index()"""
+    return IcdMapper(get_icd_index())
@@ -0,0 +1,273 @@
+"""
+Compact on-disk ICD index: sorted string tables plus offset arrays, memory-mapped read-only
+
+Build it offline from the ICD dictionary, then every worker maps the same file:
+
+    python -m ml.icd_store --source data/icd10_codes.tsv --output data/icd10_codes.bin
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Dict, List, Sequence
+
+from ml.icd_index import DEFAULT_ICD_PATH, IcdIndex, load_icd_entries, trigrams
+
+DEFAULT_ICD_STORE_PATH = os.path.join(os.path.dirname(DEFAULT_ICD_PATH), "icd10_codes.bin")
+
+MAGIC = b"ICDSTORE"
+VERSION = 1
+# Section order in the file; "*_offsets" are uint32 arrays of n+1 byte offsets into the matching "*_bytes"
+SECTIONS = (
+    "term_offsets", "term_bytes",  # normalized terms, sorted by UTF-8 bytes
+    "term_codes",  # uint32 code id per term
+    "gram_counts",  # uint32 distinct trigrams per term
+    "code_offsets", "code_bytes",  # codes, sorted
+    "description_offsets", "description_bytes",  # description per code id
+    "gram_offsets", "gram_bytes",  # trigrams, sorted
+    "posting_offsets",  # uint32 offsets into "postings" per trigram
+    "postings",  # uint32 term ids, ascending per trigram
+)
+_HEADER = struct.Struct("<8sII")
+_SECTION = struct.Struct("<QQ")
+
+
+def _u32_bytes(values: Sequence[int]) -> bytes:
+    data = array("I", values)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def _string_table(strings: Sequence[str]):
+    offsets, chunks, position = [0], [], 0
+    for s in strings:
+        encoded = s.encode("utf-8")
+        chunks.append(encoded)
+        position += len(encoded)
+        offsets.append(position)
+    return _u32_bytes(offsets), b"".join(chunks)
+
+
+def write_icd_store(index: IcdIndex, path: str) -> int:
+    """Write an in-memory IcdIndex in the store format; returns the file size"""
+    order = sorted(range(len(index.terms)), key=lambda i: index.terms[i].encode("utf-8"))
+    codes = sorted(index.descriptions, key=lambda c: c.encode("utf-8"))
+    code_id = {code: i for i, code in enumerate(codes)}
+    postings: Dict[str, List[int]] = defaultdict(list)
+    for term_id, old in enumerate(order):
+        for gram in set(trigrams(index.terms[old])):
+            postings[gram].append(term_id)
+    grams = sorted(postings, key=lambda g: g.encode("utf-8"))
+    posting_offsets = [0]
+    for gram in grams:
+        posting_offsets.append(posting_offsets[-1] + len(postings[gram]))
+
+    sections = {}
+    sections["term_offsets"], sections["term_bytes"] = _string_table([index.terms[old] for old in order])
+    sections["term_codes"] = _u32_bytes([code_id[index.term_codes[old]] for old in order])
+    sections["gram_counts"] = _u32_bytes([index._gram_counts[old] for old in order])
+    sections["code_offsets"], sections["code_bytes"] = _string_table(codes)
+    sections["description_offsets"], sections["description_bytes"] = _string_table(
+        [index.descriptions[code] for code in codes])
+    sections["gram_offsets"], sections["gram_bytes"] = _string_table(grams)
+    sections["posting_offsets"] = _u32_bytes(posting_offsets)
+    sections["postings"] = _u32_bytes([term_id for gram in grams for term_id in postings[gram]])
+
+    # Sections start on 8-byte boundaries so the uint32 views are aligned
+    position = _HEADER.size + _SECTION.size * len(SECTIONS)
+    table, layout = [], []
+    for name in SECTIONS:
+        position += -position % 8
+        table.append(_SECTION.pack(position, len(sections[name])))
+        layout.append(position)
+        position += len(sections[name])
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(SECTIONS)))
+        f.write(b"".join(table))
+        for name, start in zip(SECTIONS, layout):
+            f.write(b"\0" * (start - f.tell()))
+            f.write(sections[name])
+    os.replace(tmp_path, path)
+    return position
+
+
+class _StringTable:
+    """Read-only sequence of strings over an offsets array and a byte blob"""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def raw(self, i: int) -> bytes:
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]])
+
+    def __getitem__(self, i: int) -> str:
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.raw(i).decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def find(self, key: str) -> int:
+        """Index of `key` by binary search (the table must be sorted), -1 if absent"""
+        target = key.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self.raw(lo) == target else -1
+
+
+class _TermCodes:
+    """term id -> code"""
+
+    def __init__(self, code_ids, codes: _StringTable):
+        self._code_ids = code_ids
+        self._codes = codes
+
+    def __len__(self) -> int:
+        return len(self._code_ids)
+
+    def __getitem__(self, term_id: int) -> str:
+        return self._codes[self._code_ids[term_id]]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class _ExactTerms:
+    """normalized term -> term id, the dict interface IcdIndex.search() uses"""
+
+    def __init__(self, terms: _StringTable):
+        self._terms = terms
+
+    def get(self, term: str, default=None):
+        term_id = self._terms.find(term)
+        return default if term_id < 0 else term_id
+
+
+class _Descriptions(Mapping):
+    def __init__(self, codes: _StringTable, descriptions: _StringTable):
+        self._codes = codes
+        self._descriptions = descriptions
+
+    def __getitem__(self, code: str) -> str:
+        code_id = self._codes.find(code)
+        if code_id < 0:
+            raise KeyError(code)
+        return self._descriptions[code_id]
+
+    def __iter__(self):
+        return iter(self._codes)
+
+    def __len__(self) -> int:
+        return len(self._codes)
+
+
+class _Postings:
+    """trigram -> ascending term ids (a uint32 view into the mapped file)"""
+
+    def __init__(self, grams: _StringTable, offsets, postings):
+        self._grams = grams
+        self._offsets = offsets
+        self._postings = postings
+
+    def __contains__(self, gram: str) -> bool:
+        return self._grams.find(gram) >= 0
+
+    def __getitem__(self, gram: str):
+        gram_id = self._grams.find(gram)
+        if gram_id < 0:
+            raise KeyError(gram)
+        return self._postings[self._offsets[gram_id]:self._offsets[gram_id + 1]]
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+
+class MappedIcdIndex(IcdIndex):
+    """
+    IcdIndex over a store file mapped read-only: opening it only reads the
+    section table, and the pages are shared by every process mapping the file.
+    Exact lookups binary-search the sorted term table instead of a dict.
+    """
+
+    def __init__(self, path: str = DEFAULT_ICD_STORE_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._stat = os.fstat(f.fileno())
+        view = memoryview(self._mmap)
+        magic, version, count = _HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION or count != len(SECTIONS):
+            raise ValueError(f"{path} is not an ICD store (version {VERSION}); rebuild it with python -m ml.icd_store")
+        s = {}
+        for i, name in enumerate(SECTIONS):
+            start, length = _SECTION.unpack_from(view, _HEADER.size + i * _SECTION.size)
+            s[name] = view[start:start + length]
+
+        def u32(name):
+            if sys.byteorder == "big":
+                values = array("I", s[name].tobytes())
+                values.byteswap()
+                return values
+            return s[name].cast("I")
+
+        self.terms = _StringTable(u32("term_offsets"), s["term_bytes"])
+        codes = _StringTable(u32("code_offsets"), s["code_bytes"])
+        self.term_codes = _TermCodes(u32("term_codes"), codes)
+        self.descriptions = _Descriptions(codes, _StringTable(u32("description_offsets"), s["description_bytes"]))
+        self._exact = _ExactTerms(self.terms)
+        self._gram_counts = u32("gram_counts")
+        self._postings = _Postings(_StringTable(u32("gram_offsets"), s["gram_bytes"]),
+                                   u32("posting_offsets"), u32("postings"))
+
+    @property
+    def size(self) -> int:
+        return len(self._mmap)
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity of the mapped file (section table, size, mtime) without decoding any term"""
+        table = self._mmap[:_HEADER.size + _SECTION.size * len(SECTIONS)]
+        return hashlib.sha1(table + f"{self._stat.st_size}:{self._stat.st_mtime_ns}".encode()).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=os.getenv("ICD_DICT_PATH", DEFAULT_ICD_PATH),
+                        help="ICD dictionary (TSV/CSV with code, description, synonyms, or a CMS code .txt)")
+    parser.add_argument("--output", default=os.getenv("ICD_STORE_PATH", DEFAULT_ICD_STORE_PATH))
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = IcdIndex(load_icd_entries(args.source))
+    size = write_icd_store(index, args.output)
+    print(f"{args.output}: {len(index.descriptions)} codes, {len(index)} terms, {len(index._postings)} trigrams, "
+          f"{size / 1e6:.1f} MB, built in {time.perf_counter() - started:.1f} s")
+
+    started = time.perf_counter()
+    mapped = MappedIcdIndex(args.output)
+    open_ms = (time.perf_counter() - started) * 1000
+    mismatches = sum(1 for term in index.terms[:1000] if mapped.lookup(term) != index.lookup(term))
+    print(f"opened in {open_ms:.2f} ms, {mismatches} lookup mismatches on the first 1000 terms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Lab knowledge base: reference tests, units, ranges and synonyms loaded once from file
+"""
+import csv
+import hashlib
+import json
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ml.lab_matcher import LabNameMatcher
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+DEFAULT_LAB_KB_PATH = os.path.join(DATA_DIR, "lab_tests.json")
+EMBEDDING_CACHE_DIR = os.path.join(DATA_DIR, ".cache")
+
+_RANGE_RE = re.compile(r"^\s*([\d.]+)\s*[-–]\s*([\d.]+)\s*$")
+_BOUND_RE = re.compile(r"^\s*(<=?|≤|>=?|≥)\s*([\d.]+)\s*$")
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_lab_name(name: str) -> str:
+    """Key used for all name lookups (case and whitespace insensitive)"""
+    return _WS_RE.sub(" ", name or "").strip().lower()
+
+
+def parse_range(normal_range: Optional[str]) -> Tuple[Optional[float], Optional[float]]:
+    """Parse "70-110", "<200" or ">60" into numeric (low, high) bounds"""
+    if not normal_range:
+        return None, None
+    m = _RANGE_RE.match(normal_range)
+    if m:
+        return float(m.group(1)), float(m.group(2))
+    m = _BOUND_RE.match(normal_range)
+    if m:
+        bound = float(m.group(2))
+        if m.group(1)[0] in "<≤":
+            return None, bound
+        return bound, None
+    return None, None
+
+
+@dataclass(frozen=True)
+class LabTest:
+    """A reference lab test with pre-parsed range bounds"""
+    name: str
+    description: str
+    unit: Optional[str]
+    normal_range: Optional[str]
+    low: Optional[float]
+    high: Optional[float]
+    synonyms: Tuple[str, ...] = ()
+    # (unit, (factor, offset)): value in `unit` * factor + offset = value in `unit` of this test
+    conversions: Tuple[Tuple[str, Tuple[float, float]], ...] = ()
+
+    def flag(self, value: Optional[float]) -> Optional[str]:
+        """Return "low", "high" or "normal" for a numeric value, None if unknown"""
+        if value is None or (self.low is None and self.high is None):
+            return None
+        if self.low is not None and value < self.low:
+            return "low"
+        if self.high is not None and value > self.high:
+            return "high"
+        return "normal"
+
+    def document_text(self) -> str:
+        """Text used for retrieval embeddings and LLM prompt context"""
+        return (
+            f"{self.name}: {self.description}. "
+            f"Unit: {self.unit or '-'}. Normal range: {self.normal_range or '-'}."
+        )
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Legacy dict shape used by the RAG prompt ("test", "unit", ...)"""
+        return {
+            "test": self.name,
+            "description": self.description,
+            "unit": self.unit,
+            "normal_range": self.normal_range,
+        }
+
+
+class LabKnowledgeBase:
+    """Lab tests indexed by every synonym for O(1) lookups"""
+
+    def __init__(self, tests: Iterable[LabTest]):
+        self.tests: List[LabTest] = list(tests)
+        self._by_alias: Dict[str, LabTest] = {}
+        for test in self.tests:
+            for alias in (test.name,) + test.synonyms:
+                self._by_alias.setdefault(normalize_lab_name(alias), test)
+        self._embeddings = None
+        self._matcher = None
+
+    def __len__(self) -> int:
+        return len(self.tests)
+
+    def lookup(self, name: str) -> Optional[LabTest]:
+        """Find a test by canonical name or synonym"""
+        return self._by_alias.get(normalize_lab_name(name))
+
+    def is_known(self, name: str) -> bool:
+        return normalize_lab_name(name) in self._by_alias
+
+    def canonical_name(self, name: str) -> Optional[str]:
+        test = self.lookup(name)
+        return test.name if test else None
+
+    def aliases(self) -> List[str]:
+        """All normalized names and synonyms"""
+        return list(self._by_alias.keys())
+
+    def name_matcher(self) -> LabNameMatcher:
+        """Aho-Corasick matcher over every name and synonym, built on first use"""
+        if self._matcher is None:
+            self._matcher = LabNameMatcher(self._by_alias.keys())
+        return self._matcher
+
+    def as_dicts(self) -> List[Dict[str, Any]]:
+        return [test.as_dict() for test in self.tests]
+
+    def embeddings(self, embed_model, model_name: str = "default"):
+        """
+        Return document embeddings for every test, computed once.
+        Cached on disk keyed by model name and KB content so restarts skip encoding.
+        """
+        if self._embeddings is not None:
+            return self._embeddings
+
+        import numpy as np
+
+        texts = [test.document_text() for test in self.tests]
+        fingerprint = hashlib.sha1(
+            "\n".join([model_name] + texts).encode("utf-8")).hexdigest()[:16]
+        cache_path = os.path.join(EMBEDDING_CACHE_DIR, f"lab_kb_{fingerprint}.npy")
+
+        if os.path.exists(cache_path):
+            try:
+                self._embeddings = np.load(cache_path)
+                return self._embeddings
+            except Exception as e:
+                print(f"⚠️ Could not read lab KB embedding cache: {e}")
+
+        self._embeddings = embed_model.encode(texts, convert_to_numpy=True).astype("float32")
+        try:
+            os.makedirs(EMBEDDING_CACHE_DIR, exist_ok=True)
+            np.save(cache_path, self._embeddings)
+        except OSError as e:
+            print(f"⚠️ Could not write lab KB embedding cache: {e}")
+        return self._embeddings
+
+
+def _parse_conversions(raw: Any) -> Tuple[Tuple[str, Tuple[float, float]], ...]:
+    """
+    {"mmol/L": 18.016, "mmol/mol": [0.0915, 2.15]} from JSON, or
+    "mmol/L=18.016|mmol/mol=0.0915:2.15" from CSV
+    """
+    if not raw:
+        return ()
+    if isinstance(raw, str):
+        raw = dict(item.split("=", 1) for item in raw.split("|") if "=" in item)
+        raw = {unit: [float(x) for x in spec.split(":")] for unit, spec in raw.items()}
+    conversions = []
+    for unit, spec in raw.items():
+        factor, offset = (spec, 0.0) if isinstance(spec, (int, float)) else (spec[0], spec[1] if len(spec) > 1 else 0.0)
+        conversions.append((unit.strip(), (float(factor), float(offset))))
+    return tuple(conversions)
+
+
+def _test_from_row(row: Dict[str, Any]) -> LabTest:
+    synonyms = row.get("synonyms") or []
+    if isinstance(synonyms, str):
+        synonyms = [s for s in synonyms.split("|") if s.strip()]
+    normal_range = row.get("normal_range") or None
+    low, high = parse_range(normal_range)
+    return LabTest(
+        name=row["test"].strip(),
+        description=(row.get("description") or "").strip(),
+        unit=row.get("unit") or None,
+        normal_range=normal_range,
+        low=low,
+        high=high,
+        synonyms=tuple(s.strip() for s in synonyms),
+        conversions=_parse_conversions(row.get("conversions")),
+    )
+
+
+def load_lab_kb(path: str = DEFAULT_LAB_KB_PATH) -> LabKnowledgeBase:
+    """Load the lab KB from JSON (list of objects) or CSV (synonyms and conversions separated by "|")"""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+    return LabKnowledgeBase(_test_from_row(row) for row in rows)
+
+
+@lru_cache(maxsize=1)
+def get_lab_kb() -> LabKnowledgeBase:
+    """Process-wide lab KB (path overridable with LAB_KB_PATH)"""
+    return load_lab_kb(os.getenv("LAB_KB_PATH", DEFAULT_LAB_KB_PATH))
@@ -0,0 +1,112 @@
+"""
+Aho-Corasick dictionary matcher for lab test names and synonyms
+"""
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+
+class NameHit(NamedTuple):
+    alias: str  # normalized vocabulary entry that matched
+    start: int
+    end: int
+
+
+def _fold(ch: str) -> str:
+    """Character as seen by the automaton: lower case, spaces and tabs are a single space"""
+    return " " if ch in " \t" else ch.lower()
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class LabNameMatcher:
+    """
+    Built once from the vocabulary; `find_all` reports every whole-word occurrence
+    of every name in one pass over the text, in time linear in the text length
+    plus the number of hits, however many names the vocabulary holds.
+    Matching is case-insensitive and a run of spaces or tabs matches a single
+    space; names never span lines, like the generic "name: value" scan.
+    """
+
+    def __init__(self, names: Iterable[str]):
+        # Trie as parallel lists indexed by state; state 0 is the root
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]  # lengths of the names ending at this state
+        self._depth: List[int] = [0]
+        self._alias_at: List[Optional[str]] = [None]
+        self.size = 0
+        for name in names:
+            self._add(" ".join((name or "").lower().split()))
+        self._build_failure_links()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _add(self, name: str):
+        if not name:
+            return
+        state = 0
+        for ch in name:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._depth.append(self._depth[state] + 1)
+                self._alias_at.append(None)
+                self._goto[state][ch] = nxt
+            state = nxt
+        if self._alias_at[state] is None:
+            self._alias_at[state] = name
+            self._out[state].append(state)
+            self.size += 1
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                # Names that are suffixes of this path end here too
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[NameHit]:
+        """Every whole-word occurrence, ordered by start offset and then longest first"""
+        hits: List[NameHit] = []
+        goto, fail, out = self._goto, self._fail, self._out
+        # Original offset of each character fed to the automaton (collapsed whitespace is skipped)
+        fed: List[int] = []
+        state = 0
+        prev_space = False
+        for i, raw in enumerate(text):
+            ch = _fold(raw)
+            if ch == " ":
+                if prev_space:
+                    continue
+                prev_space = True
+            else:
+                prev_space = False
+            fed.append(i)
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            end = i + 1
+            if end < len(text) and _is_word_char(text[end]) and _is_word_char(raw):
+                continue
+            for terminal in out[state]:
+                start = fed[len(fed) - self._depth[terminal]]
+                if start > 0 and _is_word_char(text[start - 1]) and _is_word_char(text[start]):
+                    continue
+                hits.append(NameHit(self._alias_at[terminal], start, end))
+        hits.sort(key=lambda h: (h.start, -h.end))
+        return hits
@@ -0,0 +1,97 @@
+"""
+Reconcile lab entities reported by several extractors (tables, regex, RAG+LLM)
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from ml.aggregation import normalize_value
+from ml.lab_kb import normalize_lab_name
+
+
+def _name_key(lab: Any) -> str:
+    return normalize_lab_name(getattr(lab, "canonical_name", None) or lab.text)
+
+
+def _value_key(lab: Any) -> str:
+    numeric = getattr(lab, "numeric_value", None)
+    if numeric is not None:
+        return format(round(numeric, 4), "g")
+    return normalize_value(lab.value)
+
+
+def merge_lab_entities(sources: Sequence[Tuple[str, Sequence[Any]]]) -> List[Any]:
+    """
+    One entity per lab reading across extractors, in text order. `sources` is
+    [(extractor name, entities)] in order of preference for equal confidence.
+    Two located hits are the same reading when their spans overlap and their
+    values agree (e.g. "LDL Cholesterol" vs "Cholesterol" on one line); the same
+    test and value at different offsets are serial readings and stay apart. A hit
+    without a span (a table row not found in the text) joins the first reading
+    with its canonical name and value inside its `page_span`, or anywhere when it
+    has none. The highest-confidence hit is kept, and its `sources` lists every
+    extractor that reported it, the kept one first.
+    O(n log n): a sort-and-sweep over spans, then a hash pass for span-less hits.
+    """
+    candidates: List[Tuple[Any, str, int]] = []
+    for rank, (source, labs) in enumerate(sources):
+        candidates.extend((lab, source, rank) for lab in labs)
+
+    def better(a: Tuple[Any, str, int], b: Tuple[Any, str, int]) -> bool:
+        return (a[0].confidence, -a[2]) > (b[0].confidence, -b[2])
+
+    located = [i for i, cand in enumerate(candidates) if cand[0].end > cand[0].start]
+    unlocated = [i for i, cand in enumerate(candidates) if cand[0].end <= cand[0].start]
+
+    # Same value with overlapping spans: union hits along a sweep sorted by start
+    parent = list(range(len(candidates)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    open_by_value: Dict[str, Tuple[int, int]] = {}  # value -> (furthest end, hit)
+    for i in sorted(located, key=lambda i: (candidates[i][0].start, candidates[i][0].end)):
+        lab = candidates[i][0]
+        value, end = _value_key(lab), lab.end
+        current: Optional[Tuple[int, int]] = open_by_value.get(value)
+        if current is not None and current[0] > lab.start:
+            parent[find(i)] = find(current[1])
+            end = max(end, current[0])
+        open_by_value[value] = (end, i)
+
+    # Span-less hits: the first located reading with the same name and value in
+    # their page, else one reading per (name, value, page)
+    by_key: Dict[Tuple[str, str], List[int]] = {}
+    for i in located:
+        by_key.setdefault((_name_key(candidates[i][0]), _value_key(candidates[i][0])), []).append(i)
+    for key_hits in by_key.values():
+        key_hits.sort(key=lambda i: candidates[i][0].start)
+    spanless: Dict[Tuple[str, str, Optional[Tuple[int, int]]], int] = {}
+    for i in unlocated:
+        lab = candidates[i][0]
+        key = (_name_key(lab), _value_key(lab))
+        page = getattr(lab, "page_span", None)
+        target = next((j for j in by_key.get(key, ())
+                       if page is None or page[0] <= candidates[j][0].start < page[1]), None)
+        if target is None:
+            target = spanless.setdefault(key + (page,), i)
+        if target != i:
+            parent[find(i)] = find(target)
+
+    merged: Dict[int, List[Tuple[Any, str, int]]] = {}
+    for i, cand in enumerate(candidates):
+        merged.setdefault(find(i), []).append(cand)
+
+    result = []
+    for cands in merged.values():
+        best = cands[0]
+        for cand in cands[1:]:
+            if better(cand, best):
+                best = cand
+        ranks = {source: rank for _, source, rank in cands}
+        lab = best[0]
+        lab.sources = [best[1]] + sorted(set(ranks) - {best[1]}, key=ranks.get)
+        result.append(lab)
+    result.sort(key=lambda lab: (lab.end <= lab.start, lab.start))
+    return result
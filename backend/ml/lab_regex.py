@@ -0,0 +1,157 @@
+"""
+Regex lab extractor: dictionary matching of known test names plus one precompiled generic scan
+"""
+import re
+from bisect import bisect_right
+from typing import List, NamedTuple, Optional
+
+from ml.lab_kb import LabKnowledgeBase
+from ml.lab_units import parse_numeric
+
+LAB_UNIT_PATTERN = r"mg/dL|mmol/L|g/dL|%|U/L|mEq/L|ng/mL|µg/dL|pg/mL|IU/L|mIU/L|×10[³⁹]|10\^3|10\^9"
+
+# Known test names are found by the KB's Aho-Corasick matcher (ml/lab_matcher.py); the
+# value and unit after a name are read with this pattern anchored at the end of the name.
+KNOWN_VALUE_RE = re.compile(
+    r"\s*[:=]?\s*(?P<value>[\d.,]+)\s*(?P<unit>" + LAB_UNIT_PATTERN + r")?", re.IGNORECASE)
+
+# Any short name followed by ":" / "=". Names start at a word and never span lines.
+GENERIC_SCAN_RE = re.compile(
+    r"(?<![A-Za-z0-9])(?P<name>[A-Za-z][A-Za-z0-9 \t/&-]{2,30}?)\s*[:=]\s*(?P<value>[\d.,]+)\s*(?P<unit>"
+    + LAB_UNIT_PATTERN + r")?",
+    re.IGNORECASE,
+)
+
+FALSE_POSITIVE_PATTERNS = [
+    r"^page\s+\d+",
+    r"^\d+\s+of\s+\d+",
+    r"^ref\s*:?\s*\d+",
+    r"^dob\s*:?",
+    r"^age\s*:?\s*\d+",
+    r"^collected\s*:?",
+    r"^printed\s*:?",
+    r"^referred\s*:?",
+    r"^dept\s*",
+    r"^no\s*\.?\s*",
+    r"^source\s*",
+    r"^type\s*\d+",
+    r"^\d{4}\s*$",  # Years like 2020
+    r"^[a-z]\s+\d+$",  # Single letter followed by number (like "A 1")
+    r"^\d+\s*$",  # Just numbers
+    r"^[a-z]{1,2}\s*$",  # Very short words (1-2 letters)
+    r"^departments?$",
+    r"^jalans?$",
+    r"^sel\s*\d+",
+    r"^kdigo",
+    r"^thresholds?$",
+    r"^values?$",
+    r"^within\s+\d+",
+    r"^least\s+\d+",
+    r"^increased\s+\d+",
+]
+# All false-positive patterns as one anchored alternation
+FALSE_POSITIVE_RE = re.compile("|".join(f"(?:{p})" for p in FALSE_POSITIVE_PATTERNS), re.IGNORECASE)
+
+LAB_KEYWORDS = ("test", "level", "count", "concentration", "ratio", "index", "rate")
+EXCLUDED_WORDS = frozenset({
+    "page", "of", "ref", "dob", "age", "no", "dept", "source", "type",
+    "collected", "printed", "referred", "departments", "jalans", "sel",
+    "kdigo", "thresholds", "values", "within", "least", "increased", "a",
+    "to", "the", "and", "or", "is", "are", "was", "were",
+})
+
+
+class LabMatch(NamedTuple):
+    name: str
+    value: str
+    unit: Optional[str]
+    start: int
+    end: int
+    known: bool
+    confidence: float
+
+
+def is_valid_lab_result(lab_name: str, value: Optional[str], kb: LabKnowledgeBase) -> bool:
+    """Validate if a potential lab result is actually a lab test."""
+    if not lab_name:
+        return False
+
+    lab_lower = lab_name.lower().strip()
+
+    # Must have a numeric value ("1,250", "5,6" and "<0.5" included, see ml/lab_units.py)
+    if not value or parse_numeric(value)[0] is None:
+        return False
+
+    # Known lab test (name or synonym in the lab KB), before the false-positive
+    # rules: short synonyms such as "Hb" or "Na" look like noise to them
+    if kb.is_known(lab_lower):
+        return True
+    if FALSE_POSITIVE_RE.match(lab_lower):
+        return False
+    # Common lab test keywords
+    if any(keyword in lab_lower for keyword in LAB_KEYWORDS):
+        return True
+    # Reasonable length (not too short, not too long)
+    if len(lab_name) < 3 or len(lab_name) > 50:
+        return False
+    return lab_lower not in EXCLUDED_WORDS
+
+
+def _known_matches(text: str, kb: LabKnowledgeBase) -> List[LabMatch]:
+    """Known names followed by a value, longest name first at each offset, non-overlapping"""
+    labs: List[LabMatch] = []
+    pos = 0
+    for hit in kb.name_matcher().find_all(text):
+        if hit.start < pos:
+            continue
+        m = KNOWN_VALUE_RE.match(text, hit.end)
+        if m is None:
+            continue
+        name, value = text[hit.start:hit.end], m.group("value").strip()
+        if not is_valid_lab_result(name, value, kb):
+            continue
+        labs.append(LabMatch(name, value, m.group("unit") or None, hit.start, m.end(), True, 0.95))
+        pos = m.end()
+    return labs
+
+
+def _generic_matches(text: str, kb: LabKnowledgeBase, taken: List[LabMatch]) -> List[LabMatch]:
+    """"name: value" pairs not overlapping an already taken (known) match"""
+    starts = [l.start for l in taken]
+    labs: List[LabMatch] = []
+    pos = 0
+    while True:
+        m = GENERIC_SCAN_RE.search(text, pos)
+        if m is None:
+            break
+        i = bisect_right(starts, m.start()) - 1
+        overlaps = (i >= 0 and taken[i].end > m.start()) or (i + 1 < len(taken) and taken[i + 1].start < m.end())
+        name, value = m.group("name").strip(), m.group("value").strip()
+        if overlaps or not is_valid_lab_result(name, value, kb):
+            pos = m.start() + 1
+            continue
+        unit = m.group("unit")
+        labs.append(LabMatch(name, value, unit or None, m.start(), m.end(), False, 0.9 if unit else 0.7))
+        pos = m.end()
+    return labs
+
+
+def extract_lab_matches(text: str, kb: LabKnowledgeBase) -> List[LabMatch]:
+    """
+    Known test names (every KB name and synonym) are located in one linear
+    Aho-Corasick pass and get confidence 0.95. Other "name: value" pairs found
+    by the generic scan outside those spans get 0.9 with a unit and 0.7 without;
+    when a generic candidate is rejected the scan resumes one character later.
+    Results are in text order; duplicate (name, value) pairs are dropped.
+    """
+    known = _known_matches(text, kb)
+    candidates = sorted(known + _generic_matches(text, kb, known), key=lambda l: l.start)
+    labs: List[LabMatch] = []
+    seen = set()
+    for lab in candidates:
+        key = f"{lab.name.lower()}:{lab.value}"
+        if key in seen:
+            continue
+        seen.add(key)
+        labs.append(lab)
+    return labs
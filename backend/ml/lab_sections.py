@@ -0,0 +1,184 @@
+"""
+Locate lab-looking lines in report text and measure how much of them a cheap extractor explained
+"""
+import re
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from ml.lab_kb import LabKnowledgeBase, normalize_lab_name
+from ml.prompting import estimate_tokens
+
+Span = Tuple[int, int]
+
+UNIT_PATTERN = (
+    r"mg/dL|mmol/L|µmol/L|umol/L|g/dL|g/L|%|U/L|mEq/L|ng/mL|ng/dL|µg/dL|ug/dL|µg/mL|ug/mL|pg/mL|"
+    r"IU/L|mIU/L|mg/L|mm/hr|mOsm/kg|mL/min(?:/1\.73\s?m2)?|sec|×10[³⁹]|x10\^?[39]|10\^3|10\^6|10\^9"
+)
+_UNIT_RE = re.compile(r"(?<![A-Za-z])(?:" + UNIT_PATTERN + r")(?![A-Za-z])", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"(?<![\w.])\d+(?:[.,]\d+)*(?![\w])")
+# Numbers that are never lab values on their own: dates, ranges, bounds, times
+# (dates first, or "2024-03" of "2024-03-05" would be taken as a range and "05" left over)
+_IGNORED_NUMBER_RE = re.compile(
+    r"\d{1,4}[/.-]\d{1,2}[/.-]\d{1,4}"
+    r"|\d+(?:\.\d+)?\s*[-–]\s*\d+(?:\.\d+)?"
+    r"|[<>≤≥]=?\s*\d+(?:\.\d+)?"
+    r"|\d{1,2}:\d{2}(?::\d{2})?"
+)
+_WORD_RE = re.compile(r"[A-Za-z][A-Za-z0-9/-]*")
+
+
+def iter_lines(text: str) -> Iterable[Span]:
+    """Yield (start, end) of every non-empty line"""
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        stripped = line.rstrip("\r\n")
+        if stripped.strip():
+            yield pos, pos + len(stripped)
+        pos += len(line)
+
+
+def mentions_known_lab(line: str, kb: LabKnowledgeBase, max_words: int = 3) -> bool:
+    """True if any 1..max_words word n-gram of the line is a KB test name or synonym"""
+    words = [normalize_lab_name(w) for w in _WORD_RE.findall(line)]
+    for n in range(1, max_words + 1):
+        for i in range(len(words) - n + 1):
+            if kb.is_known(" ".join(words[i:i + n])):
+                return True
+    return False
+
+
+def value_positions(line: str) -> List[int]:
+    """Offsets (within the line) of numbers that could be lab values"""
+    ignored = [m.span() for m in _IGNORED_NUMBER_RE.finditer(line)]
+    positions = []
+    for m in _NUMBER_RE.finditer(line):
+        if any(s <= m.start() < e for s, e in ignored):
+            continue
+        positions.append(m.start())
+    return positions
+
+
+def find_lab_lines(text: str, kb: LabKnowledgeBase) -> List[Span]:
+    """Lines holding a candidate value and either a unit token or a known lab name"""
+    spans = []
+    for start, end in iter_lines(text):
+        line = text[start:end]
+        if not value_positions(line):
+            continue
+        if _UNIT_RE.search(line) or mentions_known_lab(line, kb):
+            spans.append((start, end))
+    return spans
+
+
+def unexplained_lab_lines(text: str, hits: Sequence[Span], kb: LabKnowledgeBase,
+                          lines: Optional[Sequence[Span]] = None) -> List[Span]:
+    """
+    Lab-looking lines with at least one candidate value not covered by an extractor hit.
+    `hits` are (start, end) spans of already extracted lab entities.
+    """
+    hits = sorted(hits)
+    unexplained = []
+    for start, end in (lines if lines is not None else find_lab_lines(text, kb)):
+        covering = [(s, e) for s, e in hits if s < end and e > start]
+        for offset in value_positions(text[start:end]):
+            pos = start + offset
+            if not any(s <= pos < e for s, e in covering):
+                unexplained.append((start, end))
+                break
+    return unexplained
+
+
+def group_sections(text: str, lines: Sequence[Span], context_lines: int = 1, max_gap_lines: int = 1) -> List[Span]:
+    """
+    Merge lab lines into contiguous sections. Lines separated by at most
+    `max_gap_lines` other lines join the same section; each section is widened
+    by `context_lines` lines above it (usually a table header).
+    """
+    if not lines:
+        return []
+    all_lines = list(iter_lines(text))
+    index_of = {span: i for i, span in enumerate(all_lines)}
+    indices = sorted(index_of[span] for span in lines if span in index_of)
+    if not indices:
+        return []
+
+    groups = [[indices[0], indices[0]]]
+    for i in indices[1:]:
+        if i - groups[-1][1] - 1 <= max_gap_lines:
+            groups[-1][1] = i
+        else:
+            groups.append([i, i])
+
+    sections = []
+    for first, last in groups:
+        first = max(0, first - context_lines)
+        start, end = all_lines[first][0], all_lines[last][1]
+        if sections and start <= sections[-1][1]:
+            sections[-1] = (sections[-1][0], max(end, sections[-1][1]))
+        else:
+            sections.append((start, end))
+    return sections
+
+
+def batch_sections(text: str, sections: Sequence[Span], token_budget: int) -> List[List[Span]]:
+    """Pack sections into batches whose text stays under `token_budget` tokens; oversized sections are split by line"""
+    pieces: List[Span] = []
+    for start, end in sections:
+        if estimate_tokens(text[start:end]) <= token_budget:
+            pieces.append((start, end))
+            continue
+        chunk_start = None
+        chunk_end = None
+        for line_start, line_end in iter_lines(text[start:end]):
+            line_start, line_end = line_start + start, line_end + start
+            if chunk_start is not None and estimate_tokens(text[chunk_start:line_end]) > token_budget:
+                pieces.append((chunk_start, chunk_end))
+                chunk_start = None
+            if chunk_start is None:
+                chunk_start = line_start
+            chunk_end = line_end
+        if chunk_start is not None:
+            pieces.append((chunk_start, chunk_end))
+
+    batches: List[List[Span]] = []
+    used = 0
+    for piece in pieces:
+        cost = estimate_tokens(text[piece[0]:piece[1]])
+        if batches and used + cost <= token_budget:
+            batches[-1].append(piece)
+            used += cost
+        else:
+            batches.append([piece])
+            used = cost
+    return batches
+
+
+def locate_lab_offsets(text: str, name: str, value: str, sections: Optional[Sequence[Span]] = None,
+                       max_distance: int = 60) -> Optional[Span]:
+    """
+    Find where a returned (name, value) pair occurs in the source text.
+    Returns the span from the lab name to the end of the value, searching
+    `sections` first and then the whole text; None if not found.
+    """
+    if not name or not value:
+        return None
+    name_re = re.compile(re.escape(name.strip()), re.IGNORECASE)
+    value_re = re.compile(r"(?<![\d.])" + re.escape(value.strip()) + r"(?![\d])")
+    windows = list(sections or []) + [(0, len(text))]
+    for win_start, win_end in windows:
+        for m in name_re.finditer(text, win_start, win_end):
+            v = value_re.search(text, m.end(), min(win_end, m.end() + max_distance))
+            if v:
+                return m.start(), v.end()
+    return None
+
+
+def locate_value(text: str, value: str, sections: Sequence[Span]) -> Optional[Span]:
+    """Span of the first standalone occurrence of `value` inside `sections`"""
+    if not value:
+        return None
+    value_re = re.compile(r"(?<![\d.])" + re.escape(value.strip()) + r"(?![\d])")
+    for start, end in sections:
+        m = value_re.search(text, start, end)
+        if m:
+            return m.span()
+    return None
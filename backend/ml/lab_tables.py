@@ -0,0 +1,254 @@
+"""
+Table-aware lab extraction from PDF page layout (pdfplumber tables and word positions)
+"""
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from ml.lab_kb import LabKnowledgeBase, get_lab_kb, parse_range
+from ml.lab_regex import LAB_UNIT_PATTERN, is_valid_lab_result
+from ml.lab_sections import UNIT_PATTERN
+
+Cells = List[Optional[str]]
+
+# Header words identifying each column role; the first role whose keyword appears wins
+HEADER_KEYWORDS = (
+    ("range", ("reference", "range", "normal", "biological", "ref.", "interval", "limits")),
+    ("unit", ("unit", "units", "uom")),
+    ("value", ("result", "results", "value", "observed", "finding")),
+    ("name", ("test", "tests", "investigation", "parameter", "analyte", "component", "examination", "description")),
+)
+
+_UNITS = UNIT_PATTERN + "|" + LAB_UNIT_PATTERN
+_UNIT_CELL_RE = re.compile(r"^\s*(?:" + _UNITS + r")(?:/[A-Za-z0-9.]+)?\s*$", re.IGNORECASE)
+# "110", "1,234", "7.2 %", "4.1 H", "182 mg/dL (H)"; bounds like "<0.5" keep their sign in the raw value
+_VALUE_CELL_RE = re.compile(
+    r"^\s*(?P<value>[<>≤≥]?\s*\d+(?:[.,]\d+)*)\s*(?P<unit>" + _UNITS + r")?(?:/[A-Za-z0-9.]+)?"
+    r"\s*\(?(?:H|L|HH|LL|High|Low|\*)?\)?\s*$",
+    re.IGNORECASE,
+)
+_RANGE_CELL_RE = re.compile(r"^\s*(?:[<>≤≥]=?\s*)?\d+(?:\.\d+)?(?:\s*[-–]\s*\d+(?:\.\d+)?)?\s*(?:" + _UNITS + r")?\s*$",
+                            re.IGNORECASE)
+_WS_RE = re.compile(r"\s+")
+
+# A table is used only when it yields this many rows and this share of its data rows parse
+MIN_TABLE_ROWS = 2
+MIN_PARSED_SHARE = 0.6
+WORD_Y_TOLERANCE = 3.0
+HEADER_WORD_GAP = 6.0
+MAX_SKIPPED_LINES = 2
+
+
+class TableLabRow(NamedTuple):
+    name: str
+    value: str
+    unit: Optional[str]
+    normal_range: Optional[str]
+    page: int
+    known: bool
+
+
+def _clean(cell: Optional[str]) -> str:
+    return _WS_RE.sub(" ", cell or "").strip()
+
+
+def header_role(cell: Optional[str]) -> Optional[str]:
+    """Column role named by a header cell ("Reference Range" -> "range"), None for data cells"""
+    words = _clean(cell).lower().split()
+    if not words or any(ch.isdigit() for ch in "".join(words)):
+        return None
+    for role, keywords in HEADER_KEYWORDS:
+        if any(w in keywords for w in words):
+            return role
+    return None
+
+
+def header_columns(cells: Sequence[Optional[str]]) -> Optional[Dict[str, int]]:
+    """Map column roles to indices for a header row; None unless it names a test and a result column"""
+    columns: Dict[str, int] = {}
+    for i, cell in enumerate(cells):
+        role = header_role(cell)
+        if role is not None and role not in columns:
+            columns[role] = i
+    if "name" in columns and "value" in columns:
+        return columns
+    return None
+
+
+def infer_columns(rows: Sequence[Cells], kb: LabKnowledgeBase) -> Optional[Dict[str, int]]:
+    """Column roles for a header-less table, from what most of each column's cells look like"""
+    width = max((len(r) for r in rows), default=0)
+    if width < 2 or not rows:
+        return None
+
+    def share(col: int, test) -> float:
+        cells = [_clean(r[col]) for r in rows if col < len(r) and _clean(r[col])]
+        return sum(1 for c in cells if test(c)) / len(cells) if cells else 0.0
+
+    name_scores = [share(c, kb.is_known) for c in range(width)]
+    name_col = max(range(width), key=lambda c: name_scores[c])
+    if name_scores[name_col] < 0.5:
+        return None
+    columns = {"name": name_col}
+    for col in range(name_col + 1, width):
+        if share(col, lambda c: bool(_VALUE_CELL_RE.match(c))) >= 0.6:
+            columns["value"] = col
+            break
+    if "value" not in columns:
+        return None
+    for col in range(width):
+        if col in columns.values():
+            continue
+        if "unit" not in columns and share(col, lambda c: bool(_UNIT_CELL_RE.match(c))) >= 0.5:
+            columns["unit"] = col
+        elif "range" not in columns and share(col, lambda c: bool(_RANGE_CELL_RE.match(c))) >= 0.5:
+            columns["range"] = col
+    return columns
+
+
+def _cell(row: Cells, columns: Dict[str, int], role: str) -> str:
+    col = columns.get(role)
+    return _clean(row[col]) if col is not None and col < len(row) else ""
+
+
+def parse_row(row: Cells, columns: Dict[str, int], kb: LabKnowledgeBase, page: int) -> Optional[TableLabRow]:
+    """One lab row, or None when the name is not a lab test or the result is not numeric"""
+    name = _cell(row, columns, "name")
+    m = _VALUE_CELL_RE.match(_cell(row, columns, "value"))
+    if not name or m is None:
+        return None
+    value = _WS_RE.sub("", m.group("value"))
+    if not is_valid_lab_result(name, value.lstrip("<>≤≥").replace(",", "") or None, kb):
+        return None
+    unit = _cell(row, columns, "unit") or m.group("unit") or None
+    normal_range = _cell(row, columns, "range") or None
+    if normal_range:
+        # Keep only the numeric part ("70-110 mg/dL" -> "70-110") when it parses
+        bounds = re.sub(r"\s*(?:" + _UNITS + r")\s*$", "", normal_range, flags=re.IGNORECASE)
+        normal_range = bounds if parse_range(bounds) != (None, None) else normal_range
+    return TableLabRow(name, value, unit, normal_range, page, kb.is_known(name))
+
+
+def rows_to_labs(rows: Sequence[Cells], kb: LabKnowledgeBase, page: int = 0,
+                 columns: Optional[Dict[str, int]] = None) -> List[TableLabRow]:
+    """
+    Lab rows of one table. The header is looked for in the first three rows, otherwise
+    column roles are inferred from content. A table that is not well structured
+    (fewer than MIN_TABLE_ROWS rows or MIN_PARSED_SHARE of its data rows parsed) yields nothing.
+    """
+    rows = [list(r) for r in rows if r and any(_clean(c) for c in r)]
+    start = 0
+    if columns is None:
+        for i, row in enumerate(rows[:3]):
+            columns = header_columns(row)
+            if columns is not None:
+                start = i + 1
+                break
+        else:
+            columns = infer_columns(rows, kb)
+    if columns is None:
+        return []
+
+    data = rows[start:]
+    labs = [lab for lab in (parse_row(r, columns, kb, page) for r in data) if lab is not None]
+    if len(labs) < MIN_TABLE_ROWS or len(labs) < MIN_PARSED_SHARE * len(data):
+        return []
+    return labs
+
+
+def _word_lines(words: Sequence[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """Group pdfplumber words into visual lines (similar `top`), left to right"""
+    lines: List[List[Dict[str, Any]]] = []
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= WORD_Y_TOLERANCE:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def _phrases(line: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Header cells of a line: words closer than HEADER_WORD_GAP are joined, and a
+    word naming no column role (or the same role) joins the phrase before it
+    ("Test" + "Name", "Reference" + "Range").
+    """
+    phrases: List[Dict[str, Any]] = []
+    for word in line:
+        role = header_role(word["text"])
+        if phrases and (word["x0"] - phrases[-1]["x1"] < HEADER_WORD_GAP
+                        or role is None or role == header_role(phrases[-1]["text"])):
+            phrases[-1] = {"text": phrases[-1]["text"] + " " + word["text"],
+                           "x0": phrases[-1]["x0"], "x1": word["x1"]}
+        else:
+            phrases.append({"text": word["text"], "x0": word["x0"], "x1": word["x1"]})
+    return phrases
+
+
+def _split_by_columns(line: Sequence[Dict[str, Any]], starts: Sequence[float]) -> Cells:
+    """Assign each word to the last column starting left of the word's centre"""
+    cells: List[List[str]] = [[] for _ in starts]
+    for word in line:
+        centre = (word["x0"] + word["x1"]) / 2
+        col = 0
+        for i, x in enumerate(starts):
+            if centre >= x - HEADER_WORD_GAP:
+                col = i
+        cells[col].append(word["text"])
+    return [" ".join(c) or None for c in cells]
+
+
+def layout_table_labs(words: Sequence[Dict[str, Any]], kb: LabKnowledgeBase, page: int = 0) -> List[TableLabRow]:
+    """
+    Lab tables drawn without ruling lines: a header line naming a test and a result
+    column fixes the column positions, and the following lines are cut at those
+    positions until MAX_SKIPPED_LINES consecutive lines fail to parse.
+    """
+    labs: List[TableLabRow] = []
+    lines = _word_lines(words)
+    i = 0
+    while i < len(lines):
+        phrases = _phrases(lines[i])
+        columns = header_columns([p["text"] for p in phrases])
+        i += 1
+        if columns is None:
+            continue
+        starts = [p["x0"] for p in phrases]
+        rows: List[Cells] = []
+        skipped = 0
+        while i < len(lines) and skipped <= MAX_SKIPPED_LINES:
+            cells = _split_by_columns(lines[i], starts)
+            if header_columns(cells) is not None:
+                break
+            if parse_row(cells, columns, kb, page) is None:
+                skipped += 1
+            else:
+                skipped = 0
+                rows.append(cells)
+            i += 1
+        labs.extend(rows_to_labs(rows, kb, page, columns=columns))
+    return labs
+
+
+def extract_page_table_labs(page: Any, kb: LabKnowledgeBase, page_number: int = 0) -> List[TableLabRow]:
+    """
+    Structured lab rows of one pdfplumber page: ruled tables found by
+    `page.find_tables()` first, then column layout recovered from word positions.
+    """
+    labs: List[TableLabRow] = []
+    for table in page.find_tables():
+        labs.extend(rows_to_labs(table.extract(), kb, page_number))
+    if labs:
+        return labs
+    return layout_table_labs(page.extract_words(), kb, page_number)
+
+
+def page_table_labs(page_number: int, page: Any) -> List[TableLabRow]:
+    """
+    extract_page_table_labs() with the process-wide KB, as a page hook for
+    utils.extract_pdf_pages (module-level so it also runs in PDF worker processes)
+    """
+    try:
+        return extract_page_table_labs(page, get_lab_kb(), page_number)
+    except Exception as e:
+        print(f"⚠️ Table lab extraction failed on page {page_number}: {e}")
+        return []
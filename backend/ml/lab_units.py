@@ -0,0 +1,133 @@
+"""
+Lab value normalization: numeric parsing, unit canonicalization and conversion to KB units
+"""
+import re
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from ml.lab_kb import LabKnowledgeBase, LabTest
+
+# Spelling variants -> canonical unit spelling (keys are lower case, no spaces)
+UNIT_ALIASES: Dict[str, str] = {
+    "mg/dl": "mg/dL", "mg%": "mg/dL",
+    "g/dl": "g/dL", "g/l": "g/L", "mg/l": "mg/L",
+    "mmol/l": "mmol/L", "mmol/mol": "mmol/mol",
+    "umol/l": "µmol/L", "µmol/l": "µmol/L", "μmol/l": "µmol/L",
+    "nmol/l": "nmol/L", "pmol/l": "pmol/L",
+    "meq/l": "mEq/L",
+    "ug/dl": "µg/dL", "µg/dl": "µg/dL", "μg/dl": "µg/dL", "mcg/dl": "µg/dL",
+    "ug/ml": "µg/mL", "µg/ml": "µg/mL", "μg/ml": "µg/mL", "mcg/ml": "µg/mL",
+    "ug/l": "µg/L", "µg/l": "µg/L", "μg/l": "µg/L",
+    "ng/ml": "ng/mL", "ng/dl": "ng/dL", "ng/l": "ng/L", "pg/ml": "pg/mL",
+    "u/l": "U/L", "iu/l": "U/L", "mu/l": "mIU/L", "miu/l": "mIU/L", "uiu/ml": "mIU/L", "µiu/ml": "mIU/L",
+    "%": "%",
+    "10^3/ul": "10^3/uL", "10^3/µl": "10^3/uL", "x10^3/ul": "10^3/uL", "×10³/µl": "10^3/uL",
+    "×10³/ul": "10^3/uL", "k/ul": "10^3/uL", "10^9/l": "10^3/uL", "x10^9/l": "10^3/uL", "×10⁹/l": "10^3/uL",
+    "10^6/ul": "10^6/uL", "10^6/µl": "10^6/uL", "x10^6/ul": "10^6/uL", "m/ul": "10^6/uL",
+    "10^12/l": "10^6/uL", "x10^12/l": "10^6/uL",
+    "mm/hr": "mm/hr", "mm/h": "mm/hr",
+    "sec": "sec", "s": "sec", "seconds": "sec",
+    "mosm/kg": "mOsm/kg",
+    "ml/min/1.73m2": "mL/min/1.73m2", "ml/min/1.73m²": "mL/min/1.73m2", "ml/min": "mL/min/1.73m2",
+}
+
+# Conversions that hold for every analyte: (from, to) -> factor
+GENERIC_FACTORS: Dict[Tuple[str, str], float] = {
+    ("g/L", "g/dL"): 0.1,
+    ("mg/L", "mg/dL"): 0.1,
+    ("µg/L", "ng/mL"): 1.0,
+    ("ng/L", "pg/mL"): 1.0,
+    ("µg/mL", "mg/L"): 1.0,
+    ("mmol/L", "mEq/L"): 1.0,  # monovalent electrolytes
+    ("µg/L", "µg/dL"): 0.1,
+}
+
+_NUMBER_RE = re.compile(r"(?P<qualifier>[<>≤≥]=?)?\s*(?P<number>\d+(?:[.,]\d+)*)")
+_THOUSANDS_RE = re.compile(r"^\d{1,3}(?:,\d{3})+(?:\.\d+)?$")
+
+
+class NormalizedLab(NamedTuple):
+    canonical_name: Optional[str]
+    numeric_value: Optional[float]  # in `canonical_unit`
+    canonical_unit: Optional[str]
+    flag: Optional[str]  # "low" / "high" / "normal" against the KB range
+    qualifier: Optional[str]  # "<" / ">" when the report gives a bound
+
+
+def normalize_unit(unit: Optional[str]) -> Optional[str]:
+    """Canonical spelling of a unit ("mg/dl" -> "mg/dL"); unknown units are returned trimmed"""
+    if not unit or not unit.strip():
+        return None
+    key = re.sub(r"\s+", "", unit).lower()
+    return UNIT_ALIASES.get(key, unit.strip())
+
+
+def parse_numeric(raw: Optional[str]) -> Tuple[Optional[float], Optional[str]]:
+    """
+    First number in a raw lab value and its bound qualifier: "1,234" -> 1234.0,
+    "5,6" -> 5.6 (decimal comma), "<0.5" -> (0.5, "<"), "7.2 H" -> 7.2.
+    """
+    if raw is None:
+        return None, None
+    m = _NUMBER_RE.search(str(raw))
+    if m is None:
+        return None, None
+    number = m.group("number")
+    if _THOUSANDS_RE.match(number):
+        number = number.replace(",", "")
+    else:
+        number = number.replace(",", ".")
+        if number.count(".") > 1:
+            return None, None
+    qualifier = m.group("qualifier")
+    if qualifier:
+        qualifier = {"≤": "<", "≥": ">"}.get(qualifier[0], qualifier[0])
+    return float(number), qualifier
+
+
+def convert_value(value: float, from_unit: Optional[str], to_unit: Optional[str],
+                  test: Optional[LabTest] = None) -> Optional[float]:
+    """Convert between units (test-specific conversions first); None if no conversion is known"""
+    from_unit, to_unit = normalize_unit(from_unit), normalize_unit(to_unit)
+    if from_unit is None or to_unit is None or from_unit == to_unit:
+        return value
+    if test is not None:
+        test_unit = normalize_unit(test.unit)
+        conversions = {normalize_unit(u): spec for u, spec in test.conversions}
+        if to_unit == test_unit and from_unit in conversions:
+            factor, offset = conversions[from_unit]
+            return value * factor + offset
+        if from_unit == test_unit and to_unit in conversions:
+            factor, offset = conversions[to_unit]
+            return (value - offset) / factor
+    factor = GENERIC_FACTORS.get((from_unit, to_unit))
+    if factor is not None:
+        return value * factor
+    factor = GENERIC_FACTORS.get((to_unit, from_unit))
+    if factor is not None:
+        return value / factor
+    return None
+
+
+def normalize_lab(name: Optional[str], value: Optional[str], unit: Optional[str],
+                  kb: LabKnowledgeBase) -> NormalizedLab:
+    """
+    Canonical test name, numeric value in the KB unit and abnormal flag for one
+    extracted lab. The value stays in the reported unit (and is not flagged) when
+    the unit cannot be converted to the KB unit. A bound ("<0.5") is not flagged:
+    the number is a detection limit, not the reading.
+    """
+    test = kb.lookup(name) if name else None
+    number, qualifier = parse_numeric(value)
+    unit = normalize_unit(unit)
+    if test is None:
+        return NormalizedLab(None, number, unit, None, qualifier)
+    if number is None:
+        return NormalizedLab(test.name, None, normalize_unit(test.unit), None, qualifier)
+
+    canonical_unit = normalize_unit(test.unit)
+    converted = convert_value(number, unit, canonical_unit, test) if unit else number
+    if converted is None:
+        return NormalizedLab(test.name, number, unit, None, qualifier)
+    converted = round(converted, 4)
+    flag = test.flag(converted) if qualifier is None else None
+    return NormalizedLab(test.name, converted, canonical_unit or unit, flag, qualifier)
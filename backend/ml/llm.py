@@ -0,0 +1,294 @@
+"""
+Async LLM gateway: one shared provider, bounded concurrency and per-call timeouts
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Union
+
+from ml.circuit_breaker import CircuitBreaker
+from ml.llm_cache import LLMResponseCache, make_cache_key
+from ml.llm_providers import LLMProvider
+from ml.prompting import estimate_tokens
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "30"))
+# Do not start an LLM call with less than this much of the request deadline left
+LLM_MIN_CALL_BUDGET_S = float(os.getenv("LLM_MIN_CALL_BUDGET_S", "0.5"))
+
+# Absolute (monotonic) deadline of the request being served; inherited by child tasks and threads
+_request_deadline: ContextVar[Optional[float]] = ContextVar("llm_request_deadline", default=None)
+
+
+class LLMUnavailableError(Exception):
+    """The gateway refused to call the LLM; callers should use their fallback"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+class DeadlineExceededError(LLMUnavailableError):
+    pass
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]):
+    """Bound every LLM call made inside the block (including child tasks) by a shared deadline"""
+    token = _request_deadline.set(time.monotonic() + seconds if seconds is not None else None)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def deadline_remaining() -> Optional[float]:
+    """Seconds left before the current request deadline, None if there is none"""
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class LLMGateway:
+    """
+    Wraps a single provider instance so every request reuses its HTTP client.
+    At most `max_concurrency` calls are in flight; each call is bounded by `timeout`
+    and by the remaining request deadline. A circuit breaker short-circuits calls
+    while the provider is failing or slow.
+    Calls tagged with a prompt `template` (name + version) are served from `cache` when possible.
+    """
+
+    def __init__(self, provider: LLMProvider, max_concurrency: int = LLM_MAX_CONCURRENCY, timeout: float = LLM_TIMEOUT_S,
+                 cache: Optional[LLMResponseCache] = None, breaker: Optional[CircuitBreaker] = None):
+        self.provider = provider
+        self.model_name = f"{provider.name}:{provider.model_name}"
+        self.temperature = provider.temperature
+        self.cache = cache
+        self.breaker = breaker
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.stats: Dict[str, Any] = {
+            "calls": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "in_flight": 0,
+            "total_latency_ms": 0,
+            "cache_hits": 0,
+            "short_circuited": 0,
+            "deadline_skips": 0,
+            "prompt_tokens": 0,
+            "response_tokens": 0,
+        }
+        # Estimated token usage per prompt template (name without version)
+        self.token_stats: Dict[str, Dict[str, int]] = {}
+
+    def _cache_key(self, prompt: str, template: Optional[str]) -> Optional[str]:
+        if self.cache is None or not template:
+            return None
+        return make_cache_key(prompt, self.model_name, self.temperature, template)
+
+    def _cache_get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+        return cached
+
+    def _cache_set(self, key: Optional[str], text: str, template: Optional[str]):
+        if key is not None and text.strip():
+            self.cache.set(key, text, template or "")
+
+    async def _acache_get(self, key: Optional[str]) -> Optional[str]:
+        if key is None:
+            return None
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            self.stats["cache_hits"] += 1
+        return cached
+
+    async def _acache_set(self, key: Optional[str], text: str, template: Optional[str]):
+        if key is not None and text.strip():
+            await self.cache.aset(key, text, template or "")
+
+    def _call_budget(self, timeout: Optional[float]) -> float:
+        budget = timeout or self.timeout
+        remaining = deadline_remaining()
+        if remaining is not None:
+            if remaining < LLM_MIN_CALL_BUDGET_S:
+                self.stats["deadline_skips"] += 1
+                raise DeadlineExceededError("Request deadline exhausted")
+            budget = min(budget, remaining)
+        return budget
+
+    def _count_tokens(self, template: Optional[str], prompt: Optional[str] = None, response: Optional[str] = None):
+        """Add estimated prompt tokens (when the call starts) or response tokens (when it succeeds)"""
+        kind = (template or "untagged").split("-v", 1)[0]
+        entry = self.token_stats.setdefault(
+            kind, {"calls": 0, "prompt_tokens": 0, "response_tokens": 0, "max_prompt_tokens": 0})
+        if prompt is not None:
+            tokens = estimate_tokens(prompt)
+            entry["calls"] += 1
+            entry["prompt_tokens"] += tokens
+            entry["max_prompt_tokens"] = max(entry["max_prompt_tokens"], tokens)
+            self.stats["prompt_tokens"] += tokens
+        if response is not None:
+            tokens = estimate_tokens(response)
+            entry["response_tokens"] += tokens
+            self.stats["response_tokens"] += tokens
+
+    def _admit(self):
+        if self.breaker is not None and not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            raise CircuitOpenError("LLM circuit open")
+
+    def _record(self, ok: bool, started: float):
+        latency_ms = (time.perf_counter() - started) * 1000
+        self.stats["total_latency_ms"] += int(latency_ms)
+        if self.breaker is None:
+            return
+        if ok:
+            self.breaker.record_success(latency_ms)
+        else:
+            self.breaker.record_failure(latency_ms)
+
+    async def _guarded_call(self, prompt: str, template: Optional[str], state: Dict[str, float]) -> str:
+        async with self._semaphore:
+            # Admission happens after queueing so a half-open probe is never stuck waiting
+            self._admit()
+            state["started"] = time.perf_counter()
+            self.stats["calls"] += 1
+            self.stats["in_flight"] += 1
+            self._count_tokens(template, prompt=prompt)
+            try:
+                return await self.provider.agenerate(prompt, template)
+            finally:
+                self.stats["in_flight"] -= 1
+
+    async def ainvoke(self, prompt: str, timeout: Optional[float] = None, template: Optional[str] = None) -> str:
+        """Run one prompt without blocking the event loop; raises on error/timeout/open circuit"""
+        key = self._cache_key(prompt, template)
+        cached = await self._acache_get(key)
+        if cached is not None:
+            return cached
+
+        budget = self._call_budget(timeout)
+        state: Dict[str, float] = {}
+        try:
+            text = await asyncio.wait_for(self._guarded_call(prompt, template, state), budget)
+        except LLMUnavailableError:
+            raise
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            if "started" in state:
+                self._record(False, state["started"])
+            raise
+        except asyncio.CancelledError:
+            # Client went away: not the provider's fault, just free a half-open probe
+            if "started" in state and self.breaker is not None:
+                self.breaker.release_probe()
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            if "started" in state:
+                self._record(False, state["started"])
+            raise
+
+        self._record(True, state["started"])
+        self._count_tokens(template, response=text)
+        await self._acache_set(key, text, template)
+        return text
+
+    async def abatch(self, prompts: Sequence[str], timeout: Optional[float] = None,
+                     template: Optional[str] = None) -> List[Union[str, BaseException]]:
+        """Run many prompts concurrently (bounded by the semaphore); failures are returned, not raised"""
+        return await asyncio.gather(
+            *(self.ainvoke(prompt, timeout, template) for prompt in prompts),
+            return_exceptions=True,
+        )
+
+    async def astream(self, prompt: str, timeout: Optional[float] = None,
+                      template: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Stream response chunks under the same limits as ainvoke; `timeout` bounds the
+        whole stream. Cached responses are replayed as a single chunk.
+        """
+        key = self._cache_key(prompt, template)
+        cached = await self._acache_get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        budget = self._call_budget(timeout)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + budget
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), budget)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+
+        chunks: List[str] = []
+        started = None
+        try:
+            self._admit()
+            started = time.perf_counter()
+            self.stats["calls"] += 1
+            self.stats["in_flight"] += 1
+            self._count_tokens(template, prompt=prompt)
+            stream = self.provider.astream(prompt, template).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), deadline - loop.time())
+                except StopAsyncIteration:
+                    break
+                chunks.append(chunk)
+                yield chunk
+        except LLMUnavailableError:
+            raise
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            self._record(False, started)
+            raise
+        except (asyncio.CancelledError, GeneratorExit):
+            # Consumer went away mid-stream: no outcome for the breaker
+            if started is not None and self.breaker is not None:
+                self.breaker.release_probe()
+            raise
+        except Exception:
+            self.stats["errors"] += 1
+            self._record(False, started)
+            raise
+        finally:
+            if started is not None:
+                self.stats["in_flight"] -= 1
+            self._semaphore.release()
+
+        text = "".join(chunks)
+        self._record(True, started)
+        self._count_tokens(template, response=text)
+        await self._acache_set(key, text, template)
+
+    def invoke(self, prompt: str, template: Optional[str] = None) -> str:
+        """Blocking call for scripts and sync code paths"""
+        key = self._cache_key(prompt, template)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return cached
+
+        self._admit()
+        self.stats["calls"] += 1
+        self._count_tokens(template, prompt=prompt)
+        started = time.perf_counter()
+        try:
+            text = self.provider.generate(prompt, template)
+        except Exception:
+            self.stats["errors"] += 1
+            self._record(False, started)
+            raise
+        self._record(True, started)
+        self._count_tokens(template, response=text)
+        self._cache_set(key, text, template)
+        return text
@@ -0,0 +1,152 @@
+"""
+LLM response cache: in-memory LRU in front of a persistent SQLite tier
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from ml.lab_kb import DATA_DIR
+from ml.lru import LRUCache
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+# The disk tier stores prompts and responses (clinical text) unencrypted; opt in explicitly
+LLM_CACHE_DISK = os.getenv("LLM_CACHE_DISK", "false").lower() in ("1", "true", "yes")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(DATA_DIR, ".cache", "llm_cache.sqlite3"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so formatting-only differences map to the same key"""
+    return _WS_RE.sub(" ", prompt).strip()
+
+
+def make_cache_key(prompt: str, model_name: str, temperature: Optional[float], template: str) -> str:
+    """Hash of (model, temperature, template version, normalized prompt)"""
+    payload = json.dumps(
+        [model_name, temperature, template, normalize_prompt(prompt)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache for prompt -> response text.
+    Memory hits cost a dict lookup; disk hits (only with a `path`, see
+    LLM_CACHE_DISK) survive restarts and are shared by all workers on the host.
+    Entries expire after `ttl` seconds. aget()/aset() run the SQLite tier in a
+    worker thread so event loop callers never block on disk.
+    """
+
+    def __init__(self, path: Optional[str] = LLM_CACHE_PATH if LLM_CACHE_DISK else None, maxsize: int = LLM_CACHE_SIZE, ttl: float = LLM_CACHE_TTL_S):
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self.disk_hits = 0
+        self.writes = 0
+        self.expired = 0
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                self._conn = sqlite3.connect(path, check_same_thread=False)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS llm_cache ("
+                    "key TEXT PRIMARY KEY, template TEXT, response TEXT NOT NULL, created_at REAL NOT NULL)")
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ LLM cache disk tier disabled: {e}")
+                self._conn = None
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None or self._conn is None:
+            return value
+        return self._disk_get(key)
+
+    async def aget(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is not None or self._conn is None:
+            return value
+        return await asyncio.to_thread(self._disk_get, key)
+
+    def _disk_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f"⚠️ LLM cache read failed: {e}")
+                return None
+            if row is None:
+                return None
+            response, created_at = row
+            if time.time() - created_at > self.ttl:
+                self.expired += 1
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+        self.disk_hits += 1
+        self.memory.set(key, response, stored_at=created_at)
+        return response
+
+    def set(self, key: str, response: str, template: str = ""):
+        now = time.time()
+        self.memory.set(key, response, stored_at=now)
+        self.writes += 1
+        if self._conn is not None:
+            self._disk_set(key, response, template, now)
+
+    async def aset(self, key: str, response: str, template: str = ""):
+        now = time.time()
+        self.memory.set(key, response, stored_at=now)
+        self.writes += 1
+        if self._conn is not None:
+            await asyncio.to_thread(self._disk_set, key, response, template, now)
+
+    def _disk_set(self, key: str, response: str, template: str, now: float):
+        with self._lock:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, template, response, created_at) VALUES (?, ?, ?, ?)",
+                    (key, template, response, now))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                print(f"⚠️ LLM cache write failed: {e}")
+
+    def purge_expired(self) -> int:
+        """Delete expired rows from the disk tier"""
+        if self._conn is None:
+            return 0
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+            self._conn.commit()
+            return cur.rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        memory = self.memory.stats()
+        lookups = memory["hits"] + memory["misses"]
+        hits = memory["hits"] + self.disk_hits
+        disk_entries = None
+        if self._conn is not None:
+            with self._lock:
+                disk_entries = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "memory": memory,
+            "disk_hits": self.disk_hits,
+            "disk_entries": disk_entries,
+            "writes": self.writes,
+            "expired": self.expired,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,215 @@
+"""
+LLM providers: Gemini for production, a local deterministic stub for offline load tests
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Union
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-2.5-flash-lite")
+GEMINI_TEMPERATURE = float(os.getenv("GEMINI_TEMPERATURE", "0.7"))
+GEMINI_MAX_TOKENS = int(os.getenv("GEMINI_MAX_TOKENS", "1000"))
+GEMINI_TIMEOUT_S = float(os.getenv("GEMINI_TIMEOUT_S", "30"))
+
+
+class LLMProviderError(Exception):
+    """Raised by providers for failed generations (including injected stub failures)"""
+
+
+def response_text(response: Any) -> str:
+    """Extract plain text from a LangChain chat response (or anything str-able)"""
+    text = getattr(response, "text", "")
+    if callable(text):
+        text = text()
+    if not text:
+        text = getattr(response, "content", "") or str(response)
+    return text if isinstance(text, str) else str(text)
+
+
+def chunk_text(chunk: Any) -> str:
+    """Text of one streamed LangChain message chunk ("" for empty/metadata-only chunks)"""
+    content = getattr(chunk, "content", "")
+    if isinstance(content, list):
+        content = "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content)
+    return content if isinstance(content, str) else str(content)
+
+
+class LLMProvider(ABC):
+    """Interface used by the LLM gateway; `template` names the prompt kind and version"""
+    name = "base"
+    model_name = "unknown"
+    temperature: Optional[float] = None
+
+    @abstractmethod
+    async def agenerate(self, prompt: str, template: Optional[str] = None) -> str:
+        """Full response text for one prompt"""
+
+    @abstractmethod
+    def generate(self, prompt: str, template: Optional[str] = None) -> str:
+        """Blocking variant of agenerate() for scripts and sync code paths"""
+
+    async def astream(self, prompt: str, template: Optional[str] = None) -> AsyncIterator[str]:
+        """Yield the response in chunks; providers without streaming yield it in one piece"""
+        yield await self.agenerate(prompt, template)
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini through LangChain; the client is created on first use and then reused"""
+    name = "gemini"
+
+    def __init__(self, model_name: str = GEMINI_MODEL_NAME, temperature: float = GEMINI_TEMPERATURE,
+                 max_tokens: int = GEMINI_MAX_TOKENS, timeout: float = GEMINI_TIMEOUT_S,
+                 api_key: Optional[str] = None):
+        self.model_name = model_name
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.api_key = api_key or os.getenv("GOOGLE_API_KEY")
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    self._model = ChatGoogleGenerativeAI(
+                        model=self.model_name,
+                        temperature=self.temperature,
+                        google_api_key=self.api_key,
+                        max_tokens=self.max_tokens,
+                        timeout=self.timeout,
+                    )
+        return self._model
+
+    async def agenerate(self, prompt: str, template: Optional[str] = None) -> str:
+        return response_text(await self.model.ainvoke(prompt))
+
+    def generate(self, prompt: str, template: Optional[str] = None) -> str:
+        return response_text(self.model.invoke(prompt))
+
+    async def astream(self, prompt: str, template: Optional[str] = None) -> AsyncIterator[str]:
+        async for chunk in self.model.astream(prompt):
+            text = chunk_text(chunk)
+            if text:
+                yield text
+
+
+_STUB_LAB_LINE_RE = re.compile(
+    r"([A-Za-z][A-Za-z0-9 /-]{1,30}?)\s*[:=]?\s*(\d+(?:\.\d+)?)\s*([A-Za-z%/^µ0-9.]+/[A-Za-z0-9.]+|%)?")
+_STUB_WORD_RE = re.compile(r"[A-Za-z][A-Za-z-]{3,}")
+
+
+_STUB_DOC_MARKER_RE = re.compile(r"^=== DOCUMENT (\w+) ===$", re.M)
+
+
+def _stub_labs(body: str):
+    return [{"test": m.group(1).strip(), "value": m.group(2), "unit": m.group(3) or ""}
+            for m in _STUB_LAB_LINE_RE.finditer(body)]
+
+
+def _stub_lab_response(prompt: str) -> str:
+    """Echo "Name value unit" pairs found in the prompt's text section as the lab JSON array"""
+    body = prompt.split("Text to analyze:", 1)[-1].split("Return ONLY the JSON", 1)[0]
+    return json.dumps(_stub_labs(body))
+
+
+def _stub_lab_batch_response(prompt: str) -> str:
+    """Same as _stub_lab_response, keyed by the document ids of a batched prompt"""
+    body = prompt.split("Text to analyze:", 1)[-1].split("Return ONLY the JSON", 1)[0]
+    parts = _STUB_DOC_MARKER_RE.split(body)
+    return json.dumps({doc_id: _stub_labs(section) for doc_id, section in zip(parts[1::2], parts[2::2])})
+
+
+def _stub_summary_text(prompt: str) -> str:
+    words = _STUB_WORD_RE.findall(prompt.split("Detected disease entities:", 1)[-1])[:12]
+    return "Stub summary mentioning " + ", ".join(words) + "."
+
+
+def _stub_summary_response(prompt: str) -> str:
+    return json.dumps({"clinical_summary": _stub_summary_text(prompt)})
+
+
+class StubProvider(LLMProvider):
+    """
+    Offline stand-in for load tests and benchmarks. Latency is drawn from a
+    seeded log-normal distribution (median `latency_ms`, shape `latency_sigma`),
+    `failure_rate` of calls raise LLMProviderError, and responses are canned per
+    template (a string or a callable taking the prompt).
+    """
+    name = "stub"
+
+    def __init__(self, latency_ms: float = 800.0, latency_sigma: float = 0.5, failure_rate: float = 0.0,
+                 seed: Optional[int] = 0, responses: Optional[Dict[str, Union[str, Callable[[str], str]]]] = None):
+        self.model_name = "stub"
+        self.temperature = 0.0
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.responses: Dict[str, Union[str, Callable[[str], str]]] = {
+            "lab_extraction": _stub_lab_response,
+            "lab_extraction_batch": _stub_lab_batch_response,
+            "summary": _stub_summary_response,
+            "summary_stream": _stub_summary_text,
+        }
+        self.responses.update(responses or {})
+
+    def _draw(self):
+        with self._lock:
+            delay = self._rng.lognormvariate(0.0, self.latency_sigma) * self.latency_ms / 1000.0
+            fail = self._rng.random() < self.failure_rate
+        return delay, fail
+
+    def _respond(self, prompt: str, template: Optional[str]) -> str:
+        kind = (template or "").split("-v", 1)[0]
+        response = self.responses.get(kind, "OK")
+        return response(prompt) if callable(response) else response
+
+    async def agenerate(self, prompt: str, template: Optional[str] = None) -> str:
+        delay, fail = self._draw()
+        await asyncio.sleep(delay)
+        if fail:
+            raise LLMProviderError("Injected stub failure")
+        return self._respond(prompt, template)
+
+    def generate(self, prompt: str, template: Optional[str] = None) -> str:
+        delay, fail = self._draw()
+        time.sleep(delay)
+        if fail:
+            raise LLMProviderError("Injected stub failure")
+        return self._respond(prompt, template)
+
+    async def astream(self, prompt: str, template: Optional[str] = None) -> AsyncIterator[str]:
+        """Word-sized chunks; about a third of the drawn latency passes before the first one"""
+        delay, fail = self._draw()
+        await asyncio.sleep(delay * 0.3)
+        if fail:
+            raise LLMProviderError("Injected stub failure")
+        words = re.findall(r"\S+\s*", self._respond(prompt, template)) or [""]
+        for word in words:
+            yield word
+            await asyncio.sleep(delay * 0.7 / len(words))
+
+
+def get_llm_provider(name: Optional[str] = None) -> LLMProvider:
+    """Provider selected by LLM_PROVIDER ("gemini" default, or "stub" configured by LLM_STUB_* vars)"""
+    name = (name or os.getenv("LLM_PROVIDER", "gemini")).lower()
+    if name == "stub":
+        seed = os.getenv("LLM_STUB_SEED", "0")
+        return StubProvider(
+            latency_ms=float(os.getenv("LLM_STUB_LATENCY_MS", "800")),
+            latency_sigma=float(os.getenv("LLM_STUB_LATENCY_SIGMA", "0.5")),
+            failure_rate=float(os.getenv("LLM_STUB_FAILURE_RATE", "0")),
+            seed=int(seed) if seed else None,
+        )
+    if name == "gemini":
+        return GeminiProvider()
+    raise ValueError(f"Unknown LLM provider: {name}")
@@ -0,0 +1,66 @@
+"""
+Bounded LRU cache with optional TTL and hit/miss counters
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU mapping; entries older than `ttl` seconds are treated as misses"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is not _MISSING:
+                value, stored_at = item
+                if self.ttl is None or time.time() - stored_at <= self.ttl:
+                    self._data.move_to_end(key)
+                    if count:
+                        self.hits += 1
+                    return value
+                del self._data[key]
+            if count:
+                self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any, stored_at: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, stored_at if stored_at is not None else time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
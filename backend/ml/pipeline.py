@@ -0,0 +1,100 @@
+"""
+Small async DAG executor for per-document processing stages
+"""
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+
+class PipelineDAG:
+    """
+    Stages are callables whose keyword arguments are the names of the stages
+    (or initial inputs) they depend on. A stage starts as soon as all of its
+    dependencies have finished. Coroutine functions are awaited; plain
+    functions run in a worker thread unless added with inline=True.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Tuple[Callable, Tuple[str, ...], bool]] = {}
+
+    def add(self, name: str, func: Callable, deps: Iterable[str] = (), inline: bool = False) -> "PipelineDAG":
+        if name in self._stages:
+            raise ValueError(f"Stage '{name}' already defined")
+        self._stages[name] = (func, tuple(deps), inline)
+        return self
+
+    def _check(self, inputs: Dict[str, Any]):
+        known = set(inputs) | set(self._stages)
+        for name, (_, deps, _) in self._stages.items():
+            missing = [d for d in deps if d not in known]
+            if missing:
+                raise ValueError(f"Stage '{name}' depends on unknown {missing}")
+
+        # Detect cycles with a DFS over stage dependencies
+        state: Dict[str, int] = {}
+
+        def visit(name: str):
+            if state.get(name) == 1:
+                raise ValueError(f"Cycle detected at stage '{name}'")
+            if state.get(name) == 2 or name not in self._stages:
+                return
+            state[name] = 1
+            for dep in self._stages[name][1]:
+                visit(dep)
+            state[name] = 2
+
+        for name in self._stages:
+            visit(name)
+
+    async def run(self, on_stage: Optional[Callable[[str, Any], None]] = None,
+                  **inputs) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        """
+        Execute all stages. Returns (results, timings_ms) where results holds the
+        inputs plus every stage output and timings_ms the wall time of each stage.
+        `on_stage(name, value)` is called on the event loop as each stage finishes.
+        """
+        self._check(inputs)
+        loop = asyncio.get_running_loop()
+        results: Dict[str, Any] = dict(inputs)
+        timings: Dict[str, int] = {}
+        done: Dict[str, asyncio.Future] = {name: loop.create_future() for name in self._stages}
+        for name in inputs:
+            done.setdefault(name, loop.create_future())
+            if not done[name].done():
+                done[name].set_result(None)
+
+        async def run_stage(name: str):
+            func, deps, inline = self._stages[name]
+            await asyncio.gather(*(done[d] for d in deps))
+            kwargs = {d: results[d] for d in deps}
+            started = time.perf_counter()
+            try:
+                if inspect.iscoroutinefunction(func):
+                    value = await func(**kwargs)
+                elif inline:
+                    value = func(**kwargs)
+                else:
+                    value = await asyncio.to_thread(func, **kwargs)
+            except BaseException as e:
+                done[name].set_exception(e)
+                raise
+            finally:
+                timings[name] = int((time.perf_counter() - started) * 1000)
+            results[name] = value
+            done[name].set_result(None)
+            if on_stage is not None:
+                on_stage(name, value)
+
+        tasks = [asyncio.create_task(run_stage(name)) for name in self._stages]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            # Consume exceptions of dependency futures nobody awaited
+            for fut in done.values():
+                if fut.done() and not fut.cancelled():
+                    fut.exception()
+            raise
+        return results, timings
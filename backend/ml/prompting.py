@@ -0,0 +1,125 @@
+"""
+Prompt size accounting and compaction: token estimates, compact entity lists, relevance-trimmed context
+"""
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+from ml.aggregation import normalize_entity_name, normalize_value
+from ml.lab_kb import normalize_lab_name
+
+_HAS_NUMBER_RE = re.compile(r"\d")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English/Latin text)"""
+    return (len(text) + 3) // 4
+
+
+def _field(entity: Any, name: str) -> Any:
+    return entity.get(name) if isinstance(entity, dict) else getattr(entity, name, None)
+
+
+def fit_lines(lines: Sequence[str], token_budget: int) -> List[str]:
+    """Keep lines in order while they fit in `token_budget`; note how many were dropped"""
+    kept: List[str] = []
+    used = 0
+    for i, line in enumerate(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > token_budget:
+            kept.append(f"... {len(lines) - i} more")
+            break
+        kept.append(line)
+        used += cost
+    return kept
+
+
+def compact_diseases(diseases: Sequence[Any], min_confidence: float = 0.0) -> List[str]:
+    """
+    "name (label)" lines, one per distinct disease (normalized name), in order of
+    first mention. Mentions below `min_confidence` are dropped unless that would drop everything.
+    """
+    best: Dict[str, Any] = {}
+    for d in diseases:
+        name = (_field(d, "text") or "").strip()
+        key = normalize_entity_name(name)
+        if not key:
+            continue
+        confidence = float(_field(d, "confidence") or 0.0)
+        if key not in best or confidence > best[key][1]:
+            best[key] = (name, confidence, _field(d, "entity_type") or "")
+    entries = list(best.values())
+    confident = [e for e in entries if e[1] >= min_confidence]
+    return [f"{name} ({label})" if label else name for name, _, label in (confident or entries)]
+
+
+def compact_labs(labs: Sequence[Any]) -> List[str]:
+    """
+    One line per lab test: repeated readings are collapsed
+    ("Glucose: 110 mg/dL, 126 mg/dL (normal 70-110)") and exact duplicates removed.
+    """
+    grouped: Dict[str, Dict[str, Any]] = {}
+    for l in labs:
+        name = (_field(l, "text") or "").strip()
+        key = normalize_lab_name(name)
+        if not key:
+            continue
+        entry = grouped.setdefault(key, {"name": name, "values": {}, "normal_range": None})
+        entry["normal_range"] = entry["normal_range"] or _field(l, "normal_range")
+        value = (_field(l, "value") or "").strip()
+        if value:
+            unit = (_field(l, "unit") or "").strip()
+            entry["values"].setdefault((normalize_value(value), unit.lower()), f"{value} {unit}".strip())
+    lines = []
+    for entry in grouped.values():
+        values = ", ".join(entry["values"].values()) or "-"
+        normal = f" (normal {entry['normal_range']})" if entry["normal_range"] else ""
+        lines.append(f"{entry['name']}: {values}{normal}")
+    return lines
+
+
+def keyword_pattern(keywords: Sequence[str], max_keywords: int = 200) -> Optional[re.Pattern]:
+    """Case-insensitive alternation of whole-word keywords (longest first)"""
+    words = sorted({k.strip().lower() for k in keywords if k and len(k.strip()) > 1}, key=len, reverse=True)
+    if not words:
+        return None
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(w) for w in words[:max_keywords]) + r")(?!\w)",
+                      re.IGNORECASE)
+
+
+def select_context(text: str, keywords: Sequence[str], token_budget: int) -> str:
+    """
+    Fit report text into `token_budget` by relevance rather than position: lines
+    mentioning the most distinct keywords (entity names) come first, then lines
+    with numbers, then the rest. Selected lines keep their original order; gaps
+    are marked with "...".
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+    pattern = keyword_pattern(keywords)
+    lines = [line.strip() for line in text.splitlines()]
+    scored = []
+    for i, line in enumerate(lines):
+        if not line:
+            continue
+        hits = len({m.group(0).lower() for m in pattern.finditer(line)}) if pattern else 0
+        score = hits * 3 + (1 if _HAS_NUMBER_RE.search(line) else 0)
+        scored.append((-score, i))
+    scored.sort()
+
+    chosen = set()
+    used = 0
+    for _, i in scored:
+        cost = estimate_tokens(lines[i]) + 1
+        if used + cost > token_budget:
+            continue
+        chosen.add(i)
+        used += cost
+
+    out: List[str] = []
+    last = None
+    for i in sorted(chosen):
+        if last is not None and i != last + 1:
+            out.append("...")
+        out.append(lines[i])
+        last = i
+    return "\n".join(out)
@@ -0,0 +1,13 @@
+"""
+Server-sent event formatting helpers
+"""
+import json
+from typing import Any
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+SSE_KEEPALIVE = ": keep-alive\n\n"
+
+
+def format_sse(event: str, data: Any) -> str:
+    """One SSE message; `data` is JSON-encoded"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
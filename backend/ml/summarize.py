@@ -0,0 +1,106 @@
+"""
+Hierarchical (map-reduce) summarization over many per-document summaries
+"""
+import asyncio
+import os
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+# (label, summary text), e.g. ("Document 3: cbc.pdf", "Hemoglobin low ...")
+SummaryItem = Tuple[str, str]
+ReduceFn = Callable[[List[SummaryItem], bool], Awaitable[str]]
+
+CONSOLIDATED_GROUP_SIZE = int(os.getenv("CONSOLIDATED_GROUP_SIZE", "8"))
+# Per-item cap so a reduce prompt never exceeds group_size * this many characters of summaries
+CONSOLIDATED_ITEM_MAX_CHARS = int(os.getenv("CONSOLIDATED_ITEM_MAX_CHARS", "800"))
+
+_SENTENCE_RE = re.compile(r"(?<=[.?!])\s+")
+
+
+def clip_summary(text: str, max_chars: int = CONSOLIDATED_ITEM_MAX_CHARS) -> str:
+    """Cut a summary to `max_chars`, preferring a sentence boundary"""
+    text = " ".join((text or "").split())
+    if len(text) <= max_chars:
+        return text
+    clipped = text[:max_chars]
+    cut = max(clipped.rfind(". "), clipped.rfind("? "), clipped.rfind("! "))
+    return clipped[:cut + 1] if cut > max_chars // 2 else clipped.rstrip() + "…"
+
+
+def merge_first_sentences(items: Sequence[SummaryItem], max_chars: int = CONSOLIDATED_ITEM_MAX_CHARS) -> str:
+    """Deterministic merge used when a reduce call fails: the first sentence of every item"""
+    firsts = []
+    for _, text in items:
+        sentence = _SENTENCE_RE.split(text.strip(), 1)[0] if text.strip() else ""
+        if sentence:
+            firsts.append(sentence)
+    return clip_summary(" ".join(firsts), max_chars)
+
+
+def document_range_label(numbers: Sequence[int]) -> str:
+    """ "Documents 1-3, 5" for the (sorted) document numbers a merged summary covers"""
+    runs: List[List[int]] = []
+    for number in numbers:
+        if runs and number == runs[-1][1] + 1:
+            runs[-1][1] = number
+        else:
+            runs.append([number, number])
+    return "Documents " + ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in runs)
+
+
+async def reduce_summaries(items: Sequence[SummaryItem], reduce_group: ReduceFn,
+                           group_size: int = CONSOLIDATED_GROUP_SIZE,
+                           numbers: Optional[Sequence[int]] = None) -> Tuple[str, Dict[str, int]]:
+    """
+    Reduce item summaries level by level. Each level merges groups of at most
+    `group_size` items concurrently (reduce_group(group, final=False)) until a
+    single group is left, which is merged with final=True. Prompt size is bounded
+    by group_size * CONSOLIDATED_ITEM_MAX_CHARS regardless of the number of items.
+    A failed group falls back to merge_first_sentences. A single item is returned as is.
+    `numbers` are the document numbers of the items (default 1..n); merged groups
+    are labelled with the documents they cover, so skipped documents leave gaps.
+    Returns (summary, stats) with stats = {"levels", "reduce_calls", "reduce_failures"}.
+    """
+    if group_size < 2:
+        raise ValueError("group_size must be at least 2")
+    stats = {"levels": 0, "reduce_calls": 0, "reduce_failures": 0}
+    if numbers is None:
+        numbers = range(1, len(items) + 1)
+    kept = [((label, clip_summary(text)), number)
+            for (label, text), number in zip(items, numbers) if text and text.strip()]
+    current = [item for item, _ in kept]
+    covered = [[number] for _, number in kept]
+    if not current:
+        return "", stats
+    if len(current) == 1:
+        return current[0][1], stats
+
+    async def run(group: List[SummaryItem], final: bool) -> str:
+        stats["reduce_calls"] += 1
+        try:
+            merged = await reduce_group(group, final)
+        except Exception as e:
+            print(f"[reduce_summaries] group reduce failed: {e!r}")
+            merged = ""
+        if not merged.strip():
+            stats["reduce_failures"] += 1
+            return merge_first_sentences(group)
+        return clip_summary(merged)
+
+    while len(current) > group_size:
+        stats["levels"] += 1
+        groups = [current[i:i + group_size] for i in range(0, len(current), group_size)]
+        covered = [sum(covered[i:i + group_size], []) for i in range(0, len(covered), group_size)]
+        merged = await asyncio.gather(
+            *(run(group, False) if len(group) > 1 else _passthrough(group) for group in groups))
+        current = [
+            (group[0][0] if len(group) == 1 else document_range_label(group_numbers), text)
+            for group, group_numbers, text in zip(groups, covered, merged)
+        ]
+
+    stats["levels"] += 1
+    return await run(current, True), stats
+
+
+async def _passthrough(group: List[SummaryItem]) -> str:
+    return group[0][1]
@@ -0,0 +1,155 @@
+"""
+Background jobs for deferred clinical summary generation
+"""
+import asyncio
+import inspect
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from ml.sse import SSE_KEEPALIVE, format_sse
+
+SUMMARY_JOB_WORKERS = int(os.getenv("SUMMARY_JOB_WORKERS", "2"))
+SUMMARY_JOB_RETENTION = int(os.getenv("SUMMARY_JOB_RETENTION", "1000"))
+# Finished jobs are dropped this many seconds after finishing
+SUMMARY_JOB_TTL_S = float(os.getenv("SUMMARY_JOB_TTL_S", "3600"))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class SummaryJob:
+    def __init__(self, func: Callable[[], Awaitable[Any]], record_id: Optional[str] = None,
+                 on_done: Optional[Callable[["SummaryJob"], Any]] = None):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.on_done = on_done
+        self.record_id = record_id
+        self.status = PENDING
+        self.summary: Optional[Dict[str, str]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "record_id": self.record_id,
+            "summary": self.summary,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SummaryJobManager:
+    """
+    Queue of summary jobs consumed by a few worker tasks on the event loop.
+    Finished jobs are kept (up to `retention`, for at most `ttl` seconds) so clients
+    can poll or stream their result.
+    """
+
+    def __init__(self, workers: int = SUMMARY_JOB_WORKERS, retention: int = SUMMARY_JOB_RETENTION,
+                 ttl: float = SUMMARY_JOB_TTL_S):
+        self.workers = workers
+        self.retention = retention
+        self.ttl = ttl
+        self._jobs: "OrderedDict[str, SummaryJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+        self.completed = 0
+        self.failed = 0
+
+    def _ensure_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._worker_tasks = [t for t in self._worker_tasks if not t.done()]
+        while len(self._worker_tasks) < self.workers:
+            self._worker_tasks.append(asyncio.create_task(self._worker()))
+
+    def submit(self, func: Callable[[], Awaitable[Any]], record_id: Optional[str] = None,
+               on_done: Optional[Callable[[SummaryJob], Any]] = None) -> SummaryJob:
+        """Queue `func` (a coroutine function returning the summary block); must be called on the event loop"""
+        self._ensure_workers()
+        job = SummaryJob(func, record_id=record_id, on_done=on_done)
+        self._jobs[job.id] = job
+        self._evict()
+        self._queue.put_nowait(job)
+        return job
+
+    def _evict(self):
+        """Drop finished jobs past the TTL, then the oldest finished ones while over `retention`"""
+        now = time.time()
+        excess = len(self._jobs) - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and (excess > 0 or now - job.finished_at > self.ttl):
+                del self._jobs[job_id]
+                excess -= 1
+
+    def get(self, job_id: str) -> Optional[SummaryJob]:
+        return self._jobs.get(job_id)
+
+    def _set_status(self, job: SummaryJob, status: str):
+        job.status = status
+        job.changed.set()
+        job.changed = asyncio.Event()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                self._set_status(job, RUNNING)
+                try:
+                    job.summary = await job.func()
+                    job.finished_at = time.time()
+                    self.completed += 1
+                    final = DONE
+                except Exception as e:
+                    job.error = str(e) or type(e).__name__
+                    job.finished_at = time.time()
+                    self.failed += 1
+                    final = FAILED
+                job.func = None
+                if job.on_done is not None:
+                    try:
+                        if inspect.iscoroutinefunction(job.on_done):
+                            await job.on_done(job)
+                        else:
+                            await asyncio.to_thread(job.on_done, job)
+                    except Exception as e:
+                        print(f"[summary_jobs] on_done failed for {job.id}: {e}")
+                self._set_status(job, final)
+            finally:
+                self._queue.task_done()
+
+    async def events(self, job: SummaryJob, heartbeat: float = 15.0) -> AsyncIterator[str]:
+        """Server-sent events: a "status" event per change, then a final "done"/"failed" event"""
+        while True:
+            event = job.status if job.finished else "status"
+            yield format_sse(event, job.as_dict())
+            if job.finished:
+                return
+            changed = job.changed
+            try:
+                await asyncio.wait_for(changed.wait(), heartbeat)
+            except asyncio.TimeoutError:
+                yield SSE_KEEPALIVE
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "tracked_jobs": len(self._jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "workers": self.workers,
+        }
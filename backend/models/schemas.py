@@ -1,8 +1,8 @@
 """
 Pydantic models/schemas for request/response validation
 """
-from pydantic import BaseModel, EmailStr
-from typing import Optional, Dict, List, Any
+from pydantic import BaseModel, EmailStr, Field
+from typing import Optional, Dict, List, Any, Tuple
 from datetime import datetime
 
 
@@ -52,6 +52,17 @@ class Entity(BaseModel):
     value: Optional[str] = None
     unit: Optional[str] = None
     normal_range: Optional[str] = None
+    # Lab normalization (ml/lab_units.py): KB test name, value in the KB unit, low/high/normal
+    canonical_name: Optional[str] = None
+    numeric_value: Optional[float] = None
+    canonical_unit: Optional[str] = None
+    flag: Optional[str] = None
+    # "<" / ">" when numeric_value is a reported bound ("<0.5"), not the reading itself
+    qualifier: Optional[str] = None
+    # Extractors that reported this lab ("table", "regex", "rag"), the kept one first
+    sources: Optional[List[str]] = None
+    # (start, end) of the page of a table row not located in the text; lab merging only
+    page_span: Optional[Tuple[int, int]] = Field(None, exclude=True)
 
 
 class CombinedNERResponse(BaseModel):
@@ -60,11 +71,15 @@ class CombinedNERResponse(BaseModel):
     diseases: List[Entity]
     lab_results: List[Entity]
     summary: Optional[Dict[str, str]] = None
+    summary_status: Optional[str] = None
+    summary_job_id: Optional[str] = None
+    record_id: Optional[str] = None
 
 
 class TextRequest(BaseModel):
     text: str
     icd_map: bool = False
+    summary_mode: str = "sync"
 
 
 class StoredRecord(BaseModel):
@@ -83,6 +98,7 @@ class RecordDetail(StoredRecord):
     lab_results: List[Entity]
     summary: Optional[Dict[str, str]] = None
     metadata: Optional[Dict[str, Any]] = None
+    summary_status: Optional[str] = None
 
 
 class SearchQuery(BaseModel):
@@ -1,16 +1,17 @@
 # rag.py (modified to include import time in responses)
 from fastapi import HTTPException
+import asyncio
 import re
 import time
 from datetime import datetime, timedelta
 from fastapi.security import OAuth2PasswordBearer
-from typing import Any, Dict, List, Optional, Annotated
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple, Annotated
 
-from fastapi import FastAPI, UploadFile, File, Form, Depends
-from pydantic import BaseModel
+from fastapi import FastAPI, UploadFile, File, Form, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field
 from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
 import torch
-import tempfile
 import os
 import numpy as np
 from passlib.context import CryptContext
@@ -18,13 +19,35 @@ from jose import JWTError, jwt
 import faiss
 from sentence_transformers import SentenceTransformer
 import json
-from langchain_google_genai import ChatGoogleGenerativeAI
-from utils import extract_text_from_pdf, normalize_icd
+from utils import PdfPages, extract_pdf_pages, normalize_icd_batch
+from ml.lab_kb import get_lab_kb
+from ml.icd_index import get_icd_index, get_icd_mapper
+from ml.icd_embeddings import IcdEmbeddingIndex
+from ml import lab_regex
+from ml.circuit_breaker import CircuitBreaker
+from ml.llm import LLMGateway, LLMUnavailableError, request_deadline
+from ml.llm_providers import get_llm_provider
+from ml.llm_cache import LLMResponseCache, LLM_CACHE_ENABLED
+from ml.pipeline import PipelineDAG
+from ml.batching import MicroBatcher, split_keyed_batch
+from ml.summary_jobs import SummaryJob, SummaryJobManager
+from ml.sse import SSE_HEADERS, format_sse
+from ml.summarize import SummaryItem, reduce_summaries
+from ml.aggregation import aggregate_diseases, aggregate_labs, format_aggregate
+from ml.prompting import compact_diseases, compact_labs, estimate_tokens, fit_lines, select_context
+from ml.lab_tables import TableLabRow, page_table_labs
+from ml.lab_units import convert_value, normalize_lab, parse_numeric
+from ml.lab_merge import merge_lab_entities
+from ml.lab_sections import (
+    batch_sections, find_lab_lines, group_sections, locate_lab_offsets, locate_value,
+    unexplained_lab_lines
+)
 from fastapi.middleware.cors import CORSMiddleware
 from pymongo import MongoClient
 from bson import ObjectId
 from datetime import datetime
 import uuid
+from functools import partial
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -43,14 +66,28 @@ GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
 print("GEMINI_API_KEY present:", bool(GEMINI_API_KEY))
 
 
-# instantiate model (keep as you had)
-model = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash-lite",
-    temperature=0.7,
-    google_api_key=GEMINI_API_KEY,
-    max_tokens=1000,
-    timeout=30
-)
+# LLM provider: Gemini by default, LLM_PROVIDER=stub for offline load tests
+llm_provider = get_llm_provider()
+print(f"LLM provider: {llm_provider.name} ({llm_provider.model_name})")
+
+# All LLM calls go through the gateway (shared client, bounded concurrency, timeouts)
+llm_cache = LLMResponseCache() if LLM_CACHE_ENABLED else None
+llm_breaker = CircuitBreaker()
+llm_gateway = LLMGateway(llm_provider, cache=llm_cache, breaker=llm_breaker)
+
+# Overall LLM budget per predict request (seconds); LLM calls that would overrun it are skipped
+PREDICT_DEADLINE_S = float(os.getenv("PREDICT_DEADLINE_S", "45"))
+
+# Prompt template versions are part of the LLM cache key: bump when a prompt changes
+SUMMARY_PROMPT_VERSION = "summary-v2"
+SUMMARY_STREAM_PROMPT_VERSION = "summary_stream-v2"
+SUMMARY_REDUCE_PROMPT_VERSION = "summary_reduce-v1"
+LAB_EXTRACTION_PROMPT_VERSION = "lab_extraction-v2"
+LAB_BATCH_PROMPT_VERSION = "lab_extraction_batch-v1"
+
+# "sync" waits for the clinical summary, "deferred" returns entities first and summarises in the background
+SUMMARY_MODES = ("sync", "deferred")
+summary_jobs = SummaryJobManager()
 
 # ----------------------------
 # API Setup
@@ -121,43 +158,23 @@ DISEASE_MAX_LEN = min(getattr(d_tokenizer, "model_max_length", 512), 512)
 # ----------------------------
 # Lab RAG KB Setup
 # ----------------------------
-lab_dataset = [
-    {"test": "Glucose", "description": "Measures blood sugar levels in the body",
-        "unit": "mg/dL", "normal_range": "70-110"},
-    {"test": "WBC", "description": "White blood cell count, indicating immune system status",
-        "unit": "10^3/uL", "normal_range": "4-10"},
-    {"test": "Hemoglobin", "description": "Measures the concentration of hemoglobin in red blood cells",
-        "unit": "g/dL", "normal_range": "12-16"},
-    {"test": "Creatinine", "description": "Indicator of kidney function",
-        "unit": "mg/dL", "normal_range": "0.6-1.3"},
-    {"test": "Platelets", "description": "Platelet count, important for blood clotting",
-        "unit": "10^3/uL", "normal_range": "150-400"},
-    {"test": "ALT", "description": "Alanine transaminase, a liver enzyme",
-        "unit": "U/L", "normal_range": "7-56"},
-    {"test": "AST", "description": "Aspartate transaminase, another liver enzyme",
-        "unit": "U/L", "normal_range": "10-40"},
-    {"test": "BUN", "description": "Blood urea nitrogen, kidney function indicator",
-        "unit": "mg/dL", "normal_range": "7-20"},
-    {"test": "Cholesterol", "description": "Total cholesterol in the blood",
-        "unit": "mg/dL", "normal_range": "<200"},
-    {"test": "Triglycerides", "description": "Fat in the blood, indicator of cardiovascular risk",
-        "unit": "mg/dL", "normal_range": "<150"},
-    # Add more tests as needed
-]
+# Reference tests, units, parsed ranges and synonyms live in data/lab_tests.json
+lab_kb = get_lab_kb()
+# ICD dictionary index, built once at startup (ml/icd_index.py)
+icd_index = get_icd_index()
+icd_mapper = get_icd_mapper()
+lab_dataset = lab_kb.as_dicts()
 
 # ----------------------------
 # SentenceTransformer embeddings
 # ----------------------------
+EMBED_MODEL_NAME = 'all-MiniLM-L6-v2'
 # Use force_download=True to recover from any corrupted/cached files (e.g. vocab.txt)
 embed_model = SentenceTransformer(
-    'all-MiniLM-L6-v2',
+    EMBED_MODEL_NAME,
     tokenizer_kwargs={"force_download": True},
 )
-lab_texts = [
-    f"{entry['test']}: {entry['description']}. Unit: {entry['unit']}. Normal range: {entry['normal_range']}\."
-    for entry in lab_dataset
-]
-lab_embeddings = embed_model.encode(lab_texts, convert_to_numpy=True)
+lab_embeddings = lab_kb.embeddings(embed_model, EMBED_MODEL_NAME)
 embedding_dim = lab_embeddings.shape[1]
 
 # Build FAISS index
@@ -167,6 +184,14 @@ index.add(lab_embeddings)
 # Map index -> lab doc
 index_to_doc = {i: lab_dataset[i] for i in range(len(lab_dataset))}
 
+# Embedding retrieval over ICD terms, used when exact/trigram matching finds no code
+ICD_EMBEDDING_FALLBACK = os.getenv("ICD_EMBEDDING_FALLBACK", "1") != "0"
+if ICD_EMBEDDING_FALLBACK:
+    try:
+        icd_mapper.fallback = IcdEmbeddingIndex(icd_index, embed_model, EMBED_MODEL_NAME)
+    except Exception as e:
+        print(f"⚠️ ICD embedding fallback disabled: {e}")
+
 # ----------------------------
 # Pydantic Models
 # ----------------------------
@@ -338,6 +363,17 @@ class Entity(BaseModel):
     value: Optional[str] = None
     unit: Optional[str] = None
     normal_range: Optional[str] = None
+    # Lab normalization (ml/lab_units.py): KB test name, value in the KB unit, low/high/normal
+    canonical_name: Optional[str] = None
+    numeric_value: Optional[float] = None
+    canonical_unit: Optional[str] = None
+    flag: Optional[str] = None
+    # "<" / ">" when numeric_value is a reported bound ("<0.5"), not the reading itself
+    qualifier: Optional[str] = None
+    # Extractors that reported this lab ("table", "regex", "rag"), the kept one first
+    sources: Optional[List[str]] = None
+    # (start, end) of the page of a table row not located in the text; lab merging only
+    page_span: Optional[Tuple[int, int]] = Field(None, exclude=True)
 
 
 class CombinedNERResponse(BaseModel):
@@ -346,11 +382,15 @@ class CombinedNERResponse(BaseModel):
     diseases: List[Entity]
     lab_results: List[Entity]
     summary: Optional[Dict[str, str]] = None  # <-- new field
+    summary_status: Optional[str] = None  # set for deferred summaries: pending -> running -> done/failed
+    summary_job_id: Optional[str] = None
+    record_id: Optional[str] = None
 
 
 class TextRequest(BaseModel):
     text: str
     icd_map: bool = False
+    summary_mode: str = "sync"
 
 
 # -----Mongo pydantic models----------
@@ -370,6 +410,7 @@ class RecordDetail(StoredRecord):
     lab_results: List[Entity]
     summary: Optional[Dict[str, str]] = None
     metadata: Optional[Dict[str, Any]] = None
+    summary_status: Optional[str] = None
 
 
 class SearchQuery(BaseModel):
@@ -502,189 +543,180 @@ SCREENING_RULES = [
 
 def retrieve_lab_candidates(text: str, top_k: int = 5):
     query_emb = embed_model.encode([text], convert_to_numpy=True)
-    D, I = index.search(query_emb, top_k)
+    D, I = index.search(query_emb, min(top_k, len(index_to_doc)))
     return [index_to_doc[i] for i in I[0]]
 
-# _------------------------
 
+def kb_normal_range(lab_name: str) -> Optional[str]:
+    """Reference range for a lab name/synonym from the lab KB"""
+    test = lab_kb.lookup(lab_name)
+    return test.normal_range if test else None
 
-# Common lab test names (whitelist for validation)
-KNOWN_LAB_TESTS = {
-    "glucose", "wbc", "rbc", "hemoglobin", "hgb", "hematocrit", "hct", "platelet", "creatinine",
-    "bun", "alt", "ast", "cholesterol", "triglyceride", "albumin", "bilirubin", "sodium", "potassium",
-    "calcium", "phosphorus", "magnesium", "tsh", "t4", "t3", "hba1c", "hba", "ldl", "hdl", "crp",
-    "esr", "pt", "inr", "aptt", "psa", "vitamin d", "vitamin b12", "folate", "iron", "ferritin",
-    "uric acid", "alkaline phosphatase", "alp", "ggt", "ldh", "ck", "troponin", "bnp", "nt-probnp",
-    "d-dimer", "fibrinogen", "protein", "globulin", "a/g ratio", "bicarbonate", "co2", "chloride",
-    "anion gap", "osmolality", "urea", "egfr", "gfr", "microalbumin", "urine protein", "urine glucose"
-}
 
-# Common false positive patterns to exclude
-FALSE_POSITIVE_PATTERNS = [
-    r"^page\s+\d+",
-    r"^\d+\s+of\s+\d+",
-    r"^ref\s*:?\s*\d+",
-    r"^dob\s*:?",
-    r"^age\s*:?\s*\d+",
-    r"^collected\s*:?",
-    r"^printed\s*:?",
-    r"^referred\s*:?",
-    r"^dept\s*",
-    r"^no\s*\.?\s*",
-    r"^source\s*",
-    r"^type\s*\d+",
-    r"^\d{4}\s*$",  # Years like 2020
-    r"^[a-z]\s+\d+$",  # Single letter followed by number (like "A 1")
-    r"^\d+\s*$",  # Just numbers
-    r"^[a-z]{1,2}\s*$",  # Very short words (1-2 letters)
-    r"^departments?$",
-    r"^jalans?$",
-    r"^sel\s*\d+",
-    r"^kdigo",
-    r"^thresholds?$",
-    r"^values?$",
-    r"^within\s+\d+",
-    r"^least\s+\d+",
-    r"^increased\s+\d+",
-]
+def normalize_lab_entities(labs: List[Entity]) -> List[Entity]:
+    """Fill canonical name, numeric value, canonical unit, flag and bound qualifier; the raw text/value/unit are kept"""
+    for lab in labs:
+        norm = normalize_lab(lab.text, lab.value, lab.unit, lab_kb)
+        lab.canonical_name = norm.canonical_name
+        lab.numeric_value = norm.numeric_value
+        lab.canonical_unit = norm.canonical_unit
+        lab.flag = norm.flag
+        lab.qualifier = norm.qualifier
+    return labs
+
+# _------------------------
 
+
+# False positive patterns and keyword rules live in ml/lab_regex.py
 def is_valid_lab_result(lab_name: str, value: str = None) -> bool:
     """
     Validate if a potential lab result is actually a lab test.
     """
-    if not lab_name:
-        return False
-    
-    lab_lower = lab_name.lower().strip()
-    
-    # Check against false positive patterns
-    for pattern in FALSE_POSITIVE_PATTERNS:
-        if re.match(pattern, lab_lower, re.IGNORECASE):
-            return False
-    
-    # Must have a numeric value
-    if value:
-        try:
-            float(value)
-        except (ValueError, TypeError):
-            return False
-    else:
-        return False
-    
-    # Check if it's a known lab test
-    if lab_lower in KNOWN_LAB_TESTS:
-        return True
-    
-    # Check if it contains common lab test keywords
-    lab_keywords = ["test", "level", "count", "concentration", "ratio", "index", "rate"]
-    if any(keyword in lab_lower for keyword in lab_keywords):
-        return True
-    
-    # Check if it's a reasonable length (not too short, not too long)
-    if len(lab_name) < 3 or len(lab_name) > 50:
-        return False
-    
-    # Exclude common non-lab words
-    excluded_words = {"page", "of", "ref", "dob", "age", "no", "dept", "source", "type", 
-                     "collected", "printed", "referred", "departments", "jalans", "sel",
-                     "kdigo", "thresholds", "values", "within", "least", "increased", "a", 
-                     "to", "the", "and", "or", "is", "are", "was", "were"}
-    if lab_lower in excluded_words:
-        return False
-    
-    # If it has a unit, it's more likely to be a lab test
-    # This will be checked in the regex pattern
-    
-    return True
+    return lab_regex.is_valid_lab_result(lab_name, value, lab_kb)
 
 def extract_labs_with_regex(text: str):
     """
-    Extract lab results using improved regex patterns.
+    Extract lab results with the precompiled single-pass regex engine (ml/lab_regex.py).
     Only matches patterns that look like actual lab tests with values and units.
     """
-    # More specific pattern: lab name (2+ chars, not just numbers) followed by value and optional unit
-    # Pattern 1: "LabName: value unit" or "LabName value unit"
-    pattern1 = r"([A-Za-z][A-Za-z0-9\s/&-]{2,30}?)\s*[:=]\s*([\d.,]+)\s*(mg/dL|mmol/L|g/dL|%|U/L|mEq/L|ng/mL|µg/dL|pg/mL|IU/L|mIU/L|×10[³⁹]|10\^3|10\^9)?"
-    
-    # Pattern 2: Common lab test names followed by value
-    pattern2 = r"\b(Glucose|WBC|RBC|Hemoglobin|HGB|Hematocrit|HCT|Platelet|Creatinine|BUN|ALT|AST|Cholesterol|Triglyceride|Albumin|Bilirubin|Sodium|Potassium|Calcium|Phosphorus|Magnesium|TSH|T4|T3|HbA1c|HbA|LDL|HDL|CRP|ESR|PT|INR|APTT|PSA|Vitamin\s+D|Vitamin\s+B12|Folate|Iron|Ferritin|Uric\s+Acid|Alkaline\s+Phosphatase|ALP|GGT|LDH|CK|Troponin|BNP|NT-proBNP|D-dimer|Fibrinogen|Protein|Globulin|A/G\s+Ratio|Bicarbonate|CO2|Chloride|Anion\s+Gap|Osmolality|Urea|eGFR|GFR|Microalbumin|Urine\s+Protein|Urine\s+Glucose)\s*[:=]?\s*([\d.,]+)\s*(mg/dL|mmol/L|g/dL|%|U/L|mEq/L|ng/mL|µg/dL|pg/mL|IU/L|mIU/L|×10[³⁹]|10\^3|10\^9)?"
-    
-    labs = []
-    seen = set()  # Track seen labs to avoid duplicates
-    
-    # Try pattern 1 (general pattern)
-    for match in re.finditer(pattern1, text, re.IGNORECASE):
-        lab_name = match.group(1).strip()
-        value = match.group(2).strip()
-        unit = match.group(3) if match.lastindex >= 3 and match.group(3) else None
-        
-        # Validate
-        if is_valid_lab_result(lab_name, value):
-            # Create unique key to avoid duplicates
-            key = f"{lab_name.lower()}:{value}"
-            if key not in seen:
-                seen.add(key)
-                labs.append(Entity(
-                    text=lab_name,
-                    start=match.start(),
-                    end=match.end(),
-                    entity_type="lab",
-                    confidence=0.9 if unit else 0.7,  # Higher confidence if unit present
-                    value=value,
-                    unit=unit
-                ))
-    
-    # Try pattern 2 (known lab tests)
-    for match in re.finditer(pattern2, text, re.IGNORECASE):
-        lab_name = match.group(1).strip()
-        value = match.group(2).strip()  # Value is group 2
-        unit = match.group(3) if match.lastindex >= 3 and match.group(3) else None  # Unit is group 3
-        
-        # Validate
-        if is_valid_lab_result(lab_name, value):
-            key = f"{lab_name.lower()}:{value}"
-            if key not in seen:
-                seen.add(key)
-                labs.append(Entity(
-                    text=lab_name,
-                    start=match.start(),
-                    end=match.end(),
-                    entity_type="lab",
-                    confidence=0.95,  # High confidence for known lab tests
-                    value=value,
-                    unit=unit
-                ))
-    
-    return labs
+    return [
+        Entity(
+            text=m.name,
+            start=m.start,
+            end=m.end,
+            entity_type="lab",
+            confidence=m.confidence,
+            value=m.value,
+            unit=m.unit,
+            normal_range=kb_normal_range(m.name)
+        ) for m in lab_regex.extract_lab_matches(text, lab_kb)
+    ]
+
+
+# Lab tables recovered from PDF layout; their rows bypass the regex and LLM extractors
+TABLE_LAB_EXTRACTION = os.getenv("TABLE_LAB_EXTRACTION", "1") != "0"
+
+
+def table_rows_to_entities(text: str, rows: List[TableLabRow], pages: Optional[PdfPages] = None) -> List[Entity]:
+    """
+    Lab entities for table rows, located in the text (their own page first) where
+    possible. Rows that cannot be located get the empty span (0, 0), see has_span(),
+    and keep their page's span for merge_lab_entities().
+    """
+    entities = []
+    for row in rows:
+        sections = [pages.page_span(row.page)] if pages is not None and 0 < row.page <= len(pages.page_offsets) else None
+        span = locate_lab_offsets(text, row.name, row.value, sections)
+        start, end = span or (0, 0)
+        entities.append(Entity(
+            text=row.name,
+            start=start,
+            end=end,
+            entity_type="lab",
+            confidence=0.98 if row.known else 0.9,
+            value=row.value,
+            unit=row.unit,
+            normal_range=row.normal_range or kb_normal_range(row.name),
+            page_span=sections[0] if span is None and sections else None
+        ))
+    return entities
+
+
+# Uploaded PDFs above MAX_UPLOAD_MB are rejected; so are multi-PDF request bodies above MAX_UPLOAD_REQUEST_MB
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024)
+MAX_UPLOAD_REQUEST_BYTES = int(float(os.getenv("MAX_UPLOAD_REQUEST_MB", "100")) * 1024 * 1024)
+# Multipart boundaries and form fields next to a single PDF
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+UPLOAD_BODY_LIMITS = {
+    "/predict_pdf": MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD,
+    "/predict_pdf_stream": MAX_UPLOAD_BYTES + UPLOAD_FORM_OVERHEAD,
+    "/predict_multiple_pdfs": MAX_UPLOAD_REQUEST_BYTES,
+    "/predict_multiple_pdfs_summary": MAX_UPLOAD_REQUEST_BYTES,
+}
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """
+    413 for PDF uploads whose Content-Length is over the route's limit, before the
+    multipart body is read. Chunked uploads (no Content-Length) are checked per
+    file by check_upload_size() once parsed.
+    """
+    limit = UPLOAD_BODY_LIMITS.get(request.url.path)
+    length = request.headers.get("content-length")
+    if limit is not None and length and length.isdigit() and int(length) > limit:
+        return JSONResponse(status_code=413,
+                            content={"detail": f"Upload exceeds the {limit // (1024 * 1024)} MB limit"})
+    return await call_next(request)
+
+
+def check_upload_size(file: UploadFile) -> None:
+    """413 for an uploaded file over MAX_UPLOAD_BYTES"""
+    size = file.size
+    if size is None:
+        # Starlette before 0.24 does not record the size
+        size = file.file.seek(0, os.SEEK_END)
+    if size > MAX_UPLOAD_BYTES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"{file.filename or 'Upload'} exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+
+
+async def read_upload_pdf(file: UploadFile) -> Tuple[str, List[Entity]]:
+    """
+    read_pdf() on an upload, parsed straight from the file Starlette spooled the
+    body into (no second copy); the file is closed before analysis
+    """
+    check_upload_size(file)
+    try:
+        return await asyncio.to_thread(read_pdf, file.file)
+    finally:
+        await file.close()
+
+
+def read_pdf(source: Any) -> Tuple[str, List[Entity]]:
+    """
+    Text of a PDF (path or binary file object, e.g. an upload's spooled file) and the lab
+    entities of its well-structured lab tables, in one pass over the pages
+    (page-parallel for large PDFs, see utils.extract_pdf_pages)
+    """
+    pages = extract_pdf_pages(source, page_fn=page_table_labs if TABLE_LAB_EXTRACTION else None)
+    rows = [row for page_rows in pages.page_results if page_rows for row in page_rows]
+    return pages.text, table_rows_to_entities(pages.text, rows, pages)
 
 # Summary
 
 
-def generate_summary(extracted_text: str, diseases: list, labs: list, max_sentences: int = 4) -> str:
+SUMMARY_OUTPUT_INSTRUCTIONS = {
+    "json": """Return output as JSON ONLY in this exact format:
+{"clinical_summary": "A short 1-4 sentence clinician-facing summary."}
+
+Do not add any extra keys, commentary, or markdown. If you cannot produce JSON, return plain text summary only.""",
+    "text": """Return ONLY the summary sentences as plain text.
+Do not add a title, labels, JSON, commentary, or markdown.""",
+}
+
+
+# Summary prompt size (estimated tokens); report text gets whatever the entity lists leave
+SUMMARY_PROMPT_TOKEN_BUDGET = int(os.getenv("SUMMARY_PROMPT_TOKEN_BUDGET", "1600"))
+SUMMARY_MIN_CONTEXT_TOKENS = 200
+# Disease mentions below this NER confidence are left out of the summary prompt
+SUMMARY_MIN_ENTITY_CONFIDENCE = float(os.getenv("SUMMARY_MIN_ENTITY_CONFIDENCE", "0.5"))
+
+
+def build_summary_prompt(extracted_text: str, diseases: list, labs: list, max_sentences: int = 4,
+                         output_format: str = "json", token_budget: int = SUMMARY_PROMPT_TOKEN_BUDGET) -> str:
     """
-    Ask Gemini to produce a short clinical summary from extracted text, disease entities and lab results.
-    Returns a plain string summary. Defensive: tries to parse JSON but falls back to raw text.
+    Build the clinical summary prompt from extracted text, disease entities and lab results.
+    Entity lists are compacted (deduplicated, low-confidence diseases dropped, repeated
+    labs collapsed) and the report text is trimmed to the remaining token budget by
+    relevance to those entities. output_format="text" asks for bare sentences, which
+    can be shown while they stream.
     """
-    # Build concise context
-    disease_list = []
-    for d in diseases:
-        # accept both dict-like and pydantic Entity
-        name = getattr(d, "text", None) or d.get(
-            "text", "") if isinstance(d, dict) else ""
-        label = getattr(d, "entity_type", None) or d.get(
-            "entity_type", "") if isinstance(d, dict) else ""
-        if name:
-            disease_list.append(f"{name} ({label})")
-    lab_list = []
-    for l in labs:
-        name = getattr(l, "text", None) or l.get("test_name") or l.get(
-            "text") if isinstance(l, dict) else ""
-        value = getattr(l, "value", None) or l.get(
-            "value_extracted") if isinstance(l, dict) else None
-        if name:
-            lab_list.append(f"{name}: {value or '-'}")
-
-    prompt = f"""
+    disease_list = fit_lines(compact_diseases(diseases, SUMMARY_MIN_ENTITY_CONFIDENCE), token_budget // 4)
+    lab_list = fit_lines(compact_labs(labs), token_budget // 4)
+
+    head = f"""
 You are a concise clinical assistant. Produce a short clinical summary (at most {max_sentences} sentences) for a clinician,
 based on the extracted report text, the detected disease entities and lab results.
 
@@ -695,62 +727,144 @@ Detected lab results:
 {chr(10).join(lab_list) if lab_list else 'None'}
 
 Extracted report text (for context — you should prioritize the explicit entities and lab values above):
-\"\"\"{extracted_text[:4000]}\"\"\"
-
-Return output as JSON ONLY in this exact format:
-{{"clinical_summary": "A short 1-4 sentence clinician-facing summary."}}
-
-Do not add any extra keys, commentary, or markdown. If you cannot produce JSON, return plain text summary only.
 """
+    tail = f"""
+{SUMMARY_OUTPUT_INSTRUCTIONS[output_format]}
+"""
+    context_budget = max(SUMMARY_MIN_CONTEXT_TOKENS, token_budget - estimate_tokens(head + tail))
+    keywords = [getattr(e, "text", None) or (e.get("text") if isinstance(e, dict) else "") for e in [*diseases, *labs]]
+    context = select_context(extracted_text, keywords, context_budget)
+    return f'''{head}"""{context}"""
+{tail}'''
+
+
+def parse_summary_response(out: str, max_sentences: int = 4) -> str:
+    """Parse the model output of the summary prompt. Tries JSON first, falls back to raw text."""
+    out = out.strip()
+
+    # remove triple-backtick fences if present
+    if out.startswith("```"):
+        # find the content inside fences
+        parts = out.split("```")
+        if len(parts) >= 3:
+            out = parts[2].strip() if parts[1].strip(
+            ).lower() == "json" else parts[1].strip()
+
+    # try to find JSON object in output
+    m = re.search(
+        r"(\{\s*\"clinical_summary\"\s*:\s*\".*?\"\s*\})", out, flags=re.S)
+    json_str = m.group(1) if m else out
 
     try:
-        resp = model.invoke(prompt)
-        out = getattr(resp, "text", "") or str(resp)
-        out = out.strip()
-
-        # remove triple-backtick fences if present
-        if out.startswith("```"):
-            # find the content inside fences
-            parts = out.split("```")
-            if len(parts) >= 3:
-                out = parts[2].strip() if parts[1].strip(
-                ).lower() == "json" else parts[1].strip()
-
-        # try to find JSON object in output
-        m = re.search(
-            r"(\{\s*\"clinical_summary\"\s*:\s*\".*?\"\s*\})", out, flags=re.S)
-        json_str = m.group(1) if m else out
+        parsed = json.loads(json_str)
+        summary_text = parsed.get("clinical_summary", "")
+        if isinstance(summary_text, str) and summary_text.strip():
+            return summary_text.strip()
+    except (json.JSONDecodeError, AttributeError):
+        # fallback to plain text (strip any labels)
+        pass
 
-        try:
-            parsed = json.loads(json_str)
-            summary_text = parsed.get("clinical_summary", "")
-            if isinstance(summary_text, str) and summary_text.strip():
-                return summary_text.strip()
-        except json.JSONDecodeError:
-            # fallback to plain text (strip any labels)
-            pass
-
-        # If no JSON or parsing failed, try to extract first 1-4 sentences from the raw output
-        # Simple sentence split (keeps it short)
-        sentences = re.split(r'(?<=[\.\?\!])\s+', out)
-        summary_text = " ".join(sentences[:max_sentences]).strip()
-        return summary_text
+    # If no JSON or parsing failed, try to extract first 1-4 sentences from the raw output
+    # Simple sentence split (keeps it short)
+    sentences = re.split(r'(?<=[\.\?\!])\s+', out)
+    return " ".join(sentences[:max_sentences]).strip()
+
+
+def generate_summary(extracted_text: str, diseases: list, labs: list, max_sentences: int = 4) -> str:
+    """
+    Ask Gemini to produce a short clinical summary from extracted text, disease entities and lab results.
+    Returns a plain string summary. Defensive: tries to parse JSON but falls back to raw text.
+    """
+    prompt = build_summary_prompt(extracted_text, diseases, labs, max_sentences)
+    try:
+        return parse_summary_response(llm_gateway.invoke(prompt, template=SUMMARY_PROMPT_VERSION), max_sentences)
     except Exception as e:
         # Don't crash — return empty string so caller can fallback
         print(f"[generate_summary] Gemini/exception: {e}")
         return ""
 
+
+async def agenerate_summary(extracted_text: str, diseases: list, labs: list, max_sentences: int = 4) -> str:
+    """Async variant of generate_summary that goes through the bounded LLM gateway."""
+    prompt = build_summary_prompt(extracted_text, diseases, labs, max_sentences)
+    try:
+        return parse_summary_response(await llm_gateway.ainvoke(prompt, template=SUMMARY_PROMPT_VERSION), max_sentences)
+    except LLMUnavailableError as e:
+        print(f"[agenerate_summary] LLM skipped: {e}")
+        return ""
+    except Exception as e:
+        print(f"[agenerate_summary] Gemini/exception: {e!r}")
+        return ""
+
+
+async def astream_summary(extracted_text: str, diseases: list, labs: list, max_sentences: int = 4) -> AsyncIterator[str]:
+    """Stream the clinical summary as plain-text chunks through the LLM gateway; raises on failure."""
+    prompt = build_summary_prompt(extracted_text, diseases, labs, max_sentences, output_format="text")
+    async for chunk in llm_gateway.astream(prompt, template=SUMMARY_STREAM_PROMPT_VERSION):
+        yield chunk
+
+
+def build_reduce_summary_prompt(items: List[SummaryItem], final: bool, max_sentences: int = 5,
+                                findings: Optional[str] = None) -> str:
+    """
+    Prompt merging several document (or document group) summaries into one.
+    `findings` is the deduplicated cross-document entity block (final merge only).
+    """
+    sources = "\n\n".join(f"[{label}]\n{text}" for label, text in items)
+    audience = ("a consolidated clinical summary of the whole patient file" if final
+                else "one combined summary that a later step will merge with others")
+    findings_block = f"\nFindings across all documents (deduplicated):\n{findings}\n" if findings else ""
+    return f"""
+You are a concise clinical assistant. Below are summaries of {len(items)} medical documents (or groups of documents)
+from the same upload. Write {audience}, at most {max_sentences} sentences.
+Keep every distinct diagnosis and every abnormal lab value; merge repeated findings and mention changes over time.
+{findings_block}
+{sources}
+
+Return output as JSON ONLY in this exact format:
+{{"clinical_summary": "The combined summary."}}
+"""
+
+
+async def _reduce_summary_group(items: List[SummaryItem], final: bool, max_sentences: int = 5,
+                                findings: Optional[str] = None) -> str:
+    prompt = build_reduce_summary_prompt(items, final, max_sentences, findings if final else None)
+    return parse_summary_response(
+        await llm_gateway.ainvoke(prompt, template=SUMMARY_REDUCE_PROMPT_VERSION), max_sentences)
+
+
+def build_template_summary(diseases: list, labs: list, max_items: int = 5) -> str:
+    """Deterministic summary used when the LLM is unavailable or out of time."""
+    disease_names = []
+    for d in diseases:
+        name = d.get("text") if isinstance(d, dict) else getattr(d, "text", None)
+        if name and name.lower() not in (n.lower() for n in disease_names):
+            disease_names.append(name)
+    lab_parts = []
+    for l in labs:
+        name = l.get("text") if isinstance(l, dict) else getattr(l, "text", None)
+        value = l.get("value") if isinstance(l, dict) else getattr(l, "value", None)
+        unit = l.get("unit") if isinstance(l, dict) else getattr(l, "unit", None)
+        if name and value:
+            lab_parts.append(f"{name} {value}{' ' + unit if unit else ''}")
+
+    sentences = []
+    if disease_names:
+        sentences.append("Detected conditions: " + ", ".join(disease_names[:max_items]) + ".")
+    if lab_parts:
+        sentences.append("Lab results: " + ", ".join(lab_parts[:max_items]) + ".")
+    if not sentences:
+        sentences.append("No conditions or lab results were detected.")
+    return " ".join(sentences)
+
 # ===========================
 
 
-def extract_labs_with_rag(text: str):
-    candidates = retrieve_lab_candidates(text, top_k=10)
-    context = "\n".join([
-        f"{c['test']}: {c['description']}. Unit: {c['unit']}. Normal range: {c['normal_range']}"
-        for c in candidates
-    ])
+# Max tokens of retrieved reference tests included in a lab extraction prompt
+LAB_REFERENCE_TOKEN_BUDGET = int(os.getenv("LAB_REFERENCE_TOKEN_BUDGET", "300"))
 
-    prompt = f"""You are a medical lab results extraction assistant. Extract ONLY actual laboratory test results from the text below.
+
+LAB_EXTRACTION_INSTRUCTIONS = """You are a medical lab results extraction assistant. Extract ONLY actual laboratory test results from the text below.
 
 IMPORTANT RULES:
 1. Extract ONLY actual lab test names with numeric values (e.g., "Glucose: 95 mg/dL", "Creatinine: 1.2 mg/dL")
@@ -769,7 +883,23 @@ IMPORTANT RULES:
    - A recognized lab test name (like Glucose, Creatinine, Hemoglobin, etc.)
    - Followed by a colon or equals sign
    - Followed by a numeric value
-   - Optionally followed by a unit (mg/dL, mmol/L, g/dL, %, U/L, etc.)
+   - Optionally followed by a unit (mg/dL, mmol/L, g/dL, %, U/L, etc.)"""
+
+
+def _lab_reference_context(candidates: List[Dict[str, Any]], token_budget: Optional[int] = None) -> str:
+    """Retrieved reference tests, one line per distinct test, capped at `token_budget` tokens."""
+    references = {}
+    for c in candidates:
+        references.setdefault(
+            c['test'].lower(), f"{c['test']}: {c['description']}. Unit: {c['unit']}. Normal range: {c['normal_range']}")
+    return "\n".join(fit_lines(list(references.values()), token_budget or LAB_REFERENCE_TOKEN_BUDGET))
+
+
+def build_lab_extraction_prompt(text: str, candidates: List[Dict[str, Any]]) -> str:
+    """Build the lab extraction prompt with retrieved reference tests as context."""
+    context = _lab_reference_context(candidates)
+
+    return f"""{LAB_EXTRACTION_INSTRUCTIONS}
 
 Reference lab tests you should look for:
 {context}
@@ -783,10 +913,47 @@ Text to analyze:
 Return ONLY the JSON array, nothing else:
 """
 
+
+def build_batch_lab_extraction_prompt(documents: List[Tuple[str, str]], candidates: List[Dict[str, Any]]) -> str:
+    """
+    One lab extraction prompt for sections of several documents.
+    `documents` are (doc_id, section_text); the answer is a JSON object keyed by doc_id.
+    """
+    context = _lab_reference_context(candidates, 2 * LAB_REFERENCE_TOKEN_BUDGET)
+    sections = "\n\n".join(f"=== DOCUMENT {doc_id} ===\n{text}" for doc_id, text in documents)
+    ids = ", ".join(doc_id for doc_id, _ in documents)
+
+    return f"""{LAB_EXTRACTION_INSTRUCTIONS}
+
+Reference lab tests you should look for:
+{context}
+
+The text below holds sections from {len(documents)} separate lab reports ({ids}), each starting with a line
+"=== DOCUMENT <id> ===". Never move a result from one document to another.
+Return ONLY a valid JSON object with one key per document id, each mapping to that document's array of lab results
+([] if it has none).
+Format: {{"D1": [{{"test":"Lab Test Name","value":"123.45","unit":"mg/dL","normal_range":"70-110"}}], "D2": []}}
+
+Text to analyze:
+{sections}
+
+Return ONLY the JSON object, nothing else:
+"""
+
+
+def parse_batch_lab_response(content: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Parse the keyed JSON object of a batched lab prompt; raises ValueError if it is not one."""
+    # The outermost {...} also skips any markdown fence around the JSON
+    m = re.search(r"\{.*\}", content, re.S)
+    parsed = json.loads(m.group(0) if m else content)
+    if not isinstance(parsed, dict):
+        raise ValueError("Batched lab response is not a JSON object")
+    return {str(k): v for k, v in parsed.items() if isinstance(v, list)}
+
+
+def parse_lab_extraction_response(content: str) -> List[Entity]:
+    """Parse the JSON array returned for a lab extraction prompt into validated lab entities."""
     try:
-        # NOTE: method name depends on genai SDK version; using generate_content per your code
-        response = model.invoke(prompt)
-        content = getattr(response, "text", "") or str(response)
         # strip common fences
         content = content.strip()
         if content.startswith("```"):
@@ -795,7 +962,6 @@ Return ONLY the JSON array, nothing else:
             # parts[0] is empty, parts[1] may be "json" or the content - try to find JSON-looking part
             content = parts[-1].strip()
         # Find the first JSON array in the response
-        import re
         m = re.search(r"(\[\s*\{.*\}\s*\])", content, re.S)
         json_str = m.group(1) if m else content
         labs = json.loads(json_str) if json_str.strip().startswith("[") else []
@@ -807,8 +973,10 @@ Return ONLY the JSON array, nothing else:
     seen = set()  # Track seen labs to avoid duplicates
     
     for lab in labs:
-        test_name = lab.get("test", "").strip()
-        value = lab.get("value", "").strip()
+        if not isinstance(lab, dict):
+            continue
+        test_name = str(lab.get("test") or "").strip()
+        value = str(lab.get("value") or "").strip()
         
         # Validate the extracted lab result
         if not test_name or not value:
@@ -833,11 +1001,185 @@ Return ONLY the JSON array, nothing else:
                 "confidence") is not None else 0.9,
             value=value,
             unit=lab.get("unit"),
-            normal_range=lab.get("normal_range")
+            normal_range=lab.get("normal_range") or kb_normal_range(test_name)
         ))
 
     return entities
 
+
+# "tiered": regex first, RAG+LLM only when lab-looking lines remain unexplained
+# "full": always run both extractors
+LAB_EXTRACTION_MODE = os.getenv("LAB_EXTRACTION_MODE", "tiered").lower()
+lab_extraction_stats = {
+    "documents": 0,
+    "llm_calls": 0,
+    "llm_calls_avoided": 0,
+    "llm_prompts": 0,
+    "llm_failed_prompts": 0,
+    "unexplained_lines": 0,
+    "batched_calls": 0,
+    "batch_fallback_prompts": 0,
+    "table_documents": 0,
+    "table_rows": 0,
+    "table_rows_unlocated": 0,
+    "duplicate_labs_dropped": 0,
+}
+
+
+# Max document tokens sent per lab extraction prompt (sections are batched up to this)
+LAB_PROMPT_TOKEN_BUDGET = int(os.getenv("LAB_PROMPT_TOKEN_BUDGET", "1500"))
+
+
+def plan_lab_prompts(text: str, lines: Optional[List[Tuple[int, int]]] = None):
+    """
+    Locate lab-table regions and pack them into prompt-sized batches.
+    `lines` restricts the search to given lab lines (e.g. the ones regex left unexplained).
+    Returns [(prompt_text, [section spans])].
+    """
+    if lines is None:
+        lines = find_lab_lines(text, lab_kb)
+    sections = group_sections(text, lines)
+    return [
+        ("\n...\n".join(text[s:e] for s, e in batch), batch)
+        for batch in batch_sections(text, sections, LAB_PROMPT_TOKEN_BUDGET)
+    ]
+
+
+def anchor_lab_entities(text: str, entities: List[Entity], spans) -> List[Entity]:
+    """
+    Map LLM-returned labs back to real character offsets in the source text.
+    Labs whose value does not occur in the sent sections are dropped as hallucinated.
+    """
+    anchored = []
+    for ent in entities:
+        test = lab_kb.lookup(ent.text)
+        names = [ent.text] + ([test.name, *test.synonyms] if test else [])
+        span = None
+        for name in names:
+            span = locate_lab_offsets(text, name, ent.value, spans)
+            if span:
+                break
+        if span is None:
+            span = locate_value(text, ent.value, spans)
+            if span is None:
+                continue
+        ent.start, ent.end = span
+        anchored.append(ent)
+    return anchored
+
+
+def _collect_section_labs(text: str, plan, responses) -> List[Entity]:
+    entities: List[Entity] = []
+    seen = set()
+    for (_, spans), content in zip(plan, responses):
+        if isinstance(content, BaseException):
+            # Falls back to the regex labs already extracted for this document
+            lab_extraction_stats["llm_failed_prompts"] += 1
+            print(f"[lab extraction] Gemini/exception: {content!r}")
+            continue
+        for ent in anchor_lab_entities(text, parse_lab_extraction_response(content), spans):
+            key = f"{ent.text.lower()}:{ent.value}"
+            if key not in seen:
+                seen.add(key)
+                entities.append(ent)
+    return entities
+
+
+def extract_labs_with_rag(text: str, lines: Optional[List[Tuple[int, int]]] = None):
+    plan = plan_lab_prompts(text, lines)
+    responses = []
+    for section_text, _ in plan:
+        candidates = retrieve_lab_candidates(section_text, top_k=10)
+        prompt = build_lab_extraction_prompt(section_text, candidates)
+        try:
+            responses.append(llm_gateway.invoke(prompt, template=LAB_EXTRACTION_PROMPT_VERSION))
+        except Exception as e:
+            responses.append(e)
+    return _collect_section_labs(text, plan, responses)
+
+
+async def aextract_labs_with_rag(text: str, lines: Optional[List[Tuple[int, int]]] = None,
+                                 lab_batcher: Optional[MicroBatcher] = None) -> List[Entity]:
+    """
+    Async variant of extract_labs_with_rag: only lab sections are sent to the LLM,
+    one prompt per token-budgeted batch, all batches concurrently.
+    With a `lab_batcher` (one per multi-PDF upload, see new_lab_batcher), sections
+    are handed to it instead, and it packs sections of the upload's documents into
+    shared prompts.
+    """
+    plan = await asyncio.to_thread(plan_lab_prompts, text, lines)
+    if not plan:
+        return []
+    items = []
+    for section_text, _ in plan:
+        candidates = await asyncio.to_thread(retrieve_lab_candidates, section_text, 10)
+        items.append((section_text, candidates))
+    if lab_batcher is not None:
+        responses = await asyncio.gather(
+            *(lab_batcher.submit(item, cost=estimate_tokens(item[0])) for item in items), return_exceptions=True)
+    else:
+        lab_extraction_stats["llm_prompts"] += len(items)
+        responses = await llm_gateway.abatch(
+            [build_lab_extraction_prompt(*item) for item in items], template=LAB_EXTRACTION_PROMPT_VERSION)
+    return _collect_section_labs(text, plan, responses)
+
+
+async def _flush_lab_batch(items: List[Tuple[str, List[Dict[str, Any]]]]) -> List[Any]:
+    """
+    Extract labs for sections of several documents with one LLM call. Returns one
+    JSON-array string per item (what a single-section prompt would have returned);
+    items missing from a malformed answer fall back to their own single-section prompt.
+    """
+    lab_extraction_stats["llm_prompts"] += 1
+    if len(items) == 1:
+        return [await llm_gateway.ainvoke(build_lab_extraction_prompt(*items[0]), template=LAB_EXTRACTION_PROMPT_VERSION)]
+
+    ids = [f"D{i + 1}" for i in range(len(items))]
+    candidates = [c for _, item_candidates in items for c in item_candidates]
+    prompt = build_batch_lab_extraction_prompt([(doc_id, text) for doc_id, (text, _) in zip(ids, items)], candidates)
+    lab_extraction_stats["batched_calls"] += 1
+
+    async def batched():
+        content = await llm_gateway.ainvoke(prompt, template=LAB_BATCH_PROMPT_VERSION)
+        return {doc_id: json.dumps(labs) for doc_id, labs in parse_batch_lab_response(content).items()}
+
+    async def per_document(missing):
+        lab_extraction_stats["batch_fallback_prompts"] += len(missing)
+        lab_extraction_stats["llm_prompts"] += len(missing)
+        return await llm_gateway.abatch(
+            [build_lab_extraction_prompt(*items[i]) for i in missing], template=LAB_EXTRACTION_PROMPT_VERSION)
+
+    return await split_keyed_batch(ids, batched, per_document, reraise=(LLMUnavailableError,))
+
+
+# The documents of one multi-PDF upload share lab extraction prompts
+LAB_BATCH_ENABLED = os.getenv("LAB_BATCH_ENABLED", "1").lower() in ("1", "true", "yes")
+LAB_BATCH_MAX_SECTIONS = int(os.getenv("LAB_BATCH_MAX_SECTIONS", "8"))
+LAB_BATCH_TOKEN_BUDGET = int(os.getenv("LAB_BATCH_TOKEN_BUDGET", "3000"))
+LAB_BATCH_WAIT_S = float(os.getenv("LAB_BATCH_WAIT_MS", "50")) / 1000.0
+lab_batch_stats = {"uploads": 0, "batches": 0, "items": 0}
+
+
+def new_lab_batcher(started: float) -> MicroBatcher:
+    """
+    Lab section batcher for one multi-PDF upload. It never mixes sections of
+    different requests, and its LLM calls run under the upload's deadline
+    (PREDICT_DEADLINE_S from `started`), whichever document submitted first.
+    """
+    async def flush(items):
+        budget = PREDICT_DEADLINE_S - (time.time() - started) if PREDICT_DEADLINE_S > 0 else None
+        with request_deadline(budget):
+            return await _flush_lab_batch(items)
+
+    return MicroBatcher(flush, max_items=LAB_BATCH_MAX_SECTIONS, max_cost=LAB_BATCH_TOKEN_BUDGET,
+                        max_wait=LAB_BATCH_WAIT_S)
+
+
+def record_lab_batcher(batcher: MicroBatcher):
+    lab_batch_stats["uploads"] += 1
+    lab_batch_stats["batches"] += batcher.batches
+    lab_batch_stats["items"] += batcher.items
+
 # -----------------------
 # Sliding window function
 # ------------------------
@@ -953,7 +1295,8 @@ def store_medical_record(
     summary: Optional[Dict[str, str]] = None,
     metadata: Optional[Dict[str, Any]] = None,
     patient_id: Optional[str] = None,
-    source: str = "pdf_upload"
+    source: str = "pdf_upload",
+    summary_status: Optional[str] = None
 ):
     """
     Store processed medical record in MongoDB.
@@ -985,6 +1328,8 @@ def store_medical_record(
             "diseases_count": len(diseases),
             "labs_count": len(lab_results)
         }
+        if summary_status:
+            record["summary_status"] = summary_status
 
         print(f"DEBUG: Attempting to insert record for patient {patient_id}")
         result = records_collection.insert_one(record)
@@ -1145,99 +1490,275 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
 # ----------------------------
-# Predict Endpoints
+# Document Analysis
 # ----------------------------
 
 
-@app.post("/predict", response_model=CombinedNERResponse)
-async def predict_combined_rag(req: TextRequest, store: bool = Form(False),
-                               patient_id: Optional[str] = Form(None)):
-    req_start = time.time()
-    text = req.text
-    icd_map = req.icd_map
-
-    # Disease NER
-    if len(text.split()) < DISEASE_MAX_LEN:
-        disease_preds = d_pipeline(text)
-        # Post-process pipeline results to merge adjacent disease tokens
-        # The pipeline should handle this, but we add extra merging for safety
-        merged_preds = []
-        for p in disease_preds:
-            if not merged_preds:
-                merged_preds.append(p.copy() if isinstance(p, dict) else p)
-                continue
-            
-            last = merged_preds[-1]
-            # Get entity group/label (pipeline uses "entity_group" after aggregation)
-            current_label = str(p.get("entity_group") or p.get("entity") or "").lower()
-            last_label = str(last.get("entity_group") or last.get("entity") or "").lower()
-            
-            # Check if both are disease entities
-            is_disease = "disease" in current_label
-            is_last_disease = "disease" in last_label
-            
-            current_start = p.get("start", 0)
-            current_end = p.get("end", 0)
-            last_end = last.get("end", 0)
-            
-            gap = current_start - last_end
-            
-            # Merge if both are diseases and adjacent (within 3 chars for whitespace)
-            if is_disease and is_last_disease and gap <= 3:
-                # Merge: combine text and extend end position
-                last_text = last.get("word") or last.get("entity") or ""
-                current_text = p.get("word") or p.get("entity") or ""
-                # Only add space if there's a gap
-                if gap > 0:
-                    merged_text = (last_text + " " + current_text).strip()
-                else:
-                    merged_text = (last_text + current_text).strip()
-                last["word"] = merged_text
-                last["entity"] = merged_text
-                last["end"] = max(last_end, current_end)
-                # Average the scores
-                last_score = last.get("score", 0.0)
-                current_score = p.get("score", 0.0)
-                last["score"] = (last_score + current_score) / 2.0
-            else:
-                merged_preds.append(p.copy() if isinstance(p, dict) else p)
+def merge_pipeline_predictions(disease_preds):
+    """Post-process pipeline results to merge adjacent disease tokens"""
+    # The pipeline should handle this, but we add extra merging for safety
+    merged_preds = []
+    for p in disease_preds:
+        if not merged_preds:
+            merged_preds.append(p.copy() if isinstance(p, dict) else p)
+            continue
+        
+        last = merged_preds[-1]
+        # Get entity group/label (pipeline uses "entity_group" after aggregation)
+        current_label = str(p.get("entity_group") or p.get("entity") or "").lower()
+        last_label = str(last.get("entity_group") or last.get("entity") or "").lower()
+        
+        # Check if both are disease entities
+        is_disease = "disease" in current_label
+        is_last_disease = "disease" in last_label
         
+        current_start = p.get("start", 0)
+        current_end = p.get("end", 0)
+        last_end = last.get("end", 0)
+        
+        gap = current_start - last_end
+        
+        # Merge if both are diseases and adjacent (within 3 chars for whitespace)
+        if is_disease and is_last_disease and gap <= 3:
+            # Merge: combine text and extend end position
+            last_text = last.get("word") or last.get("entity") or ""
+            current_text = p.get("word") or p.get("entity") or ""
+            # Only add space if there's a gap
+            if gap > 0:
+                merged_text = (last_text + " " + current_text).strip()
+            else:
+                merged_text = (last_text + current_text).strip()
+            last["word"] = merged_text
+            last["entity"] = merged_text
+            last["end"] = max(last_end, current_end)
+            # Average the scores
+            last_score = last.get("score", 0.0)
+            current_score = p.get("score", 0.0)
+            last["score"] = (last_score + current_score) / 2.0
+        else:
+            merged_preds.append(p.copy() if isinstance(p, dict) else p)
+    return merged_preds
+
+
+def assign_icd_codes(diseases: List[Entity]) -> List[Entity]:
+    """Set icd_code on disease entities with one batched, memoized mapping call"""
+    codes = normalize_icd_batch(d.text for d in diseases)
+    for d in diseases:
+        d.icd_code = codes.get(d.text)
+    return diseases
+
+
+def extract_diseases(text: str, icd_map: bool = False, allow_pipeline: bool = False) -> List[Entity]:
+    """
+    Disease NER. Short texts may use the aggregation pipeline (allow_pipeline),
+    everything else goes through the sliding window.
+    """
+    if allow_pipeline and len(text.split()) < DISEASE_MAX_LEN:
+        merged_preds = merge_pipeline_predictions(d_pipeline(text))
         diseases = [
             Entity(
                 text=p.get("word") or p.get("entity"),
                 start=p.get("start", 0),
                 end=p.get("end", 0),
                 entity_type=p.get("entity_group") or p.get("entity"),
-                icd_code=normalize_icd(p.get("word") or p.get(
-                    "entity")) if icd_map else None,
                 confidence=float(p.get("score", 0.0))
             ) for p in merged_preds
         ]
     else:
-        diseases = [Entity(**p, icd_code=normalize_icd(p['text']) if icd_map else None)
-                    for p in predict_with_sliding_window(text, d_tokenizer, d_model, d_label_map, DISEASE_MAX_LEN)]
+        diseases = [Entity(**p) for p in
+                    predict_with_sliding_window(text, d_tokenizer, d_model, d_label_map, DISEASE_MAX_LEN)]
+    return assign_icd_codes(diseases) if icd_map else diseases
+
+
+def _merge_labs_stage(table_labs: List[Entity], rag_labs: List[Entity], regex_labs: List[Entity]) -> List[Entity]:
+    """Normalize every extractor's labs and keep one entity per reading (see ml/lab_merge.py)"""
+    found = normalize_lab_entities(table_labs + rag_labs + regex_labs)
+    merged = merge_lab_entities([("table", table_labs), ("regex", regex_labs), ("rag", rag_labs)])
+    lab_extraction_stats["duplicate_labs_dropped"] += len(found) - len(merged)
+    return merged
+
+
+def has_span(entity: Entity) -> bool:
+    """False for entities not located in the text (e.g. table rows whose text layer differs)"""
+    return entity.end > entity.start
+
+
+def _spans_overlap(entity: Entity, spans: List[Tuple[int, int]]) -> bool:
+    return any(s < entity.end and entity.start < e for s, e in spans)
+
+
+def _regex_labs_stage(text: str, table_labs: List[Entity]) -> List[Entity]:
+    """Regex lab extraction; hits inside rows already read from a lab table are dropped"""
+    labs = extract_labs_with_regex(text)
+    if not table_labs:
+        return labs
+    lab_extraction_stats["table_documents"] += 1
+    lab_extraction_stats["table_rows"] += len(table_labs)
+    # Unlocated rows cover no text: they suppress nothing here and explain no lab line
+    located = [l for l in table_labs if has_span(l)]
+    lab_extraction_stats["table_rows_unlocated"] += len(table_labs) - len(located)
+    spans = [(l.start, l.end) for l in located]
+    return [l for l in labs if not _spans_overlap(l, spans)]
+
+
+async def _rag_labs_stage(text: str, regex_labs: List[Entity], table_labs: List[Entity] = (),
+                          lab_batcher: Optional[MicroBatcher] = None) -> List[Entity]:
+    """RAG+LLM lab extraction, skipped when table rows and the regex tier already explain every lab line"""
+    lab_extraction_stats["documents"] += 1
+    hits = [(l.start, l.end) for l in list(table_labs) + regex_labs if has_span(l)]
+    unexplained = await asyncio.to_thread(unexplained_lab_lines, text, hits, lab_kb)
+    lab_extraction_stats["unexplained_lines"] += len(unexplained)
+    if not unexplained:
+        lab_extraction_stats["llm_calls_avoided"] += 1
+        return []
+    lab_extraction_stats["llm_calls"] += 1
+    return await aextract_labs_with_rag(text, unexplained, lab_batcher=lab_batcher)
+
+
+template_summary_count = 0
+
+
+async def _summary_stage(text: str, diseases: List[Entity], lab_results: List[Entity]):
+    global template_summary_count
+    summary_text = await agenerate_summary(text, diseases, lab_results)
+    if summary_text:
+        return {"clinical_summary": summary_text}
+    # LLM failed, was short-circuited or ran out of deadline: template summary instead
+    template_summary_count += 1
+    return {"clinical_summary": build_template_summary(diseases, lab_results), "source": "template"}
+
+
+async def _stream_summary_stage(text: str, diseases: List[Entity], lab_results: List[Entity],
+                                emit: Callable[[str, Any], None]):
+    """
+    Streaming variant of _summary_stage: every chunk is passed to emit("summary", ...).
+    A stream that fails part-way is retracted with "summary_reset" before the template fallback.
+    """
+    global template_summary_count
+    chunks = []
+    try:
+        async for chunk in astream_summary(text, diseases, lab_results):
+            chunks.append(chunk)
+            emit("summary", {"text": chunk})
+    except Exception as e:
+        print(f"[stream_summary] LLM stream failed: {e!r}")
+        if chunks:
+            emit("summary_reset", {})
+            chunks = []
+    summary_text = "".join(chunks).strip()
+    if summary_text:
+        return {"clinical_summary": summary_text}
+    template_summary_count += 1
+    summary_text = build_template_summary(diseases, lab_results)
+    emit("summary", {"text": summary_text})
+    return {"clinical_summary": summary_text, "source": "template"}
+
+
+def build_document_pipeline(icd_map: bool = False, allow_pipeline: bool = False,
+                            with_summary: bool = True, lab_batcher: Optional[MicroBatcher] = None) -> PipelineDAG:
+    """
+    Per-document stage graph: NER, regex labs and RAG labs run in parallel,
+    the summary starts as soon as all three have finished. In tiered mode the
+    RAG stage waits for the (fast) regex stage to decide whether it is needed.
+    Without `with_summary` the graph stops at the entities (deferred summaries).
+    A `lab_batcher` routes LLM lab extraction through the upload's shared batcher.
+    The `table_labs` input (rows read from PDF lab tables, possibly empty) is
+    passed through as is; the other extractors skip what it already covers.
+    """
+    dag = (
+        PipelineDAG()
+        .add("diseases", partial(extract_diseases, icd_map=icd_map, allow_pipeline=allow_pipeline), deps=["text"])
+        .add("regex_labs", _regex_labs_stage, deps=["text", "table_labs"])
+    )
+    if LAB_EXTRACTION_MODE == "tiered":
+        dag.add("rag_labs", partial(_rag_labs_stage, lab_batcher=lab_batcher), deps=["text", "regex_labs", "table_labs"])
+    else:
+        dag.add("rag_labs", partial(aextract_labs_with_rag, lab_batcher=lab_batcher), deps=["text"])
+    dag.add("lab_results", _merge_labs_stage, deps=["table_labs", "rag_labs", "regex_labs"], inline=True)
+    if with_summary:
+        dag.add("summary", _summary_stage, deps=["text", "diseases", "lab_results"])
+    return dag
+
+
+async def analyze_document(text: str, icd_map: bool = False, allow_pipeline: bool = False,
+                           started: Optional[float] = None, with_summary: bool = True,
+                           lab_batcher: Optional[MicroBatcher] = None, table_labs: Optional[List[Entity]] = None):
+    """
+    Disease NER, lab extraction and clinical summary for one document.
+    `table_labs` are lab entities already read from PDF tables (see read_pdf).
+    `lab_batcher` is the batcher shared by the documents of one upload, if any.
+    LLM calls share a deadline of PREDICT_DEADLINE_S counted from `started` (request start).
+    Returns (diseases, lab_results, summary_block, stage_timings_ms); summary_block is
+    None when `with_summary` is False.
+    """
+    budget = None
+    if PREDICT_DEADLINE_S > 0:
+        budget = PREDICT_DEADLINE_S - (time.time() - started if started else 0.0)
+    with request_deadline(budget):
+        dag = build_document_pipeline(icd_map, allow_pipeline, with_summary, lab_batcher)
+        results, timings = await dag.run(text=text, table_labs=table_labs or [])
+    return results["diseases"], results["lab_results"], results.get("summary"), timings
+
+
+def check_summary_mode(summary_mode: str) -> bool:
+    """Validate the requested summary mode; True when the summary should be deferred"""
+    if summary_mode not in SUMMARY_MODES:
+        raise HTTPException(status_code=400, detail=f"summary_mode must be one of {', '.join(SUMMARY_MODES)}")
+    return summary_mode == "deferred"
+
+
+def _store_deferred_summary(job: SummaryJob):
+    """Write a finished background summary into its stored record"""
+    if not job.record_id or records_collection is None:
+        return
+    if job.error is None:
+        update = {"summary": job.summary, "summary_status": "done"}
+    else:
+        update = {"summary_status": "failed", "summary_error": job.error}
+    records_collection.update_one({"_id": ObjectId(job.record_id)}, {"$set": update})
+
+
+def schedule_summary(text: str, diseases: List[Entity], lab_results: List[Entity],
+                     record_id: Optional[str] = None) -> SummaryJob:
+    """Queue the clinical summary of an analysed document; the stored record is updated when it finishes"""
+    async def run():
+        with request_deadline(PREDICT_DEADLINE_S if PREDICT_DEADLINE_S > 0 else None):
+            return await _summary_stage(text, diseases, lab_results)
+    return summary_jobs.submit(run, record_id=record_id, on_done=_store_deferred_summary)
+
+
+# ----------------------------
+# Predict Endpoints
+# ----------------------------
+
+
+@app.post("/predict", response_model=CombinedNERResponse)
+async def predict_combined_rag(req: TextRequest, store: bool = Form(False),
+                               patient_id: Optional[str] = Form(None)):
+    req_start = time.time()
+    text = req.text
+    icd_map = req.icd_map
+    deferred = check_summary_mode(req.summary_mode)
 
-    # Lab extraction via RAG
-    lab_results = extract_labs_with_rag(text) + extract_labs_with_regex(text)
+    diseases, lab_results, summary_block, stage_timings = await analyze_document(
+        text, icd_map, allow_pipeline=True, started=req_start, with_summary=not deferred)
 
     processing_time_ms = int((time.time() - req_start) * 1000)
 
     metadata = {
         "input_source": "text",
         "processing_time_ms": processing_time_ms,
+        "stage_timings_ms": stage_timings,
         "service_start_time_epoch": IMPORT_TIME_EPOCH,
         "service_start_time_iso": IMPORT_TIME_ISO,
     }
 
-    summary_text = generate_summary(text, diseases, lab_results)
-    summary_block = {
-        "clinical_summary": summary_text} if summary_text else None
-
     print(f"{metadata, text, diseases, lab_results, summary_block}")
 
     # STORE RECORD IF REQUESTED
+    record_id = None
     if store and records_collection is not None:
-        store_medical_record(
+        record_id = store_medical_record(
             original_filename="text_input.txt",
             extracted_text=text,
             diseases=diseases,
@@ -1245,169 +1766,271 @@ async def predict_combined_rag(req: TextRequest, store: bool = Form(False),
             summary=summary_block,
             metadata=metadata,
             patient_id=patient_id,
-            source="text_input"
+            source="text_input",
+            summary_status="pending" if deferred else None
         )
 
+    job = schedule_summary(text, diseases, lab_results, record_id) if deferred else None
     return CombinedNERResponse(
         metadata=metadata,
         text=text,
         diseases=diseases,
         lab_results=lab_results,
-        summary=summary_block
+        summary=summary_block,
+        summary_status=job.status if job else None,
+        summary_job_id=job.id if job else None,
+        record_id=record_id
     )
 
 
 @app.post("/predict_pdf", response_model=CombinedNERResponse)
-async def predict_combined_pdf(file: UploadFile = File(...), icd_map: bool = Form(False), store: bool = Form(False), patient_id: Optional[str] = Form(None)):
+async def predict_combined_pdf(file: UploadFile = File(...), icd_map: bool = Form(False), store: bool = Form(False), patient_id: Optional[str] = Form(None),
+                               summary_mode: str = Form("sync")):
     req_start = time.time()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
-    try:
-        text = extract_text_from_pdf(tmp_path)
-        if not text.strip():
-            metadata = {
-                "input_source": "uploaded_pdf",
-                "processing_time_ms": int((time.time() - req_start) * 1000),
-                "service_start_time_epoch": IMPORT_TIME_EPOCH,
-                "service_start_time_iso": IMPORT_TIME_ISO,
-            }
-            return CombinedNERResponse(metadata=metadata, text="", diseases=[], lab_results=[])
-
-        diseases = [Entity(**p, icd_code=normalize_icd(p['text']) if icd_map else None)
-                    for p in predict_with_sliding_window(text, d_tokenizer, d_model, d_label_map, DISEASE_MAX_LEN)]
-        lab_results = extract_labs_with_rag(
-            text) + extract_labs_with_regex(text)
-
-        processing_time_ms = int((time.time() - req_start) * 1000)
-
+    deferred = check_summary_mode(summary_mode)
+    text, table_labs = await read_upload_pdf(file)
+    if not text.strip():
         metadata = {
             "input_source": "uploaded_pdf",
-            "processing_time_ms": processing_time_ms,
+            "processing_time_ms": int((time.time() - req_start) * 1000),
             "service_start_time_epoch": IMPORT_TIME_EPOCH,
             "service_start_time_iso": IMPORT_TIME_ISO,
         }
+        return CombinedNERResponse(metadata=metadata, text="", diseases=[], lab_results=[])
 
-        summary_text = generate_summary(text, diseases, lab_results)
-        summary_block = {
-            "clinical_summary": summary_text} if summary_text else None
-
-        print(f"{metadata, text, diseases, lab_results, summary_block}")
-
-        # STORE RECORD IF REQUESTED
-        if store and records_collection is not None:
-            store_medical_record(
-                original_filename=file.filename,
-                extracted_text=text,
-                diseases=diseases,
-                lab_results=lab_results,
-                summary=summary_block,
-                metadata=metadata,
-                patient_id=patient_id,
-                source="pdf_upload"
-            )
+    diseases, lab_results, summary_block, stage_timings = await analyze_document(
+        text, icd_map, started=req_start, with_summary=not deferred, table_labs=table_labs)
 
-        return CombinedNERResponse(
-            metadata=metadata,
-            text=text,
+    processing_time_ms = int((time.time() - req_start) * 1000)
+
+    metadata = {
+        "input_source": "uploaded_pdf",
+        "processing_time_ms": processing_time_ms,
+        "stage_timings_ms": stage_timings,
+        "service_start_time_epoch": IMPORT_TIME_EPOCH,
+        "service_start_time_iso": IMPORT_TIME_ISO,
+    }
+
+    print(f"{metadata, text, diseases, lab_results, summary_block}")
+
+    # STORE RECORD IF REQUESTED
+    record_id = None
+    if store and records_collection is not None:
+        record_id = store_medical_record(
+            original_filename=file.filename,
+            extracted_text=text,
             diseases=diseases,
             lab_results=lab_results,
-            summary=summary_block
+            summary=summary_block,
+            metadata=metadata,
+            patient_id=patient_id,
+            source="pdf_upload",
+            summary_status="pending" if deferred else None
         )
 
-    finally:
-        os.remove(tmp_path)
+    job = schedule_summary(text, diseases, lab_results, record_id) if deferred else None
+    return CombinedNERResponse(
+        metadata=metadata,
+        text=text,
+        diseases=diseases,
+        lab_results=lab_results,
+        summary=summary_block,
+        summary_status=job.status if job else None,
+        summary_job_id=job.id if job else None,
+        record_id=record_id
+    )
 
 
-# Multi document endpoint
-@app.post("/predict_multiple_pdfs", response_model=List[CombinedNERResponse])
-async def predict_multiple_pdfs(
-    files: List[UploadFile] = File(...), 
-    icd_map: bool = Form(False),
-    store: bool = Form(False),
-    patient_id: Optional[str] = Form(None)
-):
+
+async def stream_document_analysis(text: str, icd_map: bool, allow_pipeline: bool, started: float,
+                                   metadata: Dict[str, Any], store: bool = False,
+                                   store_kwargs: Optional[Dict[str, Any]] = None,
+                                   send_text: bool = False,
+                                   table_labs: Optional[List[Entity]] = None) -> AsyncIterator[str]:
     """
-    Process multiple PDFs in one request.
-    Returns a list of responses, one per document.
+    Server-sent events for one document: "text" first when `send_text` (PDF uploads),
+    "diseases" and "lab_results" as soon as their stage finishes, "summary" chunks
+    while the summary streams, then "done" with the final summary and metadata
+    ("error" if analysis fails).
     """
-    responses = []
-
-    for file in files:
-        req_start = time.time()
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            tmp.write(await file.read())
-            tmp_path = tmp.name
-
-        try:
-            # Extract text from PDF (your existing function)
-            text = extract_text_from_pdf(tmp_path)
-            if not text.strip():
-                responses.append(CombinedNERResponse(
-                    metadata={
-                        "input_source": "uploaded_pdf",
-                        "processing_time_ms": int((time.time() - req_start) * 1000),
-                        "service_start_time_epoch": IMPORT_TIME_EPOCH,
-                        "service_start_time_iso": IMPORT_TIME_ISO,
-                        "original_filename": file.filename
-                    },
-                    text="",
-                    diseases=[],
-                    lab_results=[]
-                ))
-                continue
+    if send_text:
+        yield format_sse("text", {"text": text})
+    if not text.strip():
+        yield format_sse("done", {"metadata": {**metadata, "processing_time_ms": int((time.time() - started) * 1000)},
+                                  "summary": None, "record_id": None})
+        return
 
-            # Disease NER (your existing logic)
-            diseases = [Entity(**p, icd_code=normalize_icd(p['text']) if icd_map else None)
-                        for p in predict_with_sliding_window(text, d_tokenizer, d_model, d_label_map, DISEASE_MAX_LEN)]
+    queue: asyncio.Queue = asyncio.Queue()
 
-            # Lab extraction (your existing logic)
-            lab_results = extract_labs_with_rag(
-                text) + extract_labs_with_regex(text)
+    def emit(event: str, data: Any):
+        queue.put_nowait((event, data))
 
-            processing_time_ms = int((time.time() - req_start) * 1000)
+    def on_stage(name: str, value: Any):
+        if name in ("diseases", "lab_results"):
+            emit(name, {"entities": [e.dict() for e in value],
+                        "elapsed_ms": int((time.time() - started) * 1000)})
 
-            summary_text = generate_summary(text, diseases, lab_results)
-            summary_block = {
-                "clinical_summary": summary_text} if summary_text else None
-
-            responses.append(CombinedNERResponse(
-                metadata={
-                    "input_source": "uploaded_pdf",
-                    "processing_time_ms": processing_time_ms,
-                    "service_start_time_epoch": IMPORT_TIME_EPOCH,
-                    "service_start_time_iso": IMPORT_TIME_ISO,
-                    "original_filename": file.filename
-                },
-                text=text,
-                diseases=diseases,
-                lab_results=lab_results,
-                summary=summary_block
-            ))
-
-            # ADD STORAGE AFTER PROCESSING EACH DOCUMENT (only if store=True)
+    async def produce():
+        try:
+            dag = build_document_pipeline(icd_map, allow_pipeline, with_summary=False)
+            results, timings = await dag.run(on_stage=on_stage, text=text, table_labs=table_labs or [])
+            diseases, lab_results = results["diseases"], results["lab_results"]
+            summary_started = time.perf_counter()
+            summary_block = await _stream_summary_stage(text, diseases, lab_results, emit)
+            timings["summary"] = int((time.perf_counter() - summary_started) * 1000)
+
+            final_metadata = {
+                **metadata,
+                "processing_time_ms": int((time.time() - started) * 1000),
+                "stage_timings_ms": timings,
+                "service_start_time_epoch": IMPORT_TIME_EPOCH,
+                "service_start_time_iso": IMPORT_TIME_ISO,
+            }
+            record_id = None
             if store and records_collection is not None:
-                store_medical_record(
-                    original_filename=file.filename,
+                record_id = store_medical_record(
                     extracted_text=text,
                     diseases=diseases,
                     lab_results=lab_results,
                     summary=summary_block,
-                    metadata={
-                        "input_source": "uploaded_pdf",
-                        "processing_time_ms": processing_time_ms,
-                        "service_start_time_epoch": IMPORT_TIME_EPOCH,
-                        "service_start_time_iso": IMPORT_TIME_ISO,
-                        "original_filename": file.filename
-                    },
-                    patient_id=patient_id,
-                    source="multi_pdf_upload"
+                    metadata=final_metadata,
+                    **(store_kwargs or {})
                 )
-
+            emit("done", {"metadata": final_metadata, "summary": summary_block, "record_id": record_id})
+        except Exception as e:
+            print(f"[stream_document_analysis] failed: {e!r}")
+            emit("error", {"detail": str(e) or type(e).__name__})
         finally:
-            os.remove(tmp_path)
+            queue.put_nowait(None)
+
+    budget = None
+    if PREDICT_DEADLINE_S > 0:
+        budget = PREDICT_DEADLINE_S - (time.time() - started)
+    with request_deadline(budget):
+        producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            yield format_sse(*item)
+    finally:
+        # Client disconnected: stop NER/LLM work for this request
+        if not producer.done():
+            producer.cancel()
+
 
-    return responses
+@app.post("/predict_stream")
+async def predict_stream(req: TextRequest, store: bool = False, patient_id: Optional[str] = None):
+    """Streaming variant of /predict (text/event-stream, see stream_document_analysis)"""
+    events = stream_document_analysis(
+        req.text, req.icd_map, allow_pipeline=True, started=time.time(),
+        metadata={"input_source": "text"}, store=store,
+        store_kwargs={"original_filename": "text_input.txt", "patient_id": patient_id, "source": "text_input"})
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/predict_pdf_stream")
+async def predict_pdf_stream(file: UploadFile = File(...), icd_map: bool = Form(False), store: bool = Form(False),
+                             patient_id: Optional[str] = Form(None)):
+    """Streaming variant of /predict_pdf; text extraction happens before the stream opens"""
+    req_start = time.time()
+    text, table_labs = await read_upload_pdf(file)
+    events = stream_document_analysis(
+        text, icd_map, allow_pipeline=False, started=req_start,
+        metadata={"input_source": "uploaded_pdf", "original_filename": file.filename},
+        store=store,
+        store_kwargs={"original_filename": file.filename, "patient_id": patient_id, "source": "pdf_upload"},
+        send_text=True, table_labs=table_labs)
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+async def process_uploaded_pdf(file: UploadFile, icd_map: bool, store: bool, patient_id: Optional[str],
+                               deferred: bool = False,
+                               lab_batcher: Optional[MicroBatcher] = None) -> CombinedNERResponse:
+    """Process one file of a multi-document upload"""
+    req_start = time.time()
+    text, table_labs = await read_upload_pdf(file)
+    if not text.strip():
+        return CombinedNERResponse(
+            metadata={
+                "input_source": "uploaded_pdf",
+                "processing_time_ms": int((time.time() - req_start) * 1000),
+                "service_start_time_epoch": IMPORT_TIME_EPOCH,
+                "service_start_time_iso": IMPORT_TIME_ISO,
+                "original_filename": file.filename
+            },
+            text="",
+            diseases=[],
+            lab_results=[]
+        )
+
+    diseases, lab_results, summary_block, stage_timings = await analyze_document(
+        text, icd_map, started=req_start, with_summary=not deferred, lab_batcher=lab_batcher,
+        table_labs=table_labs)
+
+    processing_time_ms = int((time.time() - req_start) * 1000)
+    metadata = {
+        "input_source": "uploaded_pdf",
+        "processing_time_ms": processing_time_ms,
+        "stage_timings_ms": stage_timings,
+        "service_start_time_epoch": IMPORT_TIME_EPOCH,
+        "service_start_time_iso": IMPORT_TIME_ISO,
+        "original_filename": file.filename
+    }
+
+    # ADD STORAGE AFTER PROCESSING EACH DOCUMENT (only if store=True)
+    record_id = None
+    if store and records_collection is not None:
+        record_id = store_medical_record(
+            original_filename=file.filename,
+            extracted_text=text,
+            diseases=diseases,
+            lab_results=lab_results,
+            summary=summary_block,
+            metadata=metadata,
+            patient_id=patient_id,
+            source="multi_pdf_upload",
+            summary_status="pending" if deferred else None
+        )
+
+    job = schedule_summary(text, diseases, lab_results, record_id) if deferred else None
+    return CombinedNERResponse(
+        metadata=metadata,
+        text=text,
+        diseases=diseases,
+        lab_results=lab_results,
+        summary=summary_block,
+        summary_status=job.status if job else None,
+        summary_job_id=job.id if job else None,
+        record_id=record_id
+    )
+
+
+
+# Multi document endpoint
+@app.post("/predict_multiple_pdfs", response_model=List[CombinedNERResponse])
+async def predict_multiple_pdfs(
+    files: List[UploadFile] = File(...), 
+    icd_map: bool = Form(False),
+    store: bool = Form(False),
+    patient_id: Optional[str] = Form(None),
+    summary_mode: str = Form("sync")
+):
+    """
+    Process multiple PDFs in one request.
+    Documents are processed concurrently (LLM calls bounded by the gateway).
+    Returns a list of responses, one per document, in upload order.
+    """
+    deferred = check_summary_mode(summary_mode)
+    lab_batcher = new_lab_batcher(time.time()) if LAB_BATCH_ENABLED and len(files) > 1 else None
+    try:
+        responses = await asyncio.gather(
+            *(process_uploaded_pdf(file, icd_map, store, patient_id, deferred, lab_batcher) for file in files))
+    finally:
+        if lab_batcher is not None:
+            record_lab_batcher(lab_batcher)
+    return list(responses)
 
 
 # Cross document summary
@@ -1420,41 +2043,50 @@ async def predict_multiple_pdfs_consolidated(
 ):
     """
     Process multiple PDFs and return a single consolidated summary.
+    Nothing is re-extracted or re-summarised from raw text: the per-document
+    summaries are merged map-reduce style (groups of CONSOLIDATED_GROUP_SIZE,
+    reduced concurrently) and the final merge also sees the diseases and labs
+    deduplicated across documents. Prompt size stays bounded however many
+    files are uploaded.
     """
     # First get individual document responses
-    responses = await predict_multiple_pdfs(files, icd_map, store, patient_id)
+    responses = await predict_multiple_pdfs(files, icd_map, store, patient_id, summary_mode="sync")
 
-    # Combine all entities and texts for consolidated summary
-    all_texts = []
-    all_diseases = []
-    all_labs = []
     filenames = []
+    summary_items = []
+    summary_numbers = []
+    disease_docs = []
+    lab_docs = []
 
     for i, resp in enumerate(responses):
-        all_texts.append(
-            f"[Document {i+1}: {resp.metadata.get('original_filename', f'doc_{i+1}')}]\n{resp.text}")
-        all_diseases.extend(resp.diseases)
-        all_labs.extend(resp.lab_results)
-        filenames.append(resp.metadata.get('original_filename', f'doc_{i+1}'))
-
-    # Generate a consolidated summary
-    consolidated_text = "\n\n---\n\n".join(all_texts)
-
-    consolidated_summary = generate_summary(
-        consolidated_text[:4000],  # Truncate to avoid token limits
-        all_diseases,
-        all_labs
-    )
+        filename = resp.metadata.get('original_filename', f'doc_{i+1}')
+        filenames.append(filename)
+        disease_docs.append((i + 1, resp.diseases))
+        lab_docs.append((i + 1, resp.lab_results))
+        if resp.summary and resp.summary.get("clinical_summary"):
+            summary_items.append((f"Document {i+1}: {filename}", resp.summary["clinical_summary"]))
+            summary_numbers.append(i + 1)
+
+    diseases = aggregate_diseases(disease_docs)
+    labs = aggregate_labs(lab_docs, lab_kb)
+    reduce_group = partial(_reduce_summary_group, findings=format_aggregate(diseases, labs))
+
+    with request_deadline(PREDICT_DEADLINE_S if PREDICT_DEADLINE_S > 0 else None):
+        consolidated_summary, reduce_stats = await reduce_summaries(summary_items, reduce_group, numbers=summary_numbers)
 
     return {
         "metadata": {
             "total_documents": len(responses),
             "filenames": filenames,
-            "total_diseases_found": len(all_diseases),
-            "total_labs_found": len(all_labs),
+            "total_diseases_found": sum(len(r.diseases) for r in responses),
+            "total_labs_found": sum(len(r.lab_results) for r in responses),
+            "unique_diseases": len(diseases),
+            "unique_labs": len(labs),
+            "summary_reduce": reduce_stats,
             "service_start_time_iso": IMPORT_TIME_ISO
         },
         "documents": responses,
+        "aggregated": {"diseases": diseases, "lab_results": labs},
         "consolidated_summary": consolidated_summary
     }
 
@@ -1687,7 +2319,8 @@ async def get_record(record_id: str):
             diseases=diseases,
             lab_results=lab_results,
             summary=summary_obj,
-            metadata=record.get("metadata", {})
+            metadata=record.get("metadata", {}),
+            summary_status=record.get("summary_status")
         )
     except Exception as e:
         print(f"Error fetching record {record_id}: {e}")
@@ -1726,6 +2359,46 @@ async def test_mongo():
         return {"status": "error", "message": str(e)}
 
 
+@app.get("/summary_jobs/{job_id}")
+async def get_summary_job(job_id: str):
+    """Poll a deferred clinical summary"""
+    job = summary_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Summary job not found")
+    return job.as_dict()
+
+
+@app.get("/summary_jobs/{job_id}/events")
+async def stream_summary_job(job_id: str):
+    """Server-sent events for a deferred clinical summary; the last event carries the summary"""
+    job = summary_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Summary job not found")
+    return StreamingResponse(summary_jobs.events(job), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.get("/ml/stats")
+async def get_ml_stats():
+    """LLM gateway, response cache and lab extraction counters"""
+    return {
+        "llm": llm_gateway.stats,
+        "llm_tokens": llm_gateway.token_stats,
+        "llm_cache": llm_cache.stats() if llm_cache is not None else None,
+        "lab_extraction": {"mode": LAB_EXTRACTION_MODE, **lab_extraction_stats},
+        "lab_batching": {
+            "enabled": LAB_BATCH_ENABLED,
+            **lab_batch_stats,
+            "avg_batch_size": round(lab_batch_stats["items"] / lab_batch_stats["batches"], 2)
+            if lab_batch_stats["batches"] else 0.0,
+        },
+        "llm_circuit": llm_breaker.stats(),
+        "template_summaries": template_summary_count,
+        "predict_deadline_s": PREDICT_DEADLINE_S,
+        "summary_jobs": summary_jobs.stats(),
+        "icd_mapping": icd_mapper.stats(),
+    }
+
+
 # ----------------------------
 # Analytics Endpoints
 # ----------------------------
@@ -2135,6 +2808,27 @@ async def analyze_single_record(record_id: str):
         return {"error": str(e)}
 
 
+def lab_value_meets(value, qualifier, operator, threshold):
+    """
+    Whether a lab value satisfies a screening threshold. A bound ("<0.5") only
+    does when every value it allows does: "<0.5" meets "less_than 1" but not
+    "greater_than 0.1", since the reading itself is unknown.
+    """
+    if qualifier == "<":
+        return operator in ("less_than", "less_than_equal") and value <= threshold
+    if qualifier == ">":
+        return operator in ("greater_than", "greater_than_equal") and value >= threshold
+    if operator == "greater_than":
+        return value > threshold
+    if operator == "less_than":
+        return value < threshold
+    if operator == "greater_than_equal":
+        return value >= threshold
+    if operator == "less_than_equal":
+        return value <= threshold
+    return True
+
+
 def run_screening_on_record(record):
     """Run all screening rules on a single record"""
     triggered_rules = []
@@ -2143,27 +2837,26 @@ def run_screening_on_record(record):
 
     # Extract diseases and labs
     diseases = [d.get("text", "").lower() for d in record.get("diseases", [])]
-    labs = {}
+    labs = {}  # lab name -> (numeric value, unit, bound qualifier)
 
     for lab in record.get("lab_results", []):
-        lab_name = lab.get("text", "").lower()
-        lab_value = lab.get("value")
-        if lab_name and lab_value:
-            try:
-                # Try to parse numeric value
-                if isinstance(lab_value, str):
-                    # Extract numbers from string
-                    numbers = re.findall(r'\d+\.?\d*', lab_value)
-                    if numbers:
-                        labs[lab_name] = float(numbers[0])
-                else:
-                    labs[lab_name] = float(lab_value)
-            except:
-                labs[lab_name] = None
+        if "numeric_value" in lab:
+            # Normalized at extraction time (records stored before qualifiers get it from the raw value)
+            name, value, unit = lab.get("canonical_name") or lab.get("text"), lab.get("numeric_value"), lab.get("canonical_unit")
+            qualifier = lab["qualifier"] if "qualifier" in lab else parse_numeric(lab.get("value"))[1]
+        else:
+            # Records stored before lab normalization
+            norm = normalize_lab(lab.get("text"), lab.get("value"), lab.get("unit"), lab_kb)
+            name, value, unit = norm.canonical_name or lab.get("text"), norm.numeric_value, norm.canonical_unit
+            qualifier = norm.qualifier
+        lab_name = (name or "").lower()
+        if lab_name and lab.get("value"):
+            labs[lab_name] = (value, unit, qualifier)
 
     # Check each rule
     for rule in SCREENING_RULES:
         rule_triggered = True
+        current_lab = ""
 
         for condition in rule.get("conditions", []):
             cond_type = condition.get("type")
@@ -2183,6 +2876,7 @@ def run_screening_on_record(record):
 
             elif cond_type == "lab":
                 # Check if lab test is present
+                current_lab = cond_value.lower()
                 lab_found = any(cond_value.lower()
                                 in lab_name for lab_name in labs.keys())
                 if operator == "contains" and not lab_found:
@@ -2193,32 +2887,25 @@ def run_screening_on_record(record):
                     break
 
             elif cond_type == "lab_value":
-                # Check lab value against threshold
-                lab_name = condition.get("lab_name", "").lower()
+                # Check lab value against threshold (defaults to the lab of the preceding "lab" condition)
+                lab_name = (condition.get("lab_name") or current_lab).lower()
                 threshold = float(cond_value)
                 unit = condition.get("unit", "")
 
-                # Find matching lab
-                lab_value = None
-                for lab_key in labs.keys():
+                # Find matching lab, in the unit of the threshold
+                lab_value, lab_qualifier = None, None
+                for lab_key, (value, lab_unit, qualifier) in labs.items():
                     if lab_name in lab_key:
-                        lab_value = labs[lab_key]
+                        if value is not None and unit and lab_unit:
+                            value = convert_value(value, lab_unit, unit, lab_kb.lookup(lab_key))
+                        lab_value, lab_qualifier = value, qualifier
                         break
 
                 if lab_value is None:
                     rule_triggered = False
                     break
 
-                if operator == "greater_than" and not (lab_value > threshold):
-                    rule_triggered = False
-                    break
-                elif operator == "less_than" and not (lab_value < threshold):
-                    rule_triggered = False
-                    break
-                elif operator == "greater_than_equal" and not (lab_value >= threshold):
-                    rule_triggered = False
-                    break
-                elif operator == "less_than_equal" and not (lab_value <= threshold):
+                if not lab_value_meets(lab_value, lab_qualifier, operator, threshold):
                     rule_triggered = False
                     break
 
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.batching import MicroBatcher, split_keyed_batch  # noqa: E402
+
+
+def _batcher(flushed, **kwargs):
+    async def flush(items):
+        flushed.append(list(items))
+        return [item.upper() for item in items]
+    return MicroBatcher(flush, **kwargs)
+
+
+def test_concurrent_items_share_a_batch_and_get_their_own_result():
+    flushed = []
+
+    async def main():
+        batcher = _batcher(flushed, max_items=8, max_wait=0.01)
+        return await asyncio.gather(*(batcher.submit(x) for x in "abc")), batcher.stats()
+
+    results, stats = asyncio.run(main())
+    assert results == ["A", "B", "C"]
+    assert flushed == [["a", "b", "c"]]
+    assert stats == {"batches": 1, "items": 3, "avg_batch_size": 3.0}
+
+
+def test_batches_split_at_max_items_and_max_cost():
+    by_items, by_cost = [], []
+
+    async def main():
+        items = _batcher(by_items, max_items=2, max_wait=0.01)
+        await asyncio.gather(*(items.submit(x) for x in "abcde"))
+        cost = _batcher(by_cost, max_items=10, max_cost=100, max_wait=0.01)
+        await asyncio.gather(cost.submit("a", 60), cost.submit("b", 30), cost.submit("c", 30))
+
+    asyncio.run(main())
+    assert by_items == [["a", "b"], ["c", "d"], ["e"]]
+    # "c" would take the pending cost over 100, so it starts the next batch
+    assert by_cost == [["a", "b"], ["c"]]
+
+
+def test_flush_error_reaches_every_submitter():
+    async def flush(items):
+        raise RuntimeError("down")
+
+    async def main():
+        batcher = MicroBatcher(flush, max_wait=0.01)
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [str(r) for r in results] == ["down", "down"]
+
+
+def test_wrong_result_count_is_an_error():
+    async def flush(items):
+        return items[:1]
+
+    async def main():
+        batcher = MicroBatcher(flush, max_wait=0.01)
+        return await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+
+    assert all(isinstance(r, ValueError) for r in asyncio.run(main()))
+
+
+def _keyed(answer, fallback_calls):
+    async def call():
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def fallback(missing):
+        fallback_calls.append(missing)
+        return [f"single {i}" for i in missing]
+
+    return call, fallback
+
+
+def test_keyed_answer_is_split_per_key():
+    calls = []
+    call, fallback = _keyed({"D1": json.dumps([]), "D2": json.dumps([{"test": "Glucose"}])}, calls)
+    results = asyncio.run(split_keyed_batch(["D1", "D2"], call, fallback))
+    assert results == ["[]", '[{"test": "Glucose"}]']
+    assert calls == []
+
+
+def test_keys_missing_from_the_answer_fall_back_alone():
+    calls = []
+    call, fallback = _keyed({"D2": "[]"}, calls)
+    assert asyncio.run(split_keyed_batch(["D1", "D2", "D3"], call, fallback)) == ["single 0", "[]", "single 2"]
+    assert calls == [[0, 2]]
+
+
+def test_malformed_answer_falls_back_per_document():
+    calls = []
+    call, fallback = _keyed(ValueError("not a JSON object"), calls)
+    assert asyncio.run(split_keyed_batch(["D1", "D2"], call, fallback)) == ["single 0", "single 1"]
+    assert calls == [[0, 1]]
+
+
+def test_reraised_errors_skip_the_fallback():
+    calls = []
+    call, fallback = _keyed(TimeoutError("deadline"), calls)
+    with pytest.raises(TimeoutError):
+        asyncio.run(split_keyed_batch(["D1"], call, fallback, reraise=(TimeoutError,)))
+    assert calls == []
@@ -0,0 +1,86 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml import circuit_breaker  # noqa: E402
+from ml.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, percentile  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def breaker(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", clock)
+    options = dict(window=20, min_calls=10, error_rate_threshold=0.5, p95_latency_threshold_ms=1000, cooldown=30)
+    options.update(kwargs)
+    return CircuitBreaker(**options), clock
+
+
+def test_nearest_rank_percentile():
+    values = list(range(1, 21))
+    assert percentile(values, 95) == 19
+    assert percentile(values, 50) == 10
+    assert percentile(values, 100) == 20
+    assert percentile([7], 95) == 7
+    assert percentile([], 95) is None
+
+
+def test_one_slow_call_in_twenty_does_not_open(monkeypatch):
+    cb, _ = breaker(monkeypatch)
+    for _ in range(19):
+        cb.record_success(100)
+    cb.record_success(60000)
+    assert cb.state == CLOSED
+
+
+def test_error_rate_opens_only_after_min_calls(monkeypatch):
+    cb, _ = breaker(monkeypatch)
+    for _ in range(9):
+        cb.record_failure(100)
+    assert cb.state == CLOSED
+    cb.record_failure(100)
+    assert cb.state == OPEN
+    assert not cb.allow() and cb.rejected == 1
+
+
+def test_half_open_probe_closes_on_success(monkeypatch):
+    cb, clock = breaker(monkeypatch)
+    for _ in range(10):
+        cb.record_failure(100)
+    clock.now += 30
+    assert cb.allow() and cb.state == HALF_OPEN
+    # One probe at a time
+    assert not cb.allow()
+    cb.record_success(100)
+    assert cb.state == CLOSED and cb.stats()["window_calls"] == 0
+    assert cb.allow()
+
+
+def test_half_open_probe_failure_reopens(monkeypatch):
+    cb, clock = breaker(monkeypatch)
+    for _ in range(10):
+        cb.record_success(5000)
+    assert cb.state == OPEN
+    clock.now += 29
+    assert not cb.allow()
+    clock.now += 1
+    assert cb.allow()
+    cb.record_failure(100)
+    assert cb.state == OPEN and cb.times_opened == 2
+
+
+def test_released_probe_can_be_claimed_again(monkeypatch):
+    cb, clock = breaker(monkeypatch)
+    for _ in range(10):
+        cb.record_failure(100)
+    clock.now += 30
+    assert cb.allow()
+    cb.release_probe()
+    assert cb.allow() and cb.state == HALF_OPEN
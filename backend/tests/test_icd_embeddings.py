@@ -0,0 +1,24 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.icd_embeddings import IcdHit, choose_code  # noqa: E402
+
+
+def test_clear_nearest_code_is_used():
+    hits = [IcdHit("I10", "hypertension", 0.91), IcdHit("I10", "high blood pressure", 0.90),
+            IcdHit("I95.9", "hypotension", 0.80)]
+    # Terms of the same code are not a tie
+    assert choose_code(hits, 0.75, 0.03) == "I10"
+
+
+def test_near_tie_between_codes_is_refused():
+    hits = [IcdHit("C34.90", "lung cancer", 0.82), IcdHit("C18.9", "colon cancer", 0.81)]
+    assert choose_code(hits, 0.75, 0.03) is None
+    assert choose_code(hits, 0.75, 0.0) == "C34.90"
+
+
+def test_below_min_similarity_is_refused():
+    assert choose_code([IcdHit("I10", "hypertension", 0.70)], 0.75, 0.03) is None
+    assert choose_code([], 0.75, 0.03) is None
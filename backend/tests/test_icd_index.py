@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.icd_index import ICD_MIN_SCORE, IcdIndex, similarity  # noqa: E402
+
+INDEX = IcdIndex([
+    ("C34.90", "Lung cancer", []),
+    ("C18.9", "Colon cancer", []),
+    ("I50.9", "Heart failure", ["Congestive heart failure"]),
+    ("I11.9", "Hypertensive heart disease without heart failure", []),
+    ("I10", "Hypertension", []),
+])
+
+
+def test_one_word_contained_in_longer_terms_is_not_mapped():
+    assert INDEX.lookup("cancer") is None
+
+
+def test_negated_words_do_not_count_for_containment():
+    assert similarity("heart failure", "hypertensive heart disease without heart failure") < ICD_MIN_SCORE
+    assert INDEX.lookup("failure of heart") == "I50.9"
+
+
+def test_exact_and_close_misspellings_still_map():
+    assert INDEX.lookup("Heart Failure") == "I50.9"
+    assert INDEX.lookup("hypertensoin") == "I10"
+    assert INDEX.lookup("lung cancr") == "C34.90"
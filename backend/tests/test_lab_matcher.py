@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.lab_kb import get_lab_kb  # noqa: E402
+from ml.lab_matcher import LabNameMatcher  # noqa: E402
+from ml.lab_regex import extract_lab_matches  # noqa: E402
+
+KB = get_lab_kb()
+
+
+def _hits(matcher, text):
+    return [(hit.alias, text[hit.start:hit.end]) for hit in matcher.find_all(text)]
+
+
+def test_only_whole_words_match():
+    matcher = LabNameMatcher(["na", "alt"])
+    assert _hits(matcher, "Sodium (Na) 140, salt 5, ALT 30, naive") == [("na", "Na"), ("alt", "ALT")]
+
+
+def test_longest_name_first_at_each_offset():
+    matcher = LabNameMatcher(["cholesterol", "ldl cholesterol", "ldl"])
+    assert _hits(matcher, "LDL Cholesterol 130") == [
+        ("ldl cholesterol", "LDL Cholesterol"), ("ldl", "LDL"), ("cholesterol", "Cholesterol")]
+
+
+def test_case_and_spaces_fold_but_names_do_not_span_lines():
+    matcher = LabNameMatcher(["vitamin d"])
+    assert _hits(matcher, "VITAMIN \t D 30") == [("vitamin d", "VITAMIN \t D")]
+    assert _hits(matcher, "Vitamin\nD 30") == []
+
+
+def test_kb_synonyms_are_found():
+    text = "Hb 13.5 g/dL, Na 140 mEq/L, Cl 101, Ca 9.4 mg/dL, PT 12.1, CK 150 U/L, TG 180 mg/dL"
+    found = {hit.alias for hit in KB.name_matcher().find_all(text)}
+    assert {"hb", "na", "cl", "ca", "pt", "ck", "tg"} <= found
+
+
+def test_short_synonyms_survive_false_positive_rules():
+    labs = extract_lab_matches("Hb: 13.5 g/dL\nNa: 140 mEq/L\n", KB)
+    assert [(lab.name, lab.value, lab.unit, lab.known) for lab in labs] == [
+        ("Hb", "13.5", "g/dL", True), ("Na", "140", "mEq/L", True)]
@@ -0,0 +1,34 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.lab_merge import merge_lab_entities  # noqa: E402
+
+
+def lab(text, value, start, end, confidence=0.9, page_span=None):
+    return SimpleNamespace(text=text, value=value, start=start, end=end, confidence=confidence,
+                           canonical_name=text, numeric_value=float(value), page_span=page_span)
+
+
+def test_repeated_readings_stay_apart():
+    first, second = lab("Glucose", "95", 0, 12), lab("Glucose", "95", 500, 512)
+    merged = merge_lab_entities([("regex", [first, second])])
+    assert [(m.start, m.sources) for m in merged] == [(0, ["regex"]), (500, ["regex"])]
+
+
+def test_overlapping_hits_merge_across_extractors():
+    regex, rag = lab("LDL Cholesterol", "130", 100, 120, 0.85), lab("Cholesterol", "130", 104, 120, 0.95)
+    merged = merge_lab_entities([("regex", [regex]), ("rag", [rag])])
+    assert merged == [rag]
+    assert rag.sources == ["rag", "regex"]
+
+
+def test_unlocated_table_row_joins_the_reading_on_its_page():
+    page1, page3 = lab("Glucose", "95", 10, 22), lab("Glucose", "95", 900, 912)
+    row = lab("Glucose", "95", 0, 0, 0.98, page_span=(800, 1200))
+    merged = merge_lab_entities([("table", [row]), ("regex", [page1, page3])])
+    assert [m.start for m in merged] == [10, 0]
+    assert merged[1] is row and row.sources == ["table", "regex"]
+    assert page1.sources == ["regex"]
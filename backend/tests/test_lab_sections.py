@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.lab_kb import get_lab_kb  # noqa: E402
+from ml.lab_sections import find_lab_lines, unexplained_lab_lines, value_positions  # noqa: E402
+
+KB = get_lab_kb()
+
+
+def test_ranges_bounds_dates_and_times_are_not_values():
+    assert value_positions("Reference 70-100, collected 2024-03-05 at 08:30, <0.5") == []
+    assert value_positions("Glucose 95 mg/dL (70-100)") == [8]
+
+
+def test_lines_without_a_value_or_lab_hint_are_skipped():
+    text = "Collected 03/05/2024 08:30\nGlucose 95 mg/dL\nPatient seen in clinic 2 days\n"
+    assert [text[s:e] for s, e in find_lab_lines(text, KB)] == ["Glucose 95 mg/dL"]
+
+
+def test_line_is_unexplained_until_every_value_is_covered():
+    text = "Glucose 95 mg/dL\nSodium 140 mmol/L Potassium 4.1 mmol/L\n"
+    lines = find_lab_lines(text, KB)
+    glucose = (0, 16)
+    sodium = (text.index("Sodium"), text.index("Sodium") + 10)
+    potassium = (text.index("Potassium"), text.index("Potassium") + 13)
+    assert unexplained_lab_lines(text, [], KB, lines) == lines
+    assert unexplained_lab_lines(text, [glucose, sodium], KB, lines) == [lines[1]]
+    assert unexplained_lab_lines(text, [glucose, sodium, potassium], KB, lines) == []
+
+
+def test_reference_range_alone_does_not_leave_a_line_unexplained():
+    text = "Hemoglobin 13.5 g/dL 12.0-16.0 on 2024-03-05\n"
+    lines = find_lab_lines(text, KB)
+    assert unexplained_lab_lines(text, [(0, 15)], KB, lines) == []
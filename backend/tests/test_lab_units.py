@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.lab_kb import get_lab_kb  # noqa: E402
+from ml.lab_regex import extract_lab_matches, is_valid_lab_result  # noqa: E402
+from ml.lab_units import convert_value, normalize_lab, normalize_unit, parse_numeric  # noqa: E402
+
+KB = get_lab_kb()
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("1,234", (1234.0, None)),
+    ("1,250.5", (1250.5, None)),
+    ("5,6", (5.6, None)),
+    ("7.2 H", (7.2, None)),
+    ("<0.5", (0.5, "<")),
+    ("> 1000", (1000.0, ">")),
+    ("≤5", (5.0, "<")),
+    ("1.2.3", (None, None)),
+    ("positive", (None, None)),
+    (None, (None, None)),
+])
+def test_parse_numeric(raw, expected):
+    assert parse_numeric(raw) == expected
+
+
+def test_unit_spellings_are_canonical():
+    assert normalize_unit(" mg/dl ") == "mg/dL"
+    assert normalize_unit("x10^9/L") == "10^3/uL"
+    assert normalize_unit("") is None
+
+
+def test_per_test_and_generic_conversions():
+    glucose, hba1c = KB.lookup("Glucose"), KB.lookup("HbA1c")
+    assert convert_value(5.5, "mmol/L", "mg/dL", glucose) == pytest.approx(99.088)
+    assert convert_value(99.088, "mg/dL", "mmol/L", glucose) == pytest.approx(5.5)
+    assert convert_value(48, "mmol/mol", "%", hba1c) == pytest.approx(6.542)
+    assert convert_value(135, "g/L", "g/dL") == pytest.approx(13.5)
+    assert convert_value(1.35, "g/dL", "g/L") == pytest.approx(13.5)
+    assert convert_value(5.5, "mmol/L", "mg/dL") is None
+
+
+def test_normalize_lab_converts_and_flags():
+    glucose = normalize_lab("glucose", "7.8", "mmol/l", KB)
+    assert (glucose.canonical_name, glucose.canonical_unit, glucose.flag) == ("Glucose", "mg/dL", "high")
+    assert glucose.numeric_value == pytest.approx(140.5248)
+    assert normalize_lab("Hemoglobin", "135", "g/L", KB)[1:4] == (13.5, "g/dL", "normal")
+    assert normalize_lab("Sodium", "130", "mmol/L", KB).flag == "low"
+    assert normalize_lab("Platelets", "1,250", "10^3/uL", KB)[1:4] == (1250.0, "10^3/uL", "high")
+
+
+def test_unconvertible_units_and_bounds_are_not_flagged():
+    assert normalize_lab("Glucose", "95", "furlongs", KB)[1:4] == (95.0, "furlongs", None)
+    bound = normalize_lab("Creatinine", "<0.5", "mg/dL", KB)
+    assert (bound.numeric_value, bound.flag, bound.qualifier) == (0.5, None, "<")
+
+
+def test_separator_values_pass_validation():
+    assert is_valid_lab_result("Platelets", "1,250", KB)
+    assert is_valid_lab_result("Glucose", "5,6", KB)
+    assert not is_valid_lab_result("Glucose", "high", KB)
+    labs = extract_lab_matches("Platelets: 1,250 10^3\nGlucose: 5,6 mmol/L\n", KB)
+    assert [(lab.name, lab.value) for lab in labs] == [("Platelets", "1,250"), ("Glucose", "5,6")]
@@ -0,0 +1,95 @@
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.pipeline import PipelineDAG  # noqa: E402
+
+
+def test_stages_get_dependency_outputs_in_order():
+    order = []
+
+    def upper(text):
+        order.append("upper")
+        return text.upper()
+
+    async def words(upper):
+        order.append("words")
+        return upper.split()
+
+    def count(words, upper):
+        order.append("count")
+        return len(words), len(upper)
+
+    dag = PipelineDAG().add("count", count, deps=["words", "upper"]).add("words", words, deps=["upper"])
+    dag.add("upper", upper, deps=["text"])
+    seen = []
+    results, timings = asyncio.run(dag.run(on_stage=lambda name, value: seen.append(name), text="a b c"))
+    assert results["count"] == (3, 5)
+    assert order == ["upper", "words", "count"] == seen
+    assert set(timings) == {"upper", "words", "count"}
+
+
+def test_independent_stages_run_concurrently():
+    async def main():
+        both = asyncio.Event()
+        arrived = []
+
+        async def a():
+            arrived.append("a")
+            if len(arrived) == 2:
+                both.set()
+            # Only finishes if "b" starts while "a" is waiting
+            await asyncio.wait_for(both.wait(), 1)
+            return "a"
+
+        async def b():
+            arrived.append("b")
+            if len(arrived) == 2:
+                both.set()
+            await asyncio.wait_for(both.wait(), 1)
+            return "b"
+
+        return await PipelineDAG().add("a", a).add("b", b).run()
+
+    results, _ = asyncio.run(main())
+    assert (results["a"], results["b"]) == ("a", "b")
+
+
+def test_plain_functions_run_in_a_thread_unless_inline():
+    loop_thread = threading.get_ident()
+    dag = PipelineDAG()
+    dag.add("threaded", lambda: threading.get_ident())
+    dag.add("inline", lambda: threading.get_ident(), inline=True)
+    results, _ = asyncio.run(dag.run())
+    assert results["threaded"] != loop_thread
+    assert results["inline"] == loop_thread
+
+
+def test_stage_error_propagates_and_skips_dependents():
+    ran = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    dag = PipelineDAG().add("fail", fail).add("after", lambda fail: ran.append(fail), deps=["fail"])
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(dag.run())
+    assert ran == []
+
+
+def test_unknown_dependency_and_cycle_are_rejected():
+    with pytest.raises(ValueError, match="unknown"):
+        asyncio.run(PipelineDAG().add("a", lambda missing: 1, deps=["missing"]).run())
+    dag = PipelineDAG().add("a", lambda b: 1, deps=["b"]).add("b", lambda a: 1, deps=["a"])
+    with pytest.raises(ValueError, match="Cycle"):
+        asyncio.run(dag.run())
+
+
+def test_duplicate_stage_is_rejected():
+    with pytest.raises(ValueError, match="already defined"):
+        PipelineDAG().add("a", len).add("a", len)
@@ -0,0 +1,33 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml.summarize import document_range_label, reduce_summaries  # noqa: E402
+
+
+def test_range_label_skips_missing_documents():
+    assert document_range_label([1, 2, 3, 5]) == "Documents 1-3, 5"
+    assert document_range_label([4, 6]) == "Documents 4, 6"
+
+
+def test_merged_labels_use_original_document_numbers():
+    labels = []
+
+    async def reduce_group(group, final):
+        labels.append(([label for label, _ in group], final))
+        return f"merged {len(group)}."
+
+    # Document 3 failed and document 4 has no summary
+    numbers = [1, 2, 4, 5, 6, 7]
+    items = [(f"Document {n}: d{n}.pdf", "" if n == 4 else f"Summary {n}.") for n in numbers]
+    summary, stats = asyncio.run(reduce_summaries(items, reduce_group, group_size=2, numbers=numbers))
+    assert summary == "merged 2."
+    assert labels == [
+        (["Document 1: d1.pdf", "Document 2: d2.pdf"], False),
+        (["Document 5: d5.pdf", "Document 6: d6.pdf"], False),
+        (["Documents 1-2", "Documents 5-6"], False),
+        (["Documents 1-2, 5-6", "Document 7: d7.pdf"], True),
+    ]
+    assert stats == {"levels": 3, "reduce_calls": 4, "reduce_failures": 0}
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ml import summary_jobs  # noqa: E402
+from ml.summary_jobs import DONE, FAILED, SummaryJobManager  # noqa: E402
+
+
+async def _result(value):
+    return value
+
+
+async def _fail():
+    raise RuntimeError("no summary")
+
+
+async def _wait_finished(*jobs):
+    while not all(job.finished for job in jobs):
+        await asyncio.sleep(0)
+
+
+def test_jobs_finish_with_summary_or_error():
+    async def main():
+        manager = SummaryJobManager(workers=1)
+        ok = manager.submit(lambda: _result({"clinical_summary": "x"}))
+        bad = manager.submit(_fail)
+        await _wait_finished(ok, bad)
+        return manager, ok, bad
+
+    manager, ok, bad = asyncio.run(main())
+    assert (ok.status, ok.summary) == (DONE, {"clinical_summary": "x"})
+    assert (bad.status, bad.error) == (FAILED, "no summary")
+    assert manager.stats()["completed"] == 1 and manager.stats()["failed"] == 1
+
+
+def test_retention_evicts_finished_jobs_behind_an_unfinished_one():
+    async def main():
+        manager = SummaryJobManager(workers=2, retention=3)
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return {}
+
+        blocked = manager.submit(slow)
+        quick = [manager.submit(lambda: _result({})) for _ in range(3)]
+        await _wait_finished(*quick)
+        latest = manager.submit(lambda: _result({}))
+        kept = [job for job in [blocked, *quick, latest] if manager.get(job.id)]
+        release.set()
+        await _wait_finished(blocked, latest)
+        return kept, blocked, quick, latest
+
+    kept, blocked, quick, latest = asyncio.run(main())
+    # The oldest job is still running: it is kept, and the oldest finished ones go instead
+    assert kept == [blocked, quick[2], latest]
+
+
+def test_finished_jobs_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(summary_jobs.time, "time", lambda: now[0])
+
+    async def main():
+        manager = SummaryJobManager(workers=1, retention=100, ttl=60)
+        old = manager.submit(lambda: _result({}))
+        await _wait_finished(old)
+        now[0] += 61
+        new = manager.submit(lambda: _result({}))
+        await _wait_finished(new)
+        return manager, old, new
+
+    manager, old, new = asyncio.run(main())
+    assert manager.get(old.id) is None
+    assert manager.get(new.id) is new
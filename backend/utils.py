@@ -1,24 +1,185 @@
+import io
+import math
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Any, Callable, List, NamedTuple, Optional
+
 import pdfplumber
-from fuzzywuzzy import process
 
-# Example ICD mapping (extend as needed)
-ICD_DICT = {
-    "diabetes mellitus": "E11",
-    "hypertension": "I10",
-    "asthma": "J45",
-}
+from ml.icd_index import get_icd_mapper
+
+# PDFs with at least this many pages are split across worker processes
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Pages read per document (0 = all) and wall-clock seconds per document (0 = no limit)
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "500"))
+PDF_EXTRACT_TIMEOUT = float(os.getenv("PDF_EXTRACT_TIMEOUT", "120"))
+
+
+class PdfPages(NamedTuple):
+    text: str  # page texts, each followed by "\n"
+    page_offsets: List[int]  # start of each page in `text`
+    page_results: List[Any]  # page_fn(page_number, page) per page, None without page_fn
+    page_count: int  # pages in the document
+    truncated: bool  # not every page was read (page limit or timeout)
+
+    def page_span(self, page_number: int):
+        """(start, end) of a page (1-based) in `text`"""
+        start = self.page_offsets[page_number - 1]
+        end = self.page_offsets[page_number] if page_number < len(self.page_offsets) else len(self.text)
+        return start, end
+
+
+def _open_pdf(source):
+    """pdfplumber PDF from a path, PDF bytes or a seekable binary file object (left open on close)"""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    elif hasattr(source, "seek"):
+        source.seek(0)
+    return pdfplumber.open(source)
+
+
+def _read_pages(pdf, start, stop, page_fn=None, deadline=None):
+    """[(text, page_fn result)] for pages[start:stop], ending early at `deadline` (time.time())"""
+    pages = []
+    for index in range(start, stop):
+        if deadline is not None and time.time() > deadline:
+            break
+        page = pdf.pages[index]
+        # extract_text() returns None for pages without a text layer
+        text = page.extract_text() or ""
+        pages.append((text, page_fn(index + 1, page) if page_fn is not None else None))
+        page.close()
+    return pages
+
+
+def _extract_page_range(source, start, stop, page_fn=None, deadline=None):
+    with _open_pdf(source) as pdf:
+        return _read_pages(pdf, start, stop, page_fn, deadline)
+
+
+@lru_cache(maxsize=None)
+def _pdf_pool(workers: int) -> ProcessPoolExecutor:
+    # spawn: forking a process that runs model and event loop threads is not safe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+@contextmanager
+def _worker_path(source):
+    """
+    A path PDF worker processes can open for `source`: a path as is, the file an
+    upload spool already rolled over to, or else a temporary copy deleted on exit
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield source
+        return
+    # SpooledTemporaryFile.name: a path, the descriptor of an anonymous file once rolled over, or None
+    name = getattr(source, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        yield name
+        return
+    if isinstance(name, int) and os.path.isdir(f"/proc/{os.getpid()}/fd"):
+        # An unlinked file is still reachable through this process's descriptor table
+        yield f"/proc/{os.getpid()}/fd/{name}"
+        return
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        if isinstance(source, (bytes, bytearray)):
+            tmp.write(source)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, tmp)
+        tmp.flush()
+        yield tmp.name
+
+
+def _extract_parallel(source, page_total, page_fn, deadline, workers):
+    # Tasks get a path: the PDF is never pickled into each page range
+    with _worker_path(source) as path:
+        return _extract_page_ranges(path, page_total, page_fn, deadline, workers)
+
+
+def _extract_page_ranges(path, page_total, page_fn, deadline, workers):
+    # Two page ranges per worker evens out pages that are slower to parse
+    chunk = max(4, math.ceil(page_total / (workers * 2)))
+    ranges = [(start, min(start + chunk, page_total)) for start in range(0, page_total, chunk)]
+    futures = [_pdf_pool(workers).submit(_extract_page_range, path, start, stop, page_fn, deadline)
+               for start, stop in ranges]
+    done, _ = wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.time()) + 1.0,
+                   return_when=FIRST_EXCEPTION)
+    pages = []
+    for (start, stop), future in zip(ranges, futures):
+        if future not in done:
+            future.cancel()
+            break
+        chunk_pages = future.result()
+        pages.extend(chunk_pages)
+        if len(chunk_pages) < stop - start:
+            break
+    for future in futures:
+        future.cancel()
+    return pages
+
+
+def extract_pdf_pages(source, page_fn: Optional[Callable[[int, Any], Any]] = None,
+                      max_pages: int = PDF_MAX_PAGES, timeout: float = PDF_EXTRACT_TIMEOUT,
+                      workers: int = PDF_WORKERS) -> PdfPages:
+    """
+    Text of every page (up to `max_pages`) of a PDF path, bytes or binary file
+    object (e.g. a spooled upload), with per-page offsets, and optionally
+    `page_fn(page_number, page)` for each page while the PDF is open. PDFs of
+    PDF_PARALLEL_MIN_PAGES pages or more are split into page ranges extracted in
+    a process pool whose workers open the PDF by path (see _worker_path); `page_fn`
+    must then be a module-level function with a picklable result. Reading stops at `timeout` seconds, keeping the pages read
+    up to the first missing one.
+    """
+    deadline = time.time() + timeout if timeout else None
+    pages = None
+    with _open_pdf(source) as pdf:
+        page_count = len(pdf.pages)
+        page_total = min(page_count, max_pages) if max_pages else page_count
+        if workers > 1 and page_total >= PDF_PARALLEL_MIN_PAGES:
+            try:
+                pages = _extract_parallel(source, page_total, page_fn, deadline, workers)
+            except BrokenProcessPool as e:
+                print(f"⚠️ PDF worker pool failed, extracting sequentially: {e}")
+                _pdf_pool(workers).shutdown(wait=False, cancel_futures=True)
+                _pdf_pool.cache_clear()
+        if pages is None:
+            pages = _read_pages(pdf, 0, page_total, page_fn, deadline)
+    if len(pages) < page_count:
+        print(f"⚠️ Read {len(pages)} of {page_count} PDF pages "
+              f"({'timeout' if len(pages) < page_total else 'page limit'})")
+
+    offsets, position = [], 0
+    for text, _ in pages:
+        offsets.append(position)
+        position += len(text) + 1
+    return PdfPages(
+        text="".join(f"{text}\n" for text, _ in pages),
+        page_offsets=offsets,
+        page_results=[result for _, result in pages],
+        page_count=page_count,
+        truncated=len(pages) < page_count,
+    )
+
+
+def extract_text_from_pdf(source):
+    """Text of every page, each followed by a newline"""
+    return extract_pdf_pages(source).text
 
 
-def extract_text_from_pdf(file_path):
-    text = ""
-    with pdfplumber.open(file_path) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-    return text
+def normalize_icd(disease_name):
+    """ICD-10 code for a disease name via the indexed ICD dictionary (ml/icd_index.py), None if no good match"""
+    return get_icd_mapper().map_one(disease_name)
 
 
-def normalize_icd(disease_name, icd_dict=ICD_DICT):
-    match, score = process.extractOne(disease_name.lower(), icd_dict.keys())
-    if score > 80:
-        return icd_dict[match]
-    return None
+def normalize_icd_batch(disease_names):
+    """{name: ICD-10 code or None} for all names of a request, each distinct name resolved once"""
+    return get_icd_mapper().map_many(disease_names)
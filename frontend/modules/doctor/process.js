@@ -366,6 +366,68 @@ viewFullHighlightBtn.addEventListener("click", () => {
   showModal("Highlighted text (full)", highlightOutput.innerHTML, true);
 });
 
+// Parse a text/event-stream response body, calling onEvent(event, data) per message
+async function readEventStream(resp, onEvent) {
+  const reader = resp.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+      let event = "message";
+      const dataLines = [];
+      for (const line of block.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) dataLines.push(line.slice(5).trim());
+      }
+      if (dataLines.length) onEvent(event, JSON.parse(dataLines.join("\n")));
+    }
+  }
+}
+
+// Streaming predict: entities are shown as soon as they are ready, the summary token by token
+async function streamPrediction(url, options, sourceText) {
+  const resp = await fetch(url, options);
+  if (!resp.ok) {
+    const txt = await resp.text();
+    alert("Server error: " + txt);
+    return;
+  }
+
+  const state = { text: sourceText || "", diseases: [], lab_results: [], metadata: {} };
+  let summaryText = "";
+  const render = () => {
+    displayResultsFromResponse({ ...state, summary: " " });
+    summaryOutput.textContent = summaryText || "Generating summary…";
+  };
+  summaryOutput.textContent = "Analyzing…";
+
+  await readEventStream(resp, (event, data) => {
+    if (event === "text") {
+      state.text = data.text;
+    } else if (event === "diseases" || event === "lab_results") {
+      state[event] = data.entities;
+      render();
+    } else if (event === "summary") {
+      summaryText += data.text;
+      summaryOutput.textContent = summaryText;
+    } else if (event === "summary_reset") {
+      summaryText = "";
+    } else if (event === "done") {
+      state.metadata = data.metadata || {};
+      if (data.summary) summaryText = data.summary.clinical_summary || summaryText;
+      render();
+    } else if (event === "error") {
+      alert("Server error: " + data.detail);
+    }
+  });
+}
+
 // submit handler (fetches and displays summary as part of response)
 // Replace the existing submitBtn event listener with this:
 
@@ -412,45 +474,33 @@ submitBtn.addEventListener("click", async () => {
         alert("Error: " + err);
       }
     } else {
-      // Single file - use existing endpoint
+      // Single file - streaming endpoint
       const formData = new FormData();
       formData.append("file", files[0]);
       formData.append("icd_map", false);
 
       try {
-        const resp = await fetch("http://localhost:8000/predict_pdf", {
+        await streamPrediction("http://localhost:8000/predict_pdf_stream", {
           method: "POST",
           body: formData,
         });
-
-        if (!resp.ok) {
-          const txt = await resp.text();
-          alert("Server error: " + txt);
-          return;
-        }
-
-        const data = await resp.json();
-        displayResultsFromResponse(data);
       } catch (err) {
         alert("Error: " + err);
       }
     }
   } else if (textInput.value.trim() !== "") {
-    // Text input - use existing endpoint
+    // Text input - streaming endpoint
     const payload = { text: textInput.value, icd_map: false };
     try {
-      const resp = await fetch("http://localhost:8000/predict", {
-        method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify(payload),
-      });
-      if (!resp.ok) {
-        const txt = await resp.text();
-        alert("Server error: " + txt);
-        return;
-      }
-      const data = await resp.json();
-      displayResultsFromResponse(data);
+      await streamPrediction(
+        "http://localhost:8000/predict_stream",
+        {
+          method: "POST",
+          headers: { "Content-Type": "application/json" },
+          body: JSON.stringify(payload),
+        },
+        textInput.value
+      );
     } catch (err) {
       alert("Error: " + err);
     }